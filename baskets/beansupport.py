@@ -53,10 +53,10 @@ def read_regular_portfolio(filename: str):
 
 def read_exported_portfolio(filename: str, ignore_options: bool = False) -> table.Table:
     """Load a file in beancount.projects.export format."""
-    tbl = table.read_csv(filename)
+    plan = table.read_csv(filename).lazy()
     if ignore_options:
-        tbl = tbl.filter(lambda row: row.assetcls != 'Options')
-    tbl = (tbl
+        plan = plan.filter(lambda row: row.assetcls != 'Options')
+    tbl = (plan
            .select(['account_abbrev', 'currency', 'cost_currency', 'export',
                     'number', 'issuer',
                     'price_file', 'rate_file'])
@@ -70,6 +70,7 @@ def read_exported_portfolio(filename: str, ignore_options: bool = False) -> tabl
            .filter(lambda row: bool(row.ticker))
            .create('price', lambda row: row.price_file * row.rate_file)
            .delete(['price_file', 'rate_file'])
+           .collect()
            .group(('ticker', 'account', 'issuer', 'price'), 'quantity', sum)
            .order(lambda row: (row.ticker, row.issuer, row.account, row.price))
            .checkall(['ticker', 'account', 'issuer', 'price', 'quantity']))
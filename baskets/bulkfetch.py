@@ -0,0 +1,103 @@
+"""Concurrent bulk downloads of files over plain HTTP.
+
+This runs many downloads at once on an asyncio event loop, under a global limit
+and a per-host limit on the number of requests in flight. The transfers
+themselves go through a shared httpfetch.Fetcher (pooled session, conditional
+requests, streaming writes) on a thread pool of the size of the global limit.
+Transient failures are retried with exponential backoff.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Dict, List, NamedTuple
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import time
+import urllib.parse
+
+import requests
+
+from baskets import httpfetch
+from baskets import scheduler
+
+
+Download = NamedTuple('Download', [
+    ('key', str),               # Key of the download, e.g. the ticker.
+    ('url', str),               # URL to fetch.
+    ('outdir', str),            # Directory to write the file to.
+    ('default_filename', str),  # Filename if the response does not provide one.
+])
+
+
+def is_transient(exc: Exception) -> bool:
+    """Return true if a failed download is worth retrying."""
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else None
+        return status is None or status == 429 or status >= 500
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+class _Limits:
+    """Semaphores for the global and per-host limits. The host semaphores are
+    created on demand."""
+
+    def __init__(self, limit: int, host_limit: int):
+        self.limit = asyncio.Semaphore(limit)
+        self.host_limit = host_limit
+        self.hosts = {}  # type: Dict[str, asyncio.Semaphore]
+
+    def host(self, url: str) -> asyncio.Semaphore:
+        netloc = urllib.parse.urlparse(url).netloc
+        if netloc not in self.hosts:
+            self.hosts[netloc] = asyncio.Semaphore(self.host_limit)
+        return self.hosts[netloc]
+
+
+async def _fetch(fetcher: httpfetch.Fetcher, download: Download, limits: _Limits,
+                 executor: concurrent.futures.Executor,
+                 attempts: int, delay: float, max_delay: float) -> scheduler.Result:
+    """Fetch a single file, retrying on transient errors."""
+    loop = asyncio.get_running_loop()
+    job = scheduler.Job(download.key, urllib.parse.urlparse(download.url).netloc)
+    start = time.time()
+    for attempt in range(1, attempts + 1):
+        try:
+            async with limits.host(download.url), limits.limit:
+                fetched = await loop.run_in_executor(executor, functools.partial(
+                    fetcher.fetch, download.url, download.outdir,
+                    download.default_filename))
+            return scheduler.Result(job, fetched, None, time.time() - start)
+        except Exception as exc:  # pylint: disable=broad-except
+            if attempt == attempts or not is_transient(exc):
+                logging.error("Error fetching %s: %s", download.key, exc)
+                return scheduler.Result(job, None, exc, time.time() - start)
+            wait = min(delay * 2 ** (attempt - 1), max_delay)
+            logging.info("Retrying %s in %.1f secs (attempt %d/%d)",
+                         download.key, wait, attempt, attempts)
+            await asyncio.sleep(wait)
+
+
+async def _fetch_all(fetcher, downloads, limit, host_limit, attempts, delay, max_delay):
+    limits = _Limits(limit, host_limit)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=limit) as executor:
+        return await asyncio.gather(*[
+            _fetch(fetcher, download, limits, executor, attempts, delay, max_delay)
+            for download in downloads])
+
+
+def fetch_all(fetcher: httpfetch.Fetcher, downloads: List[Download],
+              limit: int = 64, host_limit: int = 8, attempts: int = 4,
+              delay: float = 1.0, max_delay: float = 30.0) -> List[scheduler.Result]:
+    """Fetch all the downloads concurrently and return their results, in order.
+    The value of a successful result is an httpfetch.Fetched instance. Errors
+    are logged and stored in the results."""
+    start = time.time()
+    results = asyncio.run(_fetch_all(fetcher, downloads, limit, host_limit,
+                                     attempts, delay, max_delay))
+    counts = collections.Counter(result.error is None for result in results)
+    logging.info("Fetched %d files over HTTP in %.1f secs (%d failed)",
+                 counts[True], time.time() - start, counts[False])
+    return results
@@ -0,0 +1,89 @@
+"""Unit tests for concurrent bulk downloads.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import collections
+import http.server
+import tempfile
+import threading
+import time
+
+import pytest
+
+from baskets import bulkfetch
+from baskets import httpfetch
+
+
+# pylint: disable=missing-docstring
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """Serve small CSV files slowly, failing the first request for each 'flaky'
+    file and always failing for 'missing' files."""
+
+    lock = threading.Lock()
+    hits = collections.Counter()
+    running = 0
+    maxrunning = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.hits[self.path] += 1
+            hits = cls.hits[self.path]
+            cls.running += 1
+            cls.maxrunning = max(cls.maxrunning, cls.running)
+        try:
+            time.sleep(0.05)
+            if self.path.startswith('/missing'):
+                self.send_error(404)
+            elif self.path.startswith('/flaky') and hits == 1:
+                self.send_error(503)
+            else:
+                body = 'ticker,fraction\n{},1.0\n'.format(self.path).encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.running -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_all(server):
+    names = ['ok{}'.format(index) for index in range(10)] + ['flaky', 'missing']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        downloads = [bulkfetch.Download(name, '{}/{}'.format(server, name),
+                                        path.join(tmpdir, name), '{}.csv'.format(name))
+                     for name in names]
+        fetcher = httpfetch.Fetcher()
+        results = bulkfetch.fetch_all(fetcher, downloads, limit=8, host_limit=3,
+                                      delay=0.01)
+        fetcher.close()
+
+        assert [result.job.key for result in results] == names
+        assert FlakyHandler.maxrunning <= 3
+        for result in results[:-1]:
+            assert result.error is None
+            assert result.value.filename == path.join(
+                tmpdir, result.job.key, '{}.csv'.format(result.job.key))
+            assert path.exists(result.value.filename)
+        assert FlakyHandler.hits['/flaky'] == 2
+        assert FlakyHandler.hits['/missing'] == 1
+        assert results[-1].error is not None
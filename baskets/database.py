@@ -1,45 +1,364 @@
 """Database of daily dated downloads per key.
+
+Files are stored under a 'key/YYYY/MM/DD' directory tree. Every file written
+through store() is also recorded in a SQLite manifest at the root of the
+database, which serves the lookups by key and date without walking the tree.
+Files which are not in the manifest (e.g. from before it existed) are still
+found by scanning the tree, and the 'rebuild' command reindexes a tree.
+
+File contents are stored once, as read-only blobs named by their hash, and the
+files of the dated tree are hard links to them; identical downloads thus take
+no additional space. The 'dedup' command converts an existing tree.
 """
 __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 from os import path
-import os
-from typing import NamedTuple, Union, Optional
+import argparse
+import contextlib
 import datetime
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from typing import Dict, Iterator, NamedTuple, Union, Optional, Tuple
 
 
 DEFAULT_DIR = path.join(os.environ['HOME'], '.baskets/db')
 
+# Name of the manifest file, at the root of the database directory.
+MANIFEST = 'manifest.db'
+
+# Name of the directory of content-addressed blobs, at the root of the database.
+BLOBS = '.blobs'
+
 
 Database = NamedTuple('Database', [('directory', str)])
 
 
+Entry = NamedTuple('Entry', [
+    ('key', str),
+    ('date', datetime.date),
+    ('filename', str),  # Absolute filename.
+    ('size', int),
+    ('sha256', str),
+    ('issuer', Optional[str]),
+    ('content', Optional[str]),  # Hash of the parsed contents, if computed.
+])
+
+
+_SCHEMA = """
+  CREATE TABLE IF NOT EXISTS files (
+    key TEXT NOT NULL,
+    date TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    issuer TEXT,
+    content TEXT,
+    PRIMARY KEY (key, date, filename)
+  );
+"""
+
+
 def getdir(db: Database, key: str, date: datetime.date) -> str:
     """Get a dated directory."""
     return path.join(db.directory, key, '{:%Y/%m/%d}'.format(date))
 
 
+@contextlib.contextmanager
+def manifest(db: Database, create: bool = False) -> Iterator[sqlite3.Connection]:
+    """Open a connection to the manifest and commit on success. This yields
+    None if the manifest does not exist and 'create' is false."""
+    filename = path.join(db.directory, MANIFEST)
+    if not create and not path.exists(filename):
+        yield None
+        return
+    os.makedirs(db.directory, exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=60)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(files)')]
+        if 'content' not in columns:
+            conn.execute('ALTER TABLE files ADD COLUMN content TEXT')
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def hash_file(filename: str) -> str:
+    """Compute the SHA-256 of a file's contents."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 16), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _insert(conn: sqlite3.Connection, db: Database, key: str, date: datetime.date,
+            filename: str, issuer: Optional[str], sha256: str = None,
+            content: str = None):
+    """Insert or replace the manifest entry of a file in the tree."""
+    conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                 (key, date.isoformat(), path.relpath(filename, db.directory),
+                  path.getsize(filename), sha256 or hash_file(filename), issuer,
+                  content))
+
+
+def blobname(db: Database, sha256: str) -> str:
+    """Get the filename of the blob of some contents."""
+    return path.join(db.directory, BLOBS, sha256[:2], sha256)
+
+
+def _tmpname(filename: str) -> str:
+    """Get a temporary filename next to a file, unique to this thread."""
+    return path.join(path.dirname(filename), '.{}.{}.{}.tmp'.format(
+        path.basename(filename), os.getpid(), threading.get_ident()))
+
+
+def link_blob(db: Database, filename: str, dst: str, sha256: str) -> int:
+    """Store the contents of 'filename' as a blob if it isn't already, and make
+    'dst' a hard link to it. This falls back on a copy on filesystems without
+    hard links. Returns the number of bytes the blob saved."""
+    blob = blobname(db, sha256)
+    saved = 0
+    if path.exists(blob):
+        saved = path.getsize(blob)
+    else:
+        os.makedirs(path.dirname(blob), exist_ok=True)
+        tmpname = _tmpname(blob)
+        shutil.copyfile(filename, tmpname)
+        os.chmod(tmpname, 0o444)
+        os.replace(tmpname, blob)
+    if path.exists(dst) and path.samefile(blob, dst):
+        return 0
+    os.makedirs(path.dirname(dst), exist_ok=True)
+    tmpname = _tmpname(dst)
+    try:
+        os.link(blob, tmpname)
+    except OSError:
+        shutil.copyfile(blob, tmpname)
+        saved = 0
+    os.replace(tmpname, dst)
+    return saved
+
+
+def store(db: Database, key: str, date: datetime.date, filename: str,
+          issuer: str = None, content: str = None) -> str:
+    """Store a file in its dated directory, as a link to the blob of its contents,
+    and record it in the manifest. 'content' is an optional hash of the parsed
+    contents of the file. Returns the name of the stored file."""
+    dst = path.join(getdir(db, key, date), path.basename(filename))
+    sha256 = hash_file(filename)
+    logging.info("Storing %s -> %s", filename, dst)
+    link_blob(db, filename, dst, sha256)
+    with manifest(db, create=True) as conn:
+        _insert(conn, db, key, date, dst, issuer, sha256, content)
+    return dst
+
+
+def _lookup(db: Database, query: str, params: Tuple) -> Optional[str]:
+    """Run a manifest query for a single filename and return it if the file still
+    exists, or return None."""
+    with manifest(db) as conn:
+        if conn is None:
+            return None
+        row = conn.execute(query, params).fetchone()
+    if row is not None:
+        filename = path.join(db.directory, row[0])
+        if path.exists(filename):
+            return filename
+    return None
+
+
+def _visible(filenames):
+    """Filter out hidden files, e.g., partial downloads."""
+    return sorted(filename for filename in filenames if not filename.startswith('.'))
+
+
+def _subdirs(dirname: str, regexp: str):
+    """List the subdirectories of a dated tree matching a regexp, latest first."""
+    try:
+        names = os.listdir(dirname)
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if re.match(regexp, name)), reverse=True)
+
+
+def _scan_dates(db: Database, key: str) -> Iterator[Tuple[datetime.date, str]]:
+    """Walk the dated directories of a key, latest first."""
+    keydir = path.join(db.directory, key)
+    for year in _subdirs(keydir, r'\d{4}$'):
+        for month in _subdirs(path.join(keydir, year), r'\d{2}$'):
+            for day in _subdirs(path.join(keydir, year, month), r'\d{2}$'):
+                try:
+                    date = datetime.date(int(year), int(month), int(day))
+                except ValueError:
+                    continue
+                yield date, path.join(keydir, year, month, day)
+
+
+def _scan(db: Database, key: str, asof: datetime.date = None) -> Optional[str]:
+    """Find the latest file of a key, optionally at or before a date, by scanning
+    the directory tree."""
+    for date, dirname in _scan_dates(db, key):
+        if asof is not None and date > asof:
+            continue
+        filenames = _visible(os.listdir(dirname))
+        if filenames:
+            return path.join(dirname, filenames[-1])
+    return None
+
+
 def get(db: Database, key: str, date: datetime.date) -> Optional[str]:
     """Get the directory for a particular date or return None."""
-    dirname = getdir(db, key, date)
-    if path.exists(dirname):
-        filenames = os.listdir(dirname)
-        return path.join(dirname, sorted(filenames)[-1]) if filenames else None
+    filename = _lookup(db, ('SELECT filename FROM files WHERE key = ? AND date = ? '
+                            'ORDER BY filename DESC LIMIT 1'),
+                       (key, date.isoformat()))
+    if filename is None:
+        dirname = getdir(db, key, date)
+        if path.exists(dirname):
+            filenames = _visible(os.listdir(dirname))
+            filename = path.join(dirname, filenames[-1]) if filenames else None
+    return filename
+
+
+def getasof(db: Database, key: str, date: datetime.date) -> Optional[str]:
+    """Return the latest downloaded filename at or before the given date."""
+    filename = _lookup(db, ('SELECT filename FROM files WHERE key = ? AND date <= ? '
+                            'ORDER BY date DESC, filename DESC LIMIT 1'),
+                       (key, date.isoformat()))
+    return filename or _scan(db, key, date)
 
 
 def getlatest(db: Database, key: str) -> Union[str, type(None)]:
     """Return the latest downloaded filename."""
-    curdir = path.join(db.directory, key)
-    try:
-        for _ in range(3):
-            filenames = os.listdir(curdir)
-            if not filenames:
-                return None
-            curdir = path.join(curdir, filenames[-1])
-        filenames = os.listdir(curdir)
-        if filenames:
-            return path.join(curdir, sorted(filenames)[-1])
-    except FileNotFoundError:
-        pass
-    return None
+    filename = _lookup(db, ('SELECT filename FROM files WHERE key = ? '
+                            'ORDER BY date DESC, filename DESC LIMIT 1'),
+                       (key,))
+    return filename or _scan(db, key)
+
+
+def entries(db: Database, key: str = None) -> Iterator[Entry]:
+    """Iterate over the manifest entries, optionally for a single key."""
+    with manifest(db) as conn:
+        if conn is None:
+            return
+        query = 'SELECT * FROM files'
+        params = ()
+        if key is not None:
+            query += ' WHERE key = ?'
+            params = (key,)
+        rows = conn.execute(query + ' ORDER BY key, date, filename', params).fetchall()
+    for key_, date, filename, size, sha256, issuer, content in rows:
+        yield Entry(key_, datetime.datetime.strptime(date, '%Y-%m-%d').date(),
+                    path.join(db.directory, filename), size, sha256, issuer, content)
+
+
+def getlatest_entry(db: Database, key: str) -> Optional[Entry]:
+    """Return the manifest entry of the latest file of a key, if any."""
+    with manifest(db) as conn:
+        if conn is None:
+            return None
+        row = conn.execute('SELECT * FROM files WHERE key = ? '
+                           'ORDER BY date DESC, filename DESC LIMIT 1', (key,)).fetchone()
+    if row is None:
+        return None
+    key_, date, filename, size, sha256, issuer, content = row
+    return Entry(key_, datetime.datetime.strptime(date, '%Y-%m-%d').date(),
+                 path.join(db.directory, filename), size, sha256, issuer, content)
+
+
+def _tree(db: Database) -> Iterator[Tuple[str, datetime.date, str]]:
+    """Iterate over all the files of the dated tree."""
+    for key in sorted(os.listdir(db.directory)):
+        if key.startswith('.') or not path.isdir(path.join(db.directory, key)):
+            continue
+        for date, dirname in _scan_dates(db, key):
+            for filename in _visible(os.listdir(dirname)):
+                yield key, date, path.join(dirname, filename)
+
+
+def rebuild(db: Database, issuers: Dict[str, str] = None) -> int:
+    """Reindex all the files in the database tree, keeping the issuers and content
+    hashes already recorded in the manifest. The issuer of a file not recorded
+    is taken from 'issuers', a mapping of keys to issuers, or else from the other
+    files of its key. Returns the number of files indexed."""
+    previous = {(entry.key, entry.date, entry.filename): entry for entry in entries(db)}
+    known = {entry.key: entry.issuer for entry in previous.values() if entry.issuer}
+    known.update(issuers or {})
+    count = 0
+    missing = set()
+    with manifest(db, create=True) as conn:
+        conn.execute('DELETE FROM files')
+        for key, date, filename in _tree(db):
+            entry = previous.get((key, date, filename))
+            issuer = (entry.issuer if entry else None) or known.get(key)
+            if issuer is None:
+                missing.add(key)
+            sha256 = hash_file(filename)
+            _insert(conn, db, key, date, filename, issuer, sha256,
+                    entry.content if entry and entry.sha256 == sha256 else None)
+            count += 1
+    if missing:
+        logging.warning("No issuer for the files of %d keys, which won't be parsed: %s",
+                        len(missing), ', '.join(sorted(missing)))
+    return count
+
+
+def dedup(db: Database) -> Tuple[int, int]:
+    """Replace all the files of the dated tree by links to content-addressed
+    blobs. Returns the number of files processed and the number of bytes saved."""
+    count, saved = 0, 0
+    for _, _, filename in _tree(db):
+        saved += link_blob(db, filename, filename, hash_file(filename))
+        count += 1
+    return count, saved
+
+
+def main():
+    """Maintenance commands for the database of downloads."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--dbdir', default=DEFAULT_DIR,
+                        help="Database directory.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    rebuild_parser = subparsers.add_parser(
+        'rebuild', help="Reindex the files in the database tree.")
+    rebuild_parser.add_argument('--issuer', action='append', default=[],
+                                help=("Issuer of the files of a key, as KEY=ISSUER, for "
+                                      "the files without a recorded issuer."))
+    subparsers.add_parser('dedup', help=("Store the files of the database tree "
+                                         "as links to unique blobs."))
+    list_parser = subparsers.add_parser('list', help="List the files in the manifest.")
+    list_parser.add_argument('key', nargs='?', help="Restrict to a single key.")
+    args = parser.parse_args()
+    db = Database(args.dbdir)
+
+    if args.command == 'rebuild':
+        issuers = {}
+        for spec in args.issuer:
+            key, sep, issuer = spec.partition('=')
+            if not sep or not key or not issuer:
+                parser.error("Invalid issuer: {}".format(spec))
+            issuers[key] = issuer
+        count = rebuild(db, issuers)
+        logging.info("Indexed %d files", count)
+    elif args.command == 'dedup':
+        count, saved = dedup(db)
+        logging.info("Deduplicated %d files, saving %d bytes", count, saved)
+    elif args.command == 'list':
+        for entry in entries(db, args.key):
+            print('{:10} {} {:10} {:>10} {} {}'.format(
+                entry.key, entry.date, entry.issuer or '', entry.size,
+                entry.sha256[:12], path.relpath(entry.filename, db.directory)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Unit tests for the database of downloads.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import datetime
+import os
+import tempfile
+
+import pytest
+
+from baskets import database
+
+
+# pylint: disable=missing-docstring
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield database.Database(path.join(tmpdir, 'db'))
+
+
+def _write(dirname, filename, contents='ticker,fraction\n'):
+    os.makedirs(dirname, exist_ok=True)
+    filename = path.join(dirname, filename)
+    with open(filename, 'w') as outfile:
+        outfile.write(contents)
+    return filename
+
+
+def test_store(db):
+    dates = [datetime.date(2018, 9, 30), datetime.date(2018, 10, 2),
+             datetime.date(2019, 1, 3)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stored = [database.store(db, 'VTI', date,
+                                 _write(tmpdir, 'holdings.csv', str(date)), 'Vanguard')
+                  for date in dates]
+    assert stored[0] == path.join(db.directory, 'VTI/2018/09/30/holdings.csv')
+
+    # The stored files are found through the manifest.
+    assert database.get(db, 'VTI', dates[1]) == stored[1]
+    assert database.get(db, 'VTI', datetime.date(2018, 10, 1)) is None
+    assert database.getlatest(db, 'VTI') == stored[2]
+    assert database.getasof(db, 'VTI', datetime.date(2018, 12, 31)) == stored[1]
+    assert database.getasof(db, 'VTI', datetime.date(2018, 1, 1)) is None
+    assert database.getlatest(db, 'VEA') is None
+
+    entries = list(database.entries(db, 'VTI'))
+    assert [entry.date for entry in entries] == dates
+    assert entries[0].issuer == 'Vanguard'
+    assert entries[0].size == len(str(dates[0]))
+    assert entries[0].sha256 == database.hash_file(stored[0])
+
+
+def test_scan_and_rebuild(db, caplog):
+    # Files written without the manifest, including hidden partial downloads.
+    old = _write(database.getdir(db, 'IVV', datetime.date(2018, 9, 30)), 'IVV.csv')
+    new = _write(database.getdir(db, 'IVV', datetime.date(2018, 10, 2)), 'IVV.csv')
+    _write(database.getdir(db, 'IVV', datetime.date(2018, 10, 2)), '.IVV.csv.part')
+    _write(database.getdir(db, 'IVV', datetime.date(2018, 11, 5)), '.IVV.csv.part')
+    assert database.getlatest(db, 'IVV') == new
+    assert database.getasof(db, 'IVV', datetime.date(2018, 10, 1)) == old
+    assert database.get(db, 'IVV', datetime.date(2018, 10, 2)) == new
+
+    # Unindexed files are still found once the manifest exists.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database.store(db, 'SPY', datetime.date(2018, 10, 2),
+                       _write(tmpdir, 'SPY.csv'), 'StateStreet')
+    assert database.getlatest(db, 'IVV') == new
+
+    # The issuer of a key is known from its other files.
+    _write(database.getdir(db, 'SPY', datetime.date(2018, 10, 3)), 'SPY.csv')
+    assert database.rebuild(db) == 4
+    assert [(entry.key, entry.issuer) for entry in database.entries(db)] == [
+        ('IVV', None), ('IVV', None), ('SPY', 'StateStreet'), ('SPY', 'StateStreet')]
+    assert 'No issuer for the files of 1 keys' in caplog.text
+    assert database.getlatest(db, 'IVV') == new
+
+    # The issuers of the keys of a tree without a manifest can be given.
+    assert database.rebuild(db, {'IVV': 'iShares'}) == 4
+    assert [(entry.key, entry.issuer) for entry in database.entries(db)] == [
+        ('IVV', 'iShares'), ('IVV', 'iShares'), ('SPY', 'StateStreet'),
+        ('SPY', 'StateStreet')]
+
+
+def test_blobs_and_dedup(db):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first = database.store(db, 'VTI', datetime.date(2018, 10, 1),
+                               _write(tmpdir, 'VTI.csv', 'same'), content='abc')
+        second = database.store(db, 'VTI', datetime.date(2018, 10, 2),
+                                _write(tmpdir, 'VTI.csv', 'same'))
+        third = database.store(db, 'VTI', datetime.date(2018, 10, 3),
+                               _write(tmpdir, 'VTI.csv', 'different'))
+
+    # Identical contents are stored once.
+    assert path.samefile(first, second)
+    assert not path.samefile(first, third)
+    assert path.samefile(first, database.blobname(db, database.hash_file(first)))
+    assert database.getlatest_entry(db, 'VTI').filename == third
+    assert next(database.entries(db, 'VTI')).content == 'abc'
+
+    # Files written outside store() get deduplicated.
+    extra = _write(database.getdir(db, 'VTI', datetime.date(2018, 10, 4)), 'VTI.csv',
+                   'same')
+    assert database.dedup(db) == (4, 4)
+    assert path.samefile(first, extra)
+    with open(extra) as infile:
+        assert infile.read() == 'same'
+    assert database.dedup(db) == (4, 0)
+
+    # Rebuilding keeps the content hashes of unchanged files.
+    assert database.rebuild(db) == 4
+    assert [entry.content for entry in database.entries(db, 'VTI')] == [
+        'abc', None, None, None]
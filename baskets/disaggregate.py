@@ -0,0 +1,235 @@
+"""Disaggregate the exposures of portfolios with a matrix of ETF weights.
+
+The holdings of all the ETFs (and single stocks) of the portfolios are grouped
+into instruments once (see graph.group), and stored as a sparse matrix of the
+weight of each instrument in each ETF. The exposure of a portfolio is then the
+product of the vector of the dollar amounts of its positions by that matrix, so
+repricing or resizing positions, or computing the exposures of many portfolios
+at once, doesn't require processing any holdings again. baskets-portfolio
+aggregates its holdings this way as well.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Callable, Dict, List, NamedTuple, Tuple
+import argparse
+import collections
+import logging
+import os
+
+import numpy
+import scipy.sparse
+
+from baskets import beansupport
+from baskets import database
+from baskets import graph
+from baskets import loader
+from baskets import normalize
+from baskets import table
+from baskets.table import Table
+
+
+# Columns of the holdings in the matrix.
+COLUMNS = ['fraction', 'asstype'] + normalize.IDCOLUMNS
+
+
+WeightMatrix = NamedTuple('WeightMatrix', [
+    ('etfs', List[str]),                # The ticker of each row.
+    ('instruments', Table),             # One row per column: symbol, asstype, name.
+    ('weights', scipy.sparse.csr_matrix),  # Fractions, of shape (ETFs, instruments).
+    ('instindex', List[numpy.ndarray]),  # The instrument of each holding, per ETF.
+])
+
+
+def build(holdings: Dict[str, Table],
+          linker: Callable[[Table], List[List[Tuple]]] = graph.holdings_links,
+          debug_filename: str = None) -> WeightMatrix:
+    """Group the normalized holdings of a set of ETFs, by ticker, and build the
+    matrix of their weights. The groups are written to 'debug_filename', if
+    provided (see graph.group)."""
+    etfs = list(holdings)
+    values = {column: [] for column in COLUMNS}
+    for etf in etfs:
+        for column in COLUMNS:
+            values[column].extend(holdings[etf].values(column))
+    arrays = [numpy.array(values['fraction'], dtype=float)]
+    for column in COLUMNS[1:]:
+        arr = numpy.empty(len(values[column]), dtype=object)
+        arr[:] = values[column]
+        arrays.append(arr)
+    alltable = Table(COLUMNS, [float] + [str] * (len(COLUMNS) - 1),
+                     table.Columns(arrays))
+    etfindex = numpy.repeat(numpy.arange(len(etfs)),
+                            [len(holdings[etf]) for etf in etfs])
+
+    # Number the instruments in order of their first row.
+    sets, links = graph.link_rows(linker(alltable))
+    roots = sets.roots()
+    instindex = numpy.empty(len(alltable), dtype=int)
+    groups = collections.defaultdict(list)
+    for index, root in enumerate(roots):
+        groups[root].append(index)
+    for column, indexes in enumerate(groups.values()):
+        instindex[indexes] = column
+    if debug_filename:
+        graph.write_groups(debug_filename, alltable, groups, links, roots)
+    instruments = Table(['symbol', 'asstype', 'name'], [str, str, str],
+                        graph.describe(alltable, list(groups.values())))
+    logging.info("Weight matrix of %d ETFs and %d instruments", len(etfs),
+                 len(instruments))
+
+    # Duplicate entries are summed.
+    weights = scipy.sparse.csr_matrix((arrays[0], (etfindex, instindex)),
+                                      shape=(len(etfs), len(instruments)))
+    offsets = numpy.cumsum([len(holdings[etf]) for etf in etfs])
+    return WeightMatrix(etfs, instruments, weights,
+                        numpy.split(instindex, offsets[:-1]) if etfs else [])
+
+
+def position_vectors(matrix: WeightMatrix,
+                     portfolios: List[Dict[str, float]]) -> numpy.ndarray:
+    """Convert the dollar amounts of the positions of portfolios, by ticker, to a
+    matrix of shape (ETFs, portfolios)."""
+    etfindex = {etf: index for index, etf in enumerate(matrix.etfs)}
+    vectors = numpy.zeros((len(matrix.etfs), len(portfolios)))
+    for column, amounts in enumerate(portfolios):
+        for ticker, amount in amounts.items():
+            index = etfindex.get(ticker)
+            if index is None:
+                logging.warning("No holdings for %s; ignoring its position", ticker)
+                continue
+            vectors[index, column] += amount
+    return vectors
+
+
+def exposures(matrix: WeightMatrix, vectors: numpy.ndarray) -> numpy.ndarray:
+    """Compute the dollar amount of each instrument for position vectors (see
+    position_vectors()). Returns a matrix of shape (instruments, portfolios)."""
+    return numpy.asarray(matrix.weights.T.dot(vectors))
+
+
+def _aggtable(matrix: WeightMatrix, amounts: numpy.ndarray,
+              instruments: numpy.ndarray) -> Tuple[Table, numpy.ndarray]:
+    """Produce the aggregated table of the amounts of some instruments, in order
+    of decreasing amount, and the instruments in that order."""
+    order = instruments[numpy.argsort(-amounts[instruments], kind='stable')]
+    rows = [matrix.instruments.rows[index] + (float(amounts[index]),)
+            for index in order.tolist()]
+    return (Table(['symbol', 'asstype', 'name', 'amount'], [str, str, str, float], rows),
+            order)
+
+
+def aggtable(matrix: WeightMatrix, amounts: numpy.ndarray) -> Table:
+    """Produce the aggregated table of the amounts of the instruments, with the
+    same columns as graph.group(), in order of decreasing amount."""
+    return _aggtable(matrix, amounts, numpy.flatnonzero(amounts))[0]
+
+
+def annotate(matrix: WeightMatrix, amounts: numpy.ndarray,
+             positions: List[Tuple[str, Table]]) -> Tuple[Table, Table]:
+    """Produce the aggregated and annotated tables of the holdings of positions,
+    as graph.group() does, from the amounts of the instruments (see exposures()).
+    'positions' are the ETF ticker of each position and its holdings, with
+    their dollar amounts. Ties are broken as graph.group() does if the ETFs of
+    the matrix are in order of their first position."""
+    etfindex = {etf: index for index, etf in enumerate(matrix.etfs)}
+    rowinsts = numpy.concatenate([matrix.instindex[etfindex[etf]]
+                                  for etf, _ in positions])
+    agg, order = _aggtable(matrix, amounts, numpy.unique(rowinsts))
+    groups = numpy.empty(len(matrix.instruments), dtype=int)
+    groups[order] = numpy.arange(len(order))
+    rowgroups = groups[rowinsts]
+
+    # Reproduce the holdings, with the group of each row, as graph.aggregate().
+    holdings = table.concat(*[tbl for _, tbl in positions])
+    if isinstance(holdings.rows, table.Columns):
+        annorows = table.Columns(holdings.rows.arrays + [rowgroups])
+    else:
+        annorows = [row + (gindex,) for row, gindex in zip(holdings.rows,
+                                                             rowgroups.tolist())]
+    annotable = (Table(holdings.columns + ['group'], holdings.types + [int], annorows)
+                 .order(lambda row: (row.group, -row.amount)))
+    return agg, annotable
+
+
+def main():
+    """Disaggregate the exposures of portfolios."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument('portfolios', nargs='+',
+                        help=('CSV files which contain the tickers of assets and '
+                              'number of units'))
+    parser.add_argument('--dbdir', default=database.DEFAULT_DIR,
+                        help="Database directory of the downloaded files.")
+    parser.add_argument('-i', '--ignore-missing-issuer', action='store_true',
+                        help="Ignore positions where the issuer implementation is missing")
+    parser.add_argument('-o', '--ignore-options', action='store_true',
+                        help=("Ignore options positions "
+                              "(only works with  Beancount export file)"))
+    parser.add_argument('-l', '--ignore-shorts', action='store_true',
+                        help="Ignore short positions")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Parse all the holdings files, ignoring cached tables.")
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                        help="Number of processes to parse the holdings files with.")
+    parser.add_argument('-n', '--top', action='store', type=int, default=20,
+                        help="Number of the largest holdings to print.")
+    parser.add_argument('--outdir', action='store',
+                        help=("Directory to write the aggregated table of each "
+                              "portfolio to, as <name>.agg.csv."))
+
+    args = parser.parse_args()
+    db = database.Database(args.dbdir)
+
+    # Find the holdings of the positions of all the portfolios.
+    allpositions = []
+    for filename in args.portfolios:
+        assets = beansupport.read_portfolio(filename, args.ignore_options)
+        assets.checkall(['ticker', 'account', 'issuer', 'price', 'quantity'])
+        allpositions.append(loader.find_files(db, assets, args.ignore_shorts,
+                                                 args.ignore_missing_issuer))
+    files = {}
+    for positions in allpositions:
+        for row, filename in positions:
+            files.setdefault(row.ticker, (row.issuer, filename))
+    jobs = [job for job in files.values() if job[1]]
+    parsed = dict(zip(jobs, loader.parse_all(jobs, not args.no_cache, args.jobs)))
+    holdings = {}
+    for ticker, (issuer, filename) in files.items():
+        if filename is None:
+            holdings[ticker] = loader.stock_holdings(ticker)
+        else:
+            tbl, error = parsed[(issuer, filename)]
+            if tbl is None:
+                logging.error("Could not parse '%s' for %s: %s", filename, ticker, error)
+                continue
+            holdings[ticker] = tbl
+
+    # Compute all the exposures at once.
+    matrix = build(holdings)
+    amounts = []
+    for positions in allpositions:
+        dollars = collections.defaultdict(float)
+        for row, _ in positions:
+            dollars[row.ticker] += row.quantity * row.price
+        amounts.append(dollars)
+    results = exposures(matrix, position_vectors(matrix, amounts))
+
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    for column, filename in enumerate(args.portfolios):
+        agg = aggtable(matrix, results[:, column])
+        logging.info("Total for %s: %.2f", filename, numpy.sum(results[:, column]))
+        if args.outdir:
+            name = path.splitext(path.basename(filename))[0]
+            with open(path.join(args.outdir, '{}.agg.csv'.format(name)), 'w') as outfile:
+                table.write_csv(agg, outfile)
+        print(filename)
+        print(agg.head(args.top))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Unit tests for the matrix disaggregation of portfolios.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import numpy
+
+from baskets import disaggregate
+from baskets import graph
+from baskets import loader
+from baskets import normalize
+from baskets import table
+from baskets.table import Table
+
+
+# pylint: disable=missing-docstring
+
+
+def _etf(rows):
+    return normalize.add_missing_columns(
+        Table(['fraction', 'asstype', 'name', 'ticker', 'cusip'],
+              [float, str, str, str, str], rows).columnar())
+
+
+HOLDINGS = {
+    'VTI': _etf([(0.5, 'Equity', 'Apple Inc', 'AAPL', ''),
+                 (0.3, 'Equity', 'Microsoft Corp', 'MSFT', ''),
+                 (0.2, 'Equity', 'Tiny Co', '', '')]),
+    'IVV': _etf([(0.6, 'Equity', 'APPLE INC.', '', '037833100'),
+                 (0.4, 'Equity', 'Microsoft Corporation', '', '')]),
+    'QQQ': _etf([(1.0, 'Equity', 'Apple', 'AAPL', '037833100')]),
+    'MSFT': loader.stock_holdings('MSFT'),
+}
+
+
+def test_exposures_match_grouping():
+    matrix = disaggregate.build(HOLDINGS)
+    assert matrix.weights.shape == (4, 4)
+    positions = [{'VTI': 100., 'IVV': 50., 'MSFT': 10.},
+                 {'QQQ': 10., 'XXX': 5.}]
+    results = disaggregate.exposures(matrix,
+                                     disaggregate.position_vectors(matrix, positions))
+    assert results.shape == (4, 2)
+    numpy.testing.assert_allclose(results.sum(axis=0), [160., 10.])
+
+    # The aggregated table is the same as from grouping the dollar amounts.
+    tables = []
+    for etf, amount in positions[0].items():
+        tbl = HOLDINGS[etf].select(disaggregate.COLUMNS)
+        tables.append(Table(tbl.columns + ['amount'], tbl.types + [float],
+                            [tuple(row) + (row.fraction * amount,) for row in tbl]))
+    expected, _ = graph.group(table.concat(*tables))
+    actual = disaggregate.aggtable(matrix, results[:, 0])
+    assert actual.columns == expected.columns
+    assert [row[:3] for row in actual] == [row[:3] for row in expected]
+    numpy.testing.assert_allclose(actual.values('amount'), expected.values('amount'))
+
+    actual = disaggregate.aggtable(matrix, results[:, 1])
+    assert [tuple(row) for row in actual] == [('AAPL', 'Equity', 'APPLE INC.', 10.)]
+
+
+def test_annotate_matches_grouping():
+    # The same ETF in two accounts, and a position without any amount.
+    positions = [('VTI', 'A', 100.), ('IVV', 'A', 50.), ('VTI', 'B', 20.),
+                 ('QQQ', 'B', 0.), ('MSFT', 'C', 10.)]
+    matrix = disaggregate.build({etf: HOLDINGS[etf] for etf, _, _ in positions})
+    tables = [(etf, loader.position_holdings(HOLDINGS[etf], etf, account, amount))
+              for etf, account, amount in positions]
+    dollars = {}
+    for etf, _, amount in positions:
+        dollars[etf] = dollars.get(etf, 0.) + amount
+    amounts = disaggregate.exposures(matrix,
+                                     disaggregate.position_vectors(matrix, [dollars]))
+    aggtable, annotable = disaggregate.annotate(matrix, amounts[:, 0], tables)
+
+    expected_agg, expected_anno = graph.group(table.concat(*[tbl for _, tbl in tables]))
+    assert [row[:3] for row in aggtable] == [row[:3] for row in expected_agg]
+    numpy.testing.assert_allclose(aggtable.values('amount'),
+                                  expected_agg.values('amount'))
+    assert annotable.columns == expected_anno.columns
+    assert list(annotable) == list(expected_anno)
+    assert annotable.values('etf')[:3] == ['VTI', 'IVV', 'VTI']
@@ -3,12 +3,20 @@
 __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
+from os import path
+from typing import Callable, Dict, List
+import contextlib
 import logging
 import os
 import re
 import tempfile
+import threading
 import time
 
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
 from selenium import webdriver
 from selenium.webdriver.chrome import options
 from selenium.common.exceptions import WebDriverException
@@ -28,21 +36,168 @@ def create_driver(driver_exec: str, headless: bool = False):
     return driver
 
 
+def close_driver(driver):
+    """Shut down a driver and remove its downloads directory."""
+    try:
+        driver.quit()
+    except WebDriverException:
+        logging.warning("Error shutting down driver", exc_info=True)
+    driver.downloads_dir.cleanup()
+
+
+def is_healthy(driver) -> bool:
+    """Check that the browser behind a driver is still responsive."""
+    try:
+        return driver.execute_script('return 1;') == 1
+    except WebDriverException:
+        return False
+
+
+class DriverPool:
+    """A pool of warm web drivers, each with its own downloads directory.
+
+    Jobs check out a driver, use it and return it to the pool. Idle drivers are
+    health-checked and their downloads directory cleared before being handed
+    out again. A driver is shut down and replaced after 'max_jobs' jobs, or if
+    the job using it failed. This class is thread-safe.
+    """
+
+    def __init__(self, driver_exec: str, headless: bool = False, max_jobs: int = 20,
+                 factory: Callable = None):
+        self.driver_exec = driver_exec
+        self.headless = headless
+        self.max_jobs = max_jobs
+        self.factory = factory or create_driver
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def checkout(self):
+        """Get a healthy driver from the pool, creating a new one if needed."""
+        while True:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                break
+            if is_healthy(driver):
+                reset(driver)
+                return driver
+            logging.warning("Discarding unresponsive driver")
+            close_driver(driver)
+        logging.info("Creating a new driver")
+        driver = self.factory(self.driver_exec, headless=self.headless)
+        driver.num_jobs = 0
+        return driver
+
+    def checkin(self, driver, failed: bool = False):
+        """Return a driver to the pool after a job, or recycle it."""
+        driver.num_jobs += 1
+        if failed or driver.num_jobs >= self.max_jobs:
+            close_driver(driver)
+        else:
+            with self._lock:
+                self._idle.append(driver)
+
+    @contextlib.contextmanager
+    def driver(self):
+        """Context manager to check out a driver for the duration of a job. If the
+        job raises an exception, the driver is recycled."""
+        driver = self.checkout()
+        failed = True
+        try:
+            yield driver
+            failed = False
+        finally:
+            self.checkin(driver, failed)
+
+    def close(self):
+        """Shut down all the idle drivers."""
+        with self._lock:
+            drivers, self._idle = self._idle, []
+        for driver in drivers:
+            close_driver(driver)
+
+
 def get_downloads(driver):
     """Get the list of downloaded files after running the driver."""
     return [fn for fn in utils.abslistdir(driver.downloads_dir.name)
             if not re.match(r'.*\.crdownload$', fn)]
 
 
-def wait_for_downloads(driver, pattern: str = None):
-    """Block until the downloads directory has a single non-temp file."""
-    while True:
-        filenames = os.listdir(driver.downloads_dir.name)
-        okfiles = [fn for fn in filenames
-                   if (not re.match(r'.*\.crdownload$', fn) and
-                       (not pattern or re.match(pattern, fn)))]
-        if okfiles:
-            break
+class _DirectoryWatcher:
+    """Block until something changes in a directory. This uses inotify if it is
+    available, and falls back on polling otherwise."""
+
+    def __init__(self, dirname: str, poll_interval: float):
+        self.poll_interval = poll_interval
+        self.inotify = None
+        if inotify_simple is not None:
+            try:
+                self.inotify = inotify_simple.INotify()
+                flags = inotify_simple.flags
+                self.inotify.add_watch(dirname, (flags.CREATE | flags.MODIFY |
+                                                 flags.MOVED_TO | flags.CLOSE_WRITE))
+            except OSError:
+                logging.warning("Could not watch %s; polling", dirname)
+                self.close()
+
+    def wait(self, seconds: float):
+        """Wait for a change or until 'seconds' have elapsed."""
+        if self.inotify is not None:
+            self.inotify.read(timeout=max(1, int(seconds * 1000)))
+        else:
+            time.sleep(min(seconds, self.poll_interval))
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def _completed_files(dirname: str, pattern: str) -> Dict[str, int]:
+    """Get the sizes of the complete files in a directory matching a pattern."""
+    sizes = {}
+    for filename in os.listdir(dirname):
+        if re.match(r'.*\.crdownload$', filename) or (
+                pattern and not re.match(pattern, filename)):
+            continue
+        try:
+            sizes[filename] = path.getsize(path.join(dirname, filename))
+        except FileNotFoundError:
+            pass
+    return sizes
+
+
+def wait_for_files(dirname: str, pattern: str = None, timeout: float = 120.0,
+                   stable: float = 0.5, poll_interval: float = 0.2) -> List[str]:
+    """Block until the directory has non-temp files matching 'pattern' whose sizes
+    have not changed for 'stable' seconds. Raise TimeoutError if that does not
+    happen within 'timeout' seconds. Returns the sorted list of filenames."""
+    deadline = time.monotonic() + timeout
+    watcher = _DirectoryWatcher(dirname, poll_interval)
+    try:
+        sizes, since = None, None
+        while True:
+            current = _completed_files(dirname, pattern)
+            now = time.monotonic()
+            if current and current == sizes:
+                if now - since >= stable:
+                    return [path.join(dirname, filename) for filename in sorted(current)]
+            else:
+                sizes, since = current, now
+            remaining = deadline - now
+            if remaining <= 0:
+                raise TimeoutError("No complete download{} in {} after {} secs".format(
+                    " matching '{}'".format(pattern) if pattern else "",
+                    dirname, timeout))
+            watcher.wait(min(remaining, stable) if current else remaining)
+    finally:
+        watcher.close()
+
+
+def wait_for_downloads(driver, pattern: str = None, timeout: float = 120.0,
+                       stable: float = 0.5) -> List[str]:
+    """Block until the downloads directory has a complete non-temp file."""
+    return wait_for_files(driver.downloads_dir.name, pattern, timeout, stable)
 
 
 def reset(driver):
@@ -51,11 +206,15 @@ def reset(driver):
         os.remove(filename)
 
 
-def retry(func, *args):
-    """Automatically retry a failed."""
-    while True:
+def retry(func, *args, attempts: int = 6, delay: float = 1.0, max_delay: float = 30.0):
+    """Call 'func' and retry on driver errors, backing off exponentially between
+    attempts. The last error is raised after 'attempts' failures."""
+    for attempt in range(1, attempts + 1):
         try:
             return func(*args)
         except WebDriverException:
-            time.sleep(1)
-            logging.info("Retrying")
+            if attempt == attempts:
+                raise
+            wait = min(delay * 2 ** (attempt - 1), max_delay)
+            logging.info("Retrying in %.1f secs (attempt %d/%d)", wait, attempt, attempts)
+            time.sleep(wait)
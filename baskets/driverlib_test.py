@@ -0,0 +1,119 @@
+"""Unit tests for the driver pool.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import os
+import tempfile
+import threading
+
+import pytest
+
+from selenium.common.exceptions import WebDriverException
+
+from baskets import driverlib
+
+
+# pylint: disable=missing-docstring
+
+
+class FakeDriver:
+
+    def __init__(self):
+        self.downloads_dir = tempfile.TemporaryDirectory()
+        self.alive = True
+        self.quit_called = False
+
+    def execute_script(self, _):
+        if not self.alive:
+            raise WebDriverException("Browser is gone")
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_driver_pool():
+    created = []
+    def factory(_, headless):
+        created.append(FakeDriver())
+        return created[-1]
+    pool = driverlib.DriverPool('chromedriver', headless=True, max_jobs=2,
+                                factory=factory)
+
+    # Drivers are reused and the downloads directory is cleared in-between.
+    with pool.driver() as driver:
+        with open(path.join(driver.downloads_dir.name, 'holdings.csv'), 'w'):
+            pass
+    with pool.driver() as driver2:
+        assert driver2 is driver
+        assert driverlib.get_downloads(driver2) == []
+
+    # Recycled after max_jobs.
+    assert driver.quit_called
+    with pool.driver() as driver3:
+        assert driver3 is not driver
+
+    # Recycled on a failed job.
+    with pytest.raises(ValueError):
+        with pool.driver() as driver4:
+            assert driver4 is driver3
+            raise ValueError()
+    assert driver3.quit_called
+
+    # Unresponsive drivers are discarded.
+    with pool.driver() as driver5:
+        pass
+    driver5.alive = False
+    with pool.driver() as driver6:
+        assert driver6 is not driver5
+    assert driver5.quit_called
+
+    pool.close()
+    assert driver6.quit_called
+    assert len(created) == 4
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_wait_for_files(use_inotify, monkeypatch):
+    if not use_inotify:
+        monkeypatch.setattr(driverlib, 'inotify_simple', None)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with pytest.raises(TimeoutError):
+            driverlib.wait_for_files(tmpdir, timeout=0.2)
+
+        # Partial downloads and files not matching the pattern are ignored.
+        for filename in 'holdings.csv.crdownload', 'notes.txt':
+            with open(path.join(tmpdir, filename), 'w') as outfile:
+                outfile.write('data')
+        with pytest.raises(TimeoutError):
+            driverlib.wait_for_files(tmpdir, r'.*\.csv$', timeout=0.2)
+
+        timer = threading.Timer(0.1, os.rename,
+                                (path.join(tmpdir, 'holdings.csv.crdownload'),
+                                 path.join(tmpdir, 'holdings.csv')))
+        timer.start()
+        filenames = driverlib.wait_for_files(tmpdir, r'.*\.csv$', timeout=5,
+                                             stable=0.1)
+        timer.join()
+        assert filenames == [path.join(tmpdir, 'holdings.csv')]
+
+
+def test_retry(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(driverlib.time, 'sleep', sleeps.append)
+    calls = []
+    def flaky(value, failures):
+        calls.append(value)
+        if len(calls) <= failures:
+            raise WebDriverException("Not loaded")
+        return value
+
+    assert driverlib.retry(flaky, 'x', 3, delay=1, max_delay=3) == 'x'
+    assert sleeps == [1, 2, 3]
+
+    calls.clear()
+    with pytest.raises(WebDriverException):
+        driverlib.retry(flaky, 'x', 10, attempts=3)
+    assert len(calls) == 3
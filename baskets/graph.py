@@ -4,16 +4,21 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 import collections
+import functools
 import logging
-import re
 import math
-from typing import Tuple
+import os
+import pickle
+import re
+from typing import Callable, Dict, List, Tuple
 
-import networkx as nx
+import numpy
 
+from baskets import table
 from baskets.table import Table
 
 
+@functools.lru_cache(maxsize=65536)
 def name_key(name: str):
     """Normalize the company name for most accurate match against name database.
     We want to be able to use the name as a key."""
@@ -35,88 +40,124 @@ def print_group(rows, links, outfile=None):
     print(file=outfile)
 
 
-def print_detailed_debug_info(component, graph):
-    """Print some detailed debug information."""
-    for c in component:
-        # pylint: disable=unidiomatic-typecheck
-        if type(c) is not tuple:
-            print(c)
-            for e in graph.edges(c):
-                print(e[1])
-            print()
-    print()
-    print()
-    print()
-
-
-def build_graph(holdings: Table) -> nx.Graph:
-    """Build a graph of relationships using the identifier columns and name."""
-    columns = ['ticker', 'cusip', 'isin', 'sedol']
-    g = nx.Graph()
-    for row in holdings:
-        # Add each row.
-        g.add_node(row)
-
-        # Add links for each identifier column.
-        for column in columns:
-            value = getattr(row, column)
-            if value and value != '-':
-                g.add_edge(row, (column, value))
-
-        # Link via a normalized version of the name but only if they are the
-        # same asset type.
-        if row.name and row.name != '-':
-            key = name_key(row.name)
-            if key:
-                g.add_edge(row, ('name_key', (row.asstype, key)))
-    return g
-
-
-def group(holdings: Table, debug_filename: str = None) -> Tuple[Table, Table]:
-    """Group assets by similarity."""
+class UnionFind:
+    """Disjoint sets over the integers [0, size), stored in flat arrays, with path
+    compression and union by rank."""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+
+    def find(self, index: int) -> int:
+        """Find the representative of the set of an element."""
+        parent = self.parent
+        root = index
+        while parent[root] != root:
+            root = parent[root]
+        while parent[index] != root:
+            parent[index], index = root, parent[index]
+        return root
+
+    def union(self, index1: int, index2: int) -> int:
+        """Merge the sets of two elements and return the new representative."""
+        root1, root2 = self.find(index1), self.find(index2)
+        if root1 == root2:
+            return root1
+        rank = self.rank
+        if rank[root1] < rank[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        if rank[root1] == rank[root2]:
+            rank[root1] += 1
+        return root1
+
+    def roots(self) -> List[int]:
+        """Get the representative of every element."""
+        return [self.find(index) for index in range(len(self.parent))]
+
+
+# Identifier columns linking holdings.
+LINK_COLUMNS = ['ticker', 'cusip', 'isin', 'sedol']
+
+
+def row_links(asstype: str, name: str, identifiers: Tuple[str]) -> List[Tuple]:
+    """Get the links of a holding: a (column, value) pair for each of its
+    identifiers (in the order of LINK_COLUMNS) and a normalized version of its
+    name, qualified by its asset type."""
+    links = [(column, value)
+             for column, value in zip(LINK_COLUMNS, identifiers)
+             if value and value != '-']
+
+    # Link via a normalized version of the name but only if they are the
+    # same asset type.
+    if name and name != '-':
+        key = name_key(name)
+        if key:
+            links.append(('name_key', (asstype, key)))
+    return links
+
+
+def holdings_links(holdings: Table) -> List[List[Tuple]]:
+    """Get the links of all the rows of a holdings table."""
+    columns = [holdings.values(column) for column in LINK_COLUMNS]
+    return [row_links(asstype, name, identifiers)
+            for asstype, name, identifiers in zip(holdings.values('asstype'),
+                                                  holdings.values('name'),
+                                                  zip(*columns))]
+
+
+def link_rows(rowlinks: List[List[Tuple]]) -> Tuple[UnionFind, Dict[Tuple, int]]:
+    """Merge the rows sharing a link. Returns the sets of rows and a mapping of
+    each link to the first row it was seen on."""
+    links = {}
+    sets = UnionFind(len(rowlinks))
+    for index, linklist in enumerate(rowlinks):
+        for link in linklist:
+            first = links.setdefault(link, index)
+            if first != index:
+                sets.union(first, index)
+    return sets, links
+
+
+def write_groups(filename: str, holdings: Table, components: Dict[int, List[int]],
+                 links: Dict[Tuple, int], roots: List[int]):
+    """Write the rows and links of each connected component of the rows of a
+    holdings table, for debugging. 'links' and 'roots' are from link_rows()."""
+    component_links = collections.defaultdict(list)
+    for link, index in links.items():
+        component_links[roots[index]].append(link)
+    rows = holdings.rows
+    with open(filename, 'w') as outfile:
+        for root, indexes in components.items():
+            print_group([rows[index] for index in indexes], component_links[root],
+                        outfile)
+
+
+def group(holdings: Table, debug_filename: str = None,
+          rowlinks: List[List[Tuple]] = None) -> Tuple[Table, Table]:
+    """Group assets by similarity. The rows are linked by their identifiers and
+    names (see row_links()), or by 'rowlinks' if provided."""
 
     # Compute the connected components.
-    g = build_graph(holdings)
-    cc = nx.connected_components(g)
-    logging.info('Num connected components: %s', nx.number_connected_components(g))
+    if rowlinks is None:
+        rowlinks = holdings_links(holdings)
+    sets, links = link_rows(rowlinks)
+    roots = sets.roots()
+    components = collections.defaultdict(list)
+    for index, root in enumerate(roots):
+        components[root].append(index)
+    logging.info('Num connected components: %s', len(components))
 
     # Process each component.
     counts = collections.defaultdict(int)
-    debugfile = open(debug_filename, 'w') if debug_filename else None
     groups = []
-    for component in cc:
-        # Separate out the rows and links.
-        rows = []
-        links = []
-        for c in component:
-            # pylint: disable=unidiomatic-typecheck
-            (links if type(c) is tuple else rows).append(c)
-        counts[len(rows)] += 1
-        groups.append(rows)
-
-        # Print all groups to a test file.
-        if debugfile:
-            print_group(rows, links, debugfile)
-
-        # if ('ticker', 'GOOG') in links or ('ticker', 'GOOGL') in links:
-        #     print_detailed_debug_info(c, g)
-
-        # if 0:
-        #     # Print groups with mixed asset types.
-        #     if len(set(row.asstype for row in rows)) > 1:
-        #         print_group(rows, links)
-
-        # if 0:
-        #     # Print groups without any ticker.
-        #     if len(rows) != 1:
-        #         continue
-        #     linkdict = dict(links)
-        #     if linkdict.get('ticker', None):
-        #         continue
-        #     print_group(rows, links)
-
-    if debugfile is not None:
-        debugfile.close()
+    for indexes in components.values():
+        counts[len(indexes)] += 1
+        groups.append(indexes)
+
+    # Print all groups to a test file.
+    if debug_filename:
+        write_groups(debug_filename, holdings, components, links, roots)
     logging.info('Matched: {:%}'.format(1 - counts[1] / sum(counts.values())))
     logging.info('Items distribution (log-floored):')
     # Convert to log map.
@@ -127,29 +168,173 @@ def group(holdings: Table, debug_filename: str = None) -> Tuple[Table, Table]:
     for numitems, count in sorted(logcounts.items()):
         logging.info('   {:>3}~{:>3} items: {:10}'.format(numitems-1, numitems, count))
 
-    # Reduce the rows and produce an aggregated table.
-    aggrows = []
-    sorted_groups = sorted(groups, key=lambda grows: -sum(row.amount for row in grows))
-    for rows in sorted_groups:
-        assert rows
-        amount = sum(row.amount for row in rows)
+    return aggregate(holdings, groups)
+
+
+def describe(holdings: Table, groups: List[List[int]]) -> List[Tuple[str, str, str]]:
+    """Describe groups of rows of a holdings table by their (symbol, asstype,
+    name): all their tickers, all their asset types and their best name."""
+    names = holdings.values('name')
+    tickers = holdings.values('ticker')
+    asstypes = holdings.values('asstype')
+    descriptions = []
+    for indexes in groups:
+        assert indexes
         # Select the longest name. It seems to nealy always be the best variant.
-        names = sorted(set(row.name for row in rows), key=len, reverse=True)
-        name = names[0]
-        symbol = ','.join(sorted(set(row.ticker for row in rows if row.ticker)))
-        asstype = ','.join(sorted(set(row.asstype for row in rows)))
-        aggrows.append((symbol, asstype, name, amount))
+        gnames = sorted(set(names[index] for index in indexes),
+                        key=lambda name: (-len(name), name))
+        symbol = ','.join(sorted(set(tickers[index] for index in indexes
+                                     if tickers[index])))
+        asstype = ','.join(sorted(set(asstypes[index] for index in indexes)))
+        descriptions.append((symbol, asstype, gnames[0]))
+    return descriptions
+
+
+def aggregate(holdings: Table, groups: List[List[int]]) -> Tuple[Table, Table]:
+    """Reduce groups of rows of a holdings table. Returns an aggregated table
+    with a row per group, in order of decreasing amount, and the holdings table
+    with the index of the group of each row."""
+    amounts = holdings.values('amount')
+    group_amounts = [sum(amounts[index] for index in indexes) for indexes in groups]
+    order = sorted(range(len(groups)), key=lambda gindex: -group_amounts[gindex])
+    sorted_groups = [groups[gindex] for gindex in order]
+    aggrows = [description + (group_amounts[gindex],)
+               for gindex, description in zip(order, describe(holdings, sorted_groups))]
     columns = ['symbol', 'asstype', 'name', 'amount']
     aggtable = (Table(columns, [str, str, str, float], aggrows)
                 .order(lambda row: row.amount, asc=False))
 
     # Reproduce the original table, but with the row groups annotated this time.
-    annotation_map = {}
-    for index, rows in enumerate(sorted_groups):
-        for row in rows:
-            annotation_map[row] = index
-    annotable = (holdings.create('group', annotation_map.__getitem__)
+    rowgroups = [0] * len(holdings)
+    for gindex, indexes in enumerate(sorted_groups):
+        for index in indexes:
+            rowgroups[index] = gindex
+    if isinstance(holdings.rows, table.Columns):
+        annorows = table.Columns(holdings.rows.arrays + [numpy.array(rowgroups)])
+    else:
+        annorows = [row + (gindex,) for row, gindex in zip(holdings.rows, rowgroups)]
+    annotable = (Table(holdings.columns + ['group'], holdings.types + [int], annorows)
                  .order(lambda row: (row.group, -row.amount)))
     assert len(holdings) == len(annotable)
 
     return aggtable, annotable
+
+
+class IncrementalGroups:
+    """Groups of the holdings of a set of blocks of rows, e.g., the snapshots of
+    the ETFs of a portfolio, maintained as blocks are added and removed.
+
+    Adding a block only merges the components its rows link to. Removing a block
+    only recomputes the components its rows were in, from the links of their
+    remaining rows. The whole structure can be pickled between runs. The 'tag'
+    identifies how the rows are linked, so a saved state is only reused with
+    the same links."""
+
+    def __init__(self, tag: str = None):
+        self.tag = tag
+        self.blocks = {}      # Block key -> Table of holdings.
+        self.rowlinks = {}    # (Block key, row index) -> links of the row.
+        self.linkrows = {}    # Link -> set of (block key, row index).
+        self.components = {}  # Component id -> set of (block key, row index).
+        self.rowcomp = {}     # (Block key, row index) -> component id.
+        self.next_component = 0
+
+    def _new_component(self, rowids) -> int:
+        component = self.next_component
+        self.next_component += 1
+        self.components[component] = set(rowids)
+        for rowid in rowids:
+            self.rowcomp[rowid] = component
+        return component
+
+    def _merge(self, components) -> int:
+        """Merge components into the largest one and return it."""
+        largest = max(components, key=lambda component: len(self.components[component]))
+        rowids = self.components[largest]
+        for component in components:
+            if component != largest:
+                for rowid in self.components.pop(component):
+                    self.rowcomp[rowid] = largest
+                    rowids.add(rowid)
+        return largest
+
+    def add(self, key, holdings: Table,
+            linker: Callable[[Table], List[List[Tuple]]] = holdings_links):
+        """Add a block of holdings, replacing any previous block with the same
+        key. If the rows of the previous block have the same identifiers, only
+        the table is replaced (e.g., with different amounts)."""
+        if key in self.blocks:
+            previous = self.blocks[key]
+            if all(list(previous.values(column)) == list(holdings.values(column))
+                   for column in ['asstype', 'name'] + LINK_COLUMNS):
+                self.blocks[key] = holdings
+                return
+            self.remove(key)
+
+        self.blocks[key] = holdings
+        for index, links in enumerate(linker(holdings)):
+            rowid = (key, index)
+            self.rowlinks[rowid] = links
+            components = {self.rowcomp[next(iter(self.linkrows[link]))]
+                          for link in links if link in self.linkrows}
+            if components:
+                component = self._merge(components)
+                self.components[component].add(rowid)
+                self.rowcomp[rowid] = component
+            else:
+                self._new_component([rowid])
+            for link in links:
+                self.linkrows.setdefault(link, set()).add(rowid)
+
+    def remove(self, key):
+        """Remove a block of holdings."""
+        holdings = self.blocks.pop(key)
+        removed = {(key, index) for index in range(len(holdings))}
+        affected = {self.rowcomp.pop(rowid) for rowid in removed}
+        for rowid in removed:
+            for link in self.rowlinks.pop(rowid):
+                rowids = self.linkrows[link]
+                rowids.discard(rowid)
+                if not rowids:
+                    del self.linkrows[link]
+
+        # Split what remains of the affected components.
+        for component in affected:
+            remaining = list(self.components.pop(component) - removed)
+            sets, _ = link_rows([self.rowlinks[rowid] for rowid in remaining])
+            subsets = collections.defaultdict(list)
+            for rowid, root in zip(remaining, sets.roots()):
+                subsets[root].append(rowid)
+            for rowids in subsets.values():
+                self._new_component(rowids)
+
+    def group(self) -> Tuple[Table, Table]:
+        """Produce the aggregated and annotated tables of all the blocks, as
+        group() does."""
+        if not self.blocks:
+            raise ValueError("No holdings to group")
+        groups = collections.defaultdict(list)
+        offset = 0
+        for key, holdings in self.blocks.items():
+            for index in range(len(holdings)):
+                groups[self.rowcomp[(key, index)]].append(offset + index)
+            offset += len(holdings)
+        holdings = table.concat(*self.blocks.values())
+        return aggregate(holdings, list(groups.values()))
+
+
+def load_groups(filename: str) -> IncrementalGroups:
+    """Load incremental groups saved with save_groups()."""
+    with open(filename, 'rb') as infile:
+        groups = pickle.load(infile)
+    if not isinstance(groups, IncrementalGroups):
+        raise TypeError("Invalid groups file: {}".format(filename))
+    return groups
+
+
+def save_groups(groups: IncrementalGroups, filename: str):
+    """Save incremental groups atomically."""
+    tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmpname, 'wb') as outfile:
+        pickle.dump(groups, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpname, filename)
@@ -0,0 +1,117 @@
+"""Unit tests for the grouping of assets.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import random
+
+from baskets import graph
+from baskets.table import Table
+
+
+# pylint: disable=missing-docstring
+
+
+COLUMNS = ['etf', 'asstype', 'name', 'ticker', 'sedol', 'isin', 'cusip', 'amount']
+
+
+def _holdings():
+    return Table(COLUMNS, [str] * 7 + [float], [
+        ('VTI', 'Equity', 'Apple Inc', 'AAPL', '', '', '', 100.),
+        ('IVV', 'Equity', 'APPLE INC.', '', '', 'US0378331005', '037833100', 50.),
+        ('QQQ', 'Equity', 'Apple', 'AAPL', '', '', '037833100', 25.),
+        ('VTI', 'Equity', 'Microsoft Corp', 'MSFT', '', '', '', 80.),
+        ('IVV', 'Equity', 'Microsoft Corporation', '', '', '', '', 90.),
+        ('BND', 'FixedIncome', 'Microsoft Corp', '', '', '', '', 10.),
+        ('VTI', 'Equity', 'Tiny Co', '-', '', '', '', 1.),
+    ])
+
+
+def test_union_find():
+    sets = graph.UnionFind(6)
+    sets.union(0, 1)
+    sets.union(2, 3)
+    sets.union(1, 3)
+    roots = sets.roots()
+    assert len(set(roots[:4])) == 1
+    assert len(set(roots)) == 3
+    assert sets.find(5) == 5
+
+
+def test_group():
+    holdings = _holdings()
+    aggtable, annotable = graph.group(holdings)
+    assert [tuple(row) for row in aggtable] == [
+        ('AAPL', 'Equity', 'APPLE INC.', 175.),
+        ('', 'Equity', 'Microsoft Corporation', 90.),
+        ('MSFT', 'Equity', 'Microsoft Corp', 80.),
+        ('', 'FixedIncome', 'Microsoft Corp', 10.),
+        ('-', 'Equity', 'Tiny Co', 1.),
+    ]
+    assert annotable.values('group') == [0, 0, 0, 1, 2, 3, 4]
+    assert len(annotable) == len(holdings)
+    for row in annotable:
+        assert aggtable.rows[row.group].asstype == row.asstype
+
+
+def test_group_columnar_same_as_rows():
+    rows = list(_holdings().rows)
+    random.Random(1).shuffle(rows)
+    holdings = Table(COLUMNS, [str] * 7 + [float], rows)
+    agg1, anno1 = graph.group(holdings)
+    agg2, anno2 = graph.group(holdings.columnar())
+    assert list(agg1) == list(agg2)
+    assert list(anno1) == list(anno2)
+
+
+def _blocks(holdings):
+    blocks = {}
+    for row in holdings:
+        blocks.setdefault(row.etf, []).append(row)
+    return {etf: Table(COLUMNS, [str] * 7 + [float], rows)
+            for etf, rows in blocks.items()}
+
+
+def test_incremental_groups(tmp_path):
+    holdings = _holdings()
+    groups = graph.IncrementalGroups('test')
+    for etf, block in _blocks(holdings).items():
+        groups.add(etf, block)
+    agg1, _ = graph.group(holdings)
+    agg2, anno2 = groups.group()
+    assert list(agg1) == list(agg2)
+    assert len(anno2) == len(holdings)
+
+    # Adding a row which links the two Microsoft groups merges them.
+    bridge = Table(COLUMNS, [str] * 7 + [float], [
+        ('SPY', 'Equity', 'Microsoft Corporation', 'MSFT', '', '', '', 5.)])
+    groups.add('SPY', bridge)
+    aggtable, _ = groups.group()
+    assert [tuple(row) for row in aggtable][:2] == [
+        ('AAPL', 'Equity', 'APPLE INC.', 175.),
+        ('MSFT', 'Equity', 'Microsoft Corporation', 175.)]
+
+    # The state survives a round trip, and removing the row splits them again.
+    filename = str(tmp_path / 'groups.pickle')
+    graph.save_groups(groups, filename)
+    groups = graph.load_groups(filename)
+    assert groups.tag == 'test'
+    groups.remove('SPY')
+    aggtable, _ = groups.group()
+    assert list(aggtable) == list(agg1)
+
+    # Re-adding a block with the same identifiers only updates the amounts.
+    vti = _blocks(holdings)['VTI']
+    groups.add('VTI', Table(COLUMNS, vti.types,
+                            [row[:-1] + (row.amount * 2,) for row in vti]))
+    aggtable, _ = groups.group()
+    assert [tuple(row) for row in aggtable][:2] == [
+        ('AAPL', 'Equity', 'APPLE INC.', 275.),
+        ('MSFT', 'Equity', 'Microsoft Corp', 160.)]
+    groups.remove('VTI')
+    groups.remove('IVV')
+    groups.remove('QQQ')
+    aggtable, annotable = groups.group()
+    assert [tuple(row) for row in aggtable] == [
+        ('', 'FixedIncome', 'Microsoft Corp', 10.)]
+    assert not groups.linkrows.keys() - {('name_key', ('FixedIncome', 'microsoft'))}
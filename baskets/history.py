@@ -0,0 +1,226 @@
+"""Compute the history of the disaggregated exposure of a portfolio.
+
+The holdings snapshots of the ETFs of a portfolio are read from the columnar
+store (see snapshots) over a range of dates. At each date, the latest snapshot
+of each ETF at or before that date is in effect, so an ETF whose holdings were
+not downloaded on a particular day carries its previous holdings forward. The
+exposure is updated incrementally: at each date, only the contributions of the
+ETFs with a new snapshot are replaced.
+
+Holdings are matched across ETFs and dates by grouping their identifiers once,
+the same way as for a single portfolio (see graph.group). The positions are
+valued with the fixed prices of the portfolio file, so the drift reflects the
+changes in the composition of the ETFs.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Dict, List, NamedTuple, Tuple
+import argparse
+import bisect
+import collections
+import datetime
+import logging
+
+import numpy
+
+from baskets import beansupport
+from baskets import database
+from baskets import graph
+from baskets import normalize
+from baskets import snapshots
+from baskets import table
+from baskets.table import Table
+
+
+# Columns identifying a holding in a snapshot.
+IDKEY = ['asstype'] + normalize.IDCOLUMNS
+
+
+ExposureHistory = NamedTuple('ExposureHistory', [
+    ('dates', List[datetime.date]),
+    ('holdings', Table),         # One row per holding: symbol, asstype, name.
+    ('amounts', numpy.ndarray),  # Dollar amounts, of shape (dates, holdings).
+])
+
+
+def position_amounts(assets: Table) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Compute the dollar amounts of the ETFs and of the single stocks of a
+    portfolio, summed over accounts."""
+    etfs = collections.defaultdict(float)
+    stocks = collections.defaultdict(float)
+    for row in assets:
+        (etfs if row.issuer else stocks)[row.ticker] += row.quantity * row.price
+    return etfs, stocks
+
+
+def _match_holdings(keys: List[Tuple]) -> Tuple[numpy.ndarray, Table]:
+    """Group distinct holding identifiers. Returns the group of each key and a
+    table describing each group."""
+    distinct = {}
+    for key in keys:
+        distinct.setdefault(key, len(distinct))
+    idtable = Table(IDKEY + ['amount'], [str] * len(IDKEY) + [float],
+                    [key + (0.,) for key in distinct])
+    aggtable, annotable = graph.group(idtable)
+    groups = numpy.empty(len(distinct), dtype=int)
+    for row in annotable:
+        groups[distinct[tuple(row[:len(IDKEY)])]] = row.group
+    keygroups = groups[numpy.fromiter(map(distinct.__getitem__, keys), int, len(keys))]
+    return keygroups, aggtable.select(['symbol', 'asstype', 'name'])
+
+
+def compute(assets: Table, snaprows: Table, start: datetime.date = None,
+            end: datetime.date = None) -> ExposureHistory:
+    """Compute the exposure of a portfolio at each date with a new snapshot
+    between 'start' and 'end', from the snapshot rows of its ETFs (see
+    snapshots.read()). The dates default to the range of the snapshots."""
+    etf_amounts, stock_amounts = position_amounts(assets)
+    snaprows = snaprows.filter(lambda row: row.etf in etf_amounts)
+    etfcol = snaprows.values('etf')
+    datecol = snaprows.values('date')
+    if not datecol and not stock_amounts:
+        raise ValueError("No snapshots for the ETFs of the portfolio")
+    alldates = sorted(set(datecol)) or [end or start or datetime.date.today()]
+    start = start or alldates[0]
+    end = end or alldates[-1]
+
+    # Match the holdings, treating the single stocks as holdings as well.
+    stock_keys = [('Equity', '', ticker, '', '', '') for ticker in stock_amounts]
+    keys = list(zip(*[snaprows.values(column) for column in IDKEY]))
+    keygroups, holdings = _match_holdings(keys + stock_keys)
+    numgroups = len(holdings)
+
+    # Compute the contribution of each snapshot, as group indexes and amounts.
+    indexes = collections.defaultdict(list)
+    for index, snapkey in enumerate(zip(etfcol, datecol)):
+        indexes[snapkey].append(index)
+    fractions = snaprows.array('fraction')
+    contribs = {}
+    snapdates = collections.defaultdict(list)
+    for (etf, date), rowindexes in indexes.items():
+        rowindexes = numpy.array(rowindexes)
+        contribs[(etf, date)] = (keygroups[rowindexes],
+                                 fractions[rowindexes] * etf_amounts[etf])
+        snapdates[etf].append(date)
+    for dates in snapdates.values():
+        dates.sort()
+    for etf in sorted(set(etf_amounts) - set(snapdates)):
+        logging.warning("No snapshots for %s", etf)
+
+    # Find the snapshots in effect at the start, and the new ones at each date.
+    changes = collections.defaultdict(list)
+    for etf, dates in snapdates.items():
+        index = bisect.bisect_right(dates, start)
+        if index > 0:
+            changes[start].append((etf, dates[index - 1]))
+        for date in dates[index:]:
+            if date <= end:
+                changes[date].append((etf, date))
+    timeline = sorted(set(changes) | {start})
+
+    # Accumulate the changes in exposure from date to date.
+    current = numpy.zeros(numgroups)
+    stockgroups = keygroups[len(keys):]
+    numpy.add.at(current, stockgroups, list(stock_amounts.values()))
+    amounts = numpy.zeros((len(timeline), numgroups))
+    active = {}
+    for index, date in enumerate(timeline):
+        for etf, snapdate in changes[date]:
+            if etf in active:
+                numpy.subtract.at(current, *contribs[(etf, active[etf])])
+            numpy.add.at(current, *contribs[(etf, snapdate)])
+            active[etf] = snapdate
+        amounts[index] = current
+    return ExposureHistory(timeline, holdings, amounts)
+
+
+def to_table(history: ExposureHistory, top: int = None) -> Table:
+    """Convert an exposure history to a table of (date, holding, amount) rows,
+    in order of decreasing maximum amount of the holdings. Optionally, only keep
+    the 'top' holdings."""
+    order = numpy.argsort(-history.amounts.max(axis=0, initial=0), kind='stable')
+    if top is not None:
+        order = order[:top]
+    rows = []
+    for dateindex, date in enumerate(history.dates):
+        for group in order:
+            amount = history.amounts[dateindex, group]
+            if abs(amount) > 1e-6:
+                holding = history.holdings.rows[group]
+                rows.append((date, holding.symbol, holding.asstype, holding.name,
+                             float(amount)))
+    return Table(['date', 'symbol', 'asstype', 'name', 'amount'],
+                 [datetime.date, str, str, str, float], rows)
+
+
+def summarize(history: ExposureHistory, top: int = None) -> Table:
+    """Produce a table of the first and last amounts of each holding."""
+    first, last = history.amounts[0], history.amounts[-1]
+    order = numpy.argsort(-numpy.maximum(first, last), kind='stable')
+    if top is not None:
+        order = order[:top]
+    rows = []
+    for group in order:
+        holding = history.holdings.rows[group]
+        rows.append((holding.symbol, holding.name, float(first[group]),
+                     float(last[group]), float(last[group] - first[group])))
+    return Table(['symbol', 'name', 'first', 'last', 'change'],
+                 [str, str, float, float, float], rows)
+
+
+def main():
+    """Compute the history of the disaggregated exposure of a portfolio."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument('portfolio',
+                        help=('A CSV file which contains the tickers of assets and '
+                              'number of units'))
+    parser.add_argument('--dbdir', default=database.DEFAULT_DIR,
+                        help="Database directory of the downloaded files.")
+    parser.add_argument('--snapdir', default=None,
+                        help="Snapshots directory (default: in the database directory).")
+    parser.add_argument('--no-update', action='store_true',
+                        help="Don't add the new downloads to the snapshots first.")
+    parser.add_argument('-o', '--ignore-options', action='store_true',
+                        help=("Ignore options positions "
+                              "(only works with  Beancount export file)"))
+    parser.add_argument('-l', '--ignore-shorts', action='store_true',
+                        help="Ignore short positions")
+
+    parser.add_argument('--start', type=datetime.date.fromisoformat,
+                        help="First date (YYYY-MM-DD); defaults to the first snapshot.")
+    parser.add_argument('--end', type=datetime.date.fromisoformat,
+                        help="Last date (YYYY-MM-DD); defaults to the last snapshot.")
+    parser.add_argument('-n', '--top', action='store', type=int,
+                        help="Only keep the largest holdings.")
+    parser.add_argument('-T', '--timeseries', action='store',
+                        help="Path to write the time series of the holdings to, as CSV.")
+
+    args = parser.parse_args()
+    db = database.Database(args.dbdir)
+    storedir = args.snapdir or snapshots.getdir(db)
+    if not args.no_update:
+        snapshots.update(db, storedir)
+
+    assets = beansupport.read_portfolio(args.portfolio, args.ignore_options)
+    assets.checkall(['ticker', 'account', 'issuer', 'price', 'quantity'])
+    if args.ignore_shorts:
+        assets = assets.filter(lambda row: row.quantity >= 0)
+
+    etfs = sorted(set(row.ticker for row in assets if row.issuer))
+    snaprows = snapshots.read(storedir, etfs, end=args.end,
+                              columns=['date', 'etf', 'fraction'] + IDKEY)
+    history = compute(assets, snaprows, args.start, args.end)
+    logging.info("Computed exposure over %d dates from %s to %s",
+                 len(history.dates), history.dates[0], history.dates[-1])
+
+    if args.timeseries:
+        with open(args.timeseries, 'w') as outfile:
+            table.write_csv(to_table(history, args.top), outfile)
+    print(summarize(history, args.top or 20))
+
+
+if __name__ == '__main__':
+    main()
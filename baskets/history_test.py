@@ -0,0 +1,65 @@
+"""Unit tests for the exposure history.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import datetime
+
+import numpy
+
+from baskets import history
+from baskets.table import Table
+
+
+# pylint: disable=missing-docstring
+
+
+D1, D2, D3, D4 = [datetime.date(2018, 10, day) for day in (1, 2, 3, 4)]
+
+
+def _snaprows():
+    columns = ['date', 'etf', 'fraction'] + history.IDKEY
+    rows = [
+        # QQQ on D1, then D3.
+        (D1, 'QQQ', 0.5, 'Equity', 'Apple Inc', 'AAPL', '', '', ''),
+        (D1, 'QQQ', 0.5, 'Equity', 'Microsoft Corp', 'MSFT', '', '', ''),
+        (D3, 'QQQ', 1.0, 'Equity', 'Apple Inc', 'AAPL', '', '', ''),
+        # VTI on D2 only, with Apple under another identifier.
+        (D2, 'VTI', 0.25, 'Equity', 'Apple Inc', '', '', '', '037833100'),
+        (D2, 'VTI', 0.75, 'Equity', 'Exxon Mobil', 'XOM', '', '', ''),
+        # Not in the portfolio.
+        (D2, 'SPY', 1.0, 'Equity', 'Tesla', 'TSLA', '', '', ''),
+    ]
+    return Table(columns, [datetime.date, str, float] + [str] * 6, rows).columnar()
+
+
+def test_compute():
+    assets = Table(['ticker', 'account', 'issuer', 'price', 'quantity'],
+                   [str, str, str, float, float],
+                   [('QQQ', 'A', 'PowerShares', 100., 10.),
+                    ('VTI', 'A', 'Vanguard', 100., 2.),
+                    ('VTI', 'B', 'Vanguard', 100., 2.),
+                    ('GOOG', 'B', '', 50., 2.)])
+    hist = history.compute(assets, _snaprows())
+    assert hist.dates == [D1, D2, D3]
+    symbols = hist.holdings.values('symbol')
+    assert sorted(symbols) == ['AAPL', 'GOOG', 'MSFT', 'XOM']
+
+    def amounts(symbol):
+        return hist.amounts[:, symbols.index(symbol)].tolist()
+    assert amounts('AAPL') == [500., 600., 1100.]
+    assert amounts('MSFT') == [500., 500., 0.]
+    assert amounts('XOM') == [0., 300., 300.]
+    assert amounts('GOOG') == [100., 100., 100.]
+
+    # The snapshots in effect at the start are carried forward.
+    hist = history.compute(assets, _snaprows(), start=D2, end=D4)
+    assert hist.dates == [D2, D3]
+    assert numpy.allclose(hist.amounts.sum(axis=1), [1500., 1500.])
+
+    tbl = history.to_table(hist, top=2)
+    assert [(row.date, row.symbol, row.amount) for row in tbl] == [
+        (D2, 'AAPL', 600.), (D2, 'MSFT', 500.), (D3, 'AAPL', 1100.)]
+
+    summary = history.summarize(hist)
+    assert summary.rows[0][:1] + summary.rows[0][2:] == ('AAPL', 600., 1100., 500.)
@@ -0,0 +1,145 @@
+"""Direct HTTP downloads for issuers which expose plain holdings URLs.
+
+Issuer modules which define a 'holdings_url(symbol)' function can be fetched
+with a plain HTTP request instead of launching a browser. Requests go through a
+single pooled session with keep-alive and compression, and are made conditional
+on the validators (ETag and Last-Modified) of the previous download of the same
+URL, so unchanged files aren't transferred again.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import NamedTuple, Optional
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import urllib.parse
+
+import requests
+from requests import adapters
+
+
+# Size of the chunks streamed to disk.
+_CHUNKSIZE = 64 * 1024
+
+
+Fetched = NamedTuple('Fetched', [
+    ('filename', str),   # Name of the written file.
+    ('modified', bool),  # False if the server reported the file unchanged.
+])
+
+
+class FetchError(Exception):
+    """The response did not contain a holdings file."""
+
+
+def has_url(module) -> bool:
+    """Return true if the issuer module supports direct HTTP downloads."""
+    return callable(getattr(module, 'holdings_url', None))
+
+
+def get_filename(resp: requests.Response, default: str) -> str:
+    """Infer the filename of a downloaded file from the response."""
+    disposition = resp.headers.get('Content-Disposition', '')
+    match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', disposition)
+    if match:
+        filename = urllib.parse.unquote(match.group(1))
+    else:
+        filename = urllib.parse.unquote(path.basename(urllib.parse.urlparse(resp.url).path))
+    filename = path.basename(filename.strip())
+    return filename if path.splitext(filename)[1] else default
+
+
+class Fetcher:
+    """A pooled HTTP client with a persistent cache of response validators.
+
+    The cache maps each URL to the validators and filename of its last
+    download. This class is thread-safe.
+    """
+
+    def __init__(self, cache_filename: Optional[str] = None, pool_size: int = 10,
+                 timeout: float = 60.0):
+        self.cache_filename = cache_filename
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self._lock = threading.Lock()
+        self._cache = {}
+        if cache_filename and path.exists(cache_filename):
+            with open(cache_filename) as infile:
+                self._cache = json.load(infile)
+
+    def close(self):
+        self.session.close()
+
+    def _headers(self, url: str) -> dict:
+        """Get the conditional request headers for a URL."""
+        with self._lock:
+            entry = self._cache.get(url)
+        headers = {}
+        if entry and path.exists(entry['filename']):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _update(self, url: str, resp: requests.Response, filename: str):
+        """Record the validators of a response and save the cache."""
+        with self._lock:
+            # A 304 response may omit the validators; keep the previous ones.
+            entry = dict(self._cache[url]) if resp.status_code == 304 else {}
+            for key, header in [('etag', 'ETag'), ('last_modified', 'Last-Modified')]:
+                if header in resp.headers:
+                    entry[key] = resp.headers[header]
+            entry['filename'] = filename
+            self._cache[url] = entry
+            if self.cache_filename:
+                tmpfilename = self.cache_filename + '.tmp'
+                with open(tmpfilename, 'w') as outfile:
+                    json.dump(self._cache, outfile, indent=1, sort_keys=True)
+                os.replace(tmpfilename, self.cache_filename)
+
+    def fetch(self, url: str, outdir: str, default_filename: str) -> Fetched:
+        """Download 'url' to a file in 'outdir'. If the server reports the file
+        unchanged since the last download, the previous file is copied instead."""
+        with self.session.get(url, headers=self._headers(url), stream=True,
+                              timeout=self.timeout) as resp:
+            if resp.status_code == 304:
+                with self._lock:
+                    previous = self._cache[url]['filename']
+                filename = path.join(outdir, path.basename(previous))
+                if path.abspath(previous) != path.abspath(filename):
+                    os.makedirs(outdir, exist_ok=True)
+                    shutil.copyfile(previous, filename)
+                logging.info("Not modified: %s", url)
+                self._update(url, resp, filename)
+                return Fetched(filename, False)
+
+            resp.raise_for_status()
+            if resp.headers.get('Content-Type', '').startswith('text/html'):
+                raise FetchError("Got an HTML page instead of a file from {}".format(url))
+
+            # Stream the decompressed contents to a temporary file so that a
+            # partial download never appears under its final name.
+            filename = path.join(outdir, get_filename(resp, default_filename))
+            os.makedirs(outdir, exist_ok=True)
+            tmpfilename = path.join(outdir, '.{}.part'.format(path.basename(filename)))
+            try:
+                with open(tmpfilename, 'wb') as outfile:
+                    for chunk in resp.iter_content(_CHUNKSIZE):
+                        outfile.write(chunk)
+            except BaseException:
+                os.remove(tmpfilename)
+                raise
+            os.replace(tmpfilename, filename)
+            logging.info("Downloaded %s -> %s", url, filename)
+            self._update(url, resp, filename)
+            return Fetched(filename, True)
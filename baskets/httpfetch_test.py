@@ -0,0 +1,94 @@
+"""Unit tests for direct HTTP downloads.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import gzip
+import http.server
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+
+from baskets import httpfetch
+
+
+# pylint: disable=missing-docstring
+
+
+CONTENTS = b'ticker,fraction\nAAPL,0.6\nMSFT,0.4\n'
+
+
+class HoldingsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve a gzipped holdings file with an ETag, and an HTML page."""
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers)))
+        if self.path.startswith('/page'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write(b'<html></html>')
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = gzip.compress(CONTENTS)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition', 'attachment; filename="holdings-XYZ.csv"')
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), HoldingsHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch(server):
+    url = '{}/holdings?ticker=XYZ'.format(server)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_filename = path.join(tmpdir, 'cache.json')
+        fetcher = httpfetch.Fetcher(cache_filename)
+
+        # First download gets the decompressed file under its server name.
+        fetched = fetcher.fetch(url, path.join(tmpdir, 'day1'), 'XYZ.csv')
+        assert fetched == (path.join(tmpdir, 'day1', 'holdings-XYZ.csv'), True)
+        with open(fetched.filename, 'rb') as infile:
+            assert infile.read() == CONTENTS
+        assert os.listdir(path.join(tmpdir, 'day1')) == ['holdings-XYZ.csv']
+        assert 'gzip' in HoldingsHandler.requests[-1][1]['Accept-Encoding']
+
+        # Second download is conditional and copies the unchanged file.
+        fetcher.close()
+        fetcher = httpfetch.Fetcher(cache_filename)
+        fetched = fetcher.fetch(url, path.join(tmpdir, 'day2'), 'XYZ.csv')
+        assert fetched == (path.join(tmpdir, 'day2', 'holdings-XYZ.csv'), False)
+        assert HoldingsHandler.requests[-1][1]['If-None-Match'] == '"v1"'
+        with open(fetched.filename, 'rb') as infile:
+            assert infile.read() == CONTENTS
+        with open(cache_filename) as infile:
+            assert json.load(infile)[url] == {'etag': '"v1"', 'filename': fetched.filename}
+
+        # An HTML page is not a holdings file.
+        with pytest.raises(httpfetch.FetchError):
+            fetcher.fetch('{}/page'.format(server), path.join(tmpdir, 'day3'), 'XYZ.csv')
+        fetcher.close()
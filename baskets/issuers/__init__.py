@@ -13,18 +13,31 @@ from . import statestreet
 from . import vanguard
 from .meta import nasdaq
 
-MODULES = {
+# Issuers of the holdings of funds.
+HOLDINGS_MODULES = {
     'AmericanFunds': americanfunds,
     'GlobalX': globalx,
-    'Nasdaq': nasdaq,
     'PowerShares': powershares,
     'StateStreet': statestreet,
     'Vanguard': vanguard,
     'iShares': ishares,
 }
 
+# Issuers of other downloads, e.g., the list of all ETFs.
+META_MODULES = {
+    'Nasdaq': nasdaq,
+}
+
+MODULES = dict(HOLDINGS_MODULES, **META_MODULES)
+
 
 def get(issuer: str):
     """Get an issuer implementation.
     This function optionally exits the program on failure."""
     return MODULES.get(issuer)
+
+
+def get_holdings(issuer: str):
+    """Get the implementation of an issuer of holdings, or None for unknown
+    and meta issuers, whose downloads aren't holdings."""
+    return HOLDINGS_MODULES.get(issuer)
@@ -4,9 +4,6 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 import logging
-import time
-
-import requests
 
 from baskets import driverlib
 from baskets.table import Table
@@ -14,16 +11,20 @@ from baskets import table
 from baskets import utils
 
 
+def holdings_url(symbol: str) -> str:
+    """Get the URL of the full holdings file."""
+    return ('https://www.globalxfunds.com/funds/{}/'.format(symbol.lower()) +
+            '?download_full_holdings=true')
+
+
 def download(driver, symbol: str):
     """Get the list of holdings for Global X."""
 
-    # Note: This works too, but doesn't get us the default filename.
-    # resp = requests.get(url, params={'download_full_holdings': 'true'})
+    # Note: A plain HTTP request for holdings_url() works too (see httpfetch).
 
     # Note: This somehow doesn't work in headless mode. I don't know why.
 
-    url = ('https://www.globalxfunds.com/funds/{}/'.format(symbol.lower()) +
-           '?download_full_holdings=true')
+    url = holdings_url(symbol)
     logging.info("Opening %s", url)
     driver.get(url)
 
@@ -15,12 +15,17 @@ import requests
 from baskets import table
 
 
-def download(unused_driver, _: str) -> Dict[str, str]:
+def holdings_url(_: str) -> str:
+    """Get the URL of the list of all ETFs."""
+    return ('https://www.nasdaq.com'
+            '/investing/etfs/etf-finder-results.aspx'
+            '?download=Yes')
+
+
+def download(unused_driver, symbol: str) -> Dict[str, str]:
     """Download a list of ETF ticker to issuer name."""
 
-    resp = requests.get('https://www.nasdaq.com'
-                        '/investing/etfs/etf-finder-results.aspx'
-                        '?download=Yes')
+    resp = requests.get(holdings_url(symbol))
     tempdir = tempfile.gettempdir()
     filename = path.join(tempdir, 'etflist.csv')
     with open(filename, 'w') as outfile:
@@ -30,15 +35,15 @@ def download(unused_driver, _: str) -> Dict[str, str]:
 
 def parse(filename: str) -> table.Table:
     """Parse the NASDAQ ETFs list."""
-    tbl = table.read_csv(filename)
     outrows = []
-    for row in tbl:
-        for regexp, issuer in [('Vanguard', 'Vanguard'),
-                               ('iShares', 'iShares'),
-                               ('PowerShares', 'PowerShares'),
-                               ('StateStreet', 'StateStreet')]:
-            if re.search(regexp, row.name):
-                outrows.append((row.symbol, issuer, row.name))
-                break
+    for chunk in table.iter_csv(filename):
+        for row in chunk:
+            for regexp, issuer in [('Vanguard', 'Vanguard'),
+                                   ('iShares', 'iShares'),
+                                   ('PowerShares', 'PowerShares'),
+                                   ('StateStreet', 'StateStreet')]:
+                if re.search(regexp, row.name):
+                    outrows.append((row.symbol, issuer, row.name))
+                    break
 
     return table.Table(['ticker', 'issuer', 'name'], [str, str, str], outrows)
@@ -11,6 +11,12 @@ from baskets import utils
 from baskets.table import Table
 
 
+def holdings_url(symbol: str) -> str:
+    """Get the URL of the holdings CSV file, as linked from the product page."""
+    return ("https://www.invesco.com/us/financial-products/etfs/holdings/main/holdings/0"
+            "?audienceType=Investor&action=download&ticker={}".format(symbol))
+
+
 def download(driver, symbol: str):
     """Get the list of holdings for Vanguard."""
 
@@ -73,10 +73,12 @@ def parse(filename: str) -> Dict[str, Table]:
     values_table = table.concat(*tables)
     # pylint: disable=bad-continuation
     return (utils.create_fraction_from_market_value(values_table, 'market_value')
+            .lazy()
             .map('ticker', lambda ticker: ticker if ticker != '-' else '')
             .rename(('holdings', 'name'))
             .map('sedol', utils.empty_dashes)
-    	    .select(['fraction', 'asstype', 'name', 'ticker', 'sedol']))
+            .select(['fraction', 'asstype', 'name', 'ticker', 'sedol'])
+            .collect())
 
 
 def pct_to_fraction(string: str) -> float:
@@ -89,19 +91,21 @@ def pct_to_fraction(string: str) -> float:
 
 def parse_equity(tbl: Table) -> Table:
     """Parse the Equity table."""
-    return (tbl
+    return (tbl.lazy()
             .create('asstype', lambda _: 'Equity')
             .map('ticker', str.strip)
-            .select(VALUES_COLUMNS))
+            .select(VALUES_COLUMNS)
+            .collect())
 
 
 def parse_fixed_income(tbl: Table) -> Table:
     """Parse the Fixed income table."""
-    return (tbl
+    return (tbl.lazy()
             .create('asstype', lambda _: 'FixedIncome')
             .create('ticker', lambda _: '')
             .update('sedol', lambda row: row.sedol if row.sedol != '-' else '')
-            .select(VALUES_COLUMNS))
+            .select(VALUES_COLUMNS)
+            .collect())
 
 
 def parse_shortterm_reserves(tbl: Table) -> Table:
@@ -112,9 +116,10 @@ def parse_shortterm_reserves(tbl: Table) -> Table:
             index = tbl.columns.index(fname)
             break
     assert index is not None
-    return (tbl
+    return (tbl.lazy()
             .create('asstype', lambda _: 'ShortTerm')
             .rename((fname, 'market_value'))
             .create('ticker', lambda _: '')
             .update('sedol', lambda row: row.sedol if row.sedol != '-' else '')
-            .select(VALUES_COLUMNS))
+            .select(VALUES_COLUMNS)
+            .collect())
@@ -0,0 +1,116 @@
+"""Find and load the holdings of the positions of portfolios.
+
+The latest holdings file of each ETF position is found in the database and
+parsed (through the cache of parsed tables) into normalized holdings, over a
+pool of processes if requested. Single stock positions are their own holdings.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, List, Optional, Tuple
+import concurrent.futures
+import logging
+
+import numpy
+
+from baskets.table import Table
+from baskets import table
+from baskets import database
+from baskets import issuers
+from baskets import normalize
+from baskets import parsecache
+
+
+def parse_holdings(issuer: str, filename: str, use_cache: bool = True) -> Table:
+    """Parse and normalize a holdings file. The table is columnar, so the
+    fixups applied to it only add, drop and reorder column arrays instead of
+    copying every row, and it is cheap to send between processes."""
+    module = issuers.get(issuer)
+    if use_cache:
+        holdings = parsecache.parse(module, filename)
+    else:
+        holdings = module.parse(filename)
+    normalize.check_holdings(holdings)
+    return normalize.add_missing_columns(holdings.columnar())
+
+
+def _parse_job(job: Tuple[str, str, bool]) -> Tuple[Optional[Table], Optional[str]]:
+    issuer, filename, use_cache = job
+    logging.info("Parsing file '%s' with '%s'", filename, issuer)
+    try:
+        return parse_holdings(issuer, filename, use_cache), None
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.debug("Error parsing '%s'", filename, exc_info=True)
+        return None, '{}: {}'.format(type(exc).__name__, exc)
+
+
+def parse_all(jobs: List[Tuple[str, str]], use_cache: bool = True,
+              num_workers: int = 1) -> List[Tuple[Optional[Table], Optional[str]]]:
+    """Parse the holdings files of a list of (issuer, filename) jobs, over a pool
+    of processes if 'num_workers' is more than one. Returns a (table, error)
+    pair for each job, in order; exactly one of them is None."""
+    unique = list(dict.fromkeys(jobs))
+    args = [(issuer, filename, use_cache) for issuer, filename in unique]
+    if num_workers > 1 and len(args) > 1:
+        num_workers = min(num_workers, len(args))
+        with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+            results = list(executor.map(_parse_job, args))
+    else:
+        results = [_parse_job(arg) for arg in args]
+    byjob = dict(zip(unique, results))
+    return [byjob[job] for job in jobs]
+
+
+def find_files(db: database.Database, assets: Table, ignore_shorts: bool = False,
+               ignore_missing_issuer: bool = False) -> List[Tuple[Any, Optional[str]]]:
+    """Find the latest holdings file of each position of a portfolio. Returns
+    (row, filename) pairs, where the filename is None for single stocks. The
+    positions whose holdings are unavailable are logged and skipped."""
+    positions = []
+    for row in assets:
+        if row.quantity < 0 and ignore_shorts:
+            continue
+
+        filename = None
+        if row.issuer:
+            downloader = issuers.get(row.issuer)
+            if downloader is None:
+                message = "Missing issuer: {}".format(row.issuer)
+                if ignore_missing_issuer:
+                    logging.error(message)
+                    continue
+                else:
+                    raise SystemExit(message)
+
+            filename = database.getlatest(db, row.ticker)
+            if filename is None:
+                logging.error("Missing file for %s", row.ticker)
+                continue
+
+            if not hasattr(downloader, 'parse'):
+                logging.error("Parser for %s is not implemented", row.ticker)
+                continue
+        positions.append((row, filename))
+    return positions
+
+
+def stock_holdings(ticker: str) -> Table:
+    """Make the normalized holdings of a single stock position."""
+    holdings = Table(['fraction', 'asstype', 'ticker'], [float, str, str],
+                     [[1.0, 'Equity', ticker]])
+    return normalize.add_missing_columns(holdings.columnar())
+
+
+def position_holdings(holdings: Table, ticker: str, account: str,
+                      dollar_amount: float) -> Table:
+    """Make the holdings of a position from the normalized holdings of its ETF,
+    with the parent ETF and account, and the dollar amount of each row instead
+    of its fraction. The columns are computed as whole arrays."""
+    holdings = holdings.columnar().select(normalize.COLUMNS[2:])
+    num = len(holdings)
+    arrays = ([numpy.full(num, ticker, dtype=object),
+               numpy.full(num, account, dtype=object)] +
+              holdings.rows.arrays[1:] +
+              [holdings.array('fraction').astype(float) * dollar_amount])
+    return Table(normalize.COLUMNS[:2] + normalize.COLUMNS[3:] + ['amount'],
+                 [str, str] + holdings.types[1:] + [float], table.Columns(arrays))
@@ -0,0 +1,45 @@
+"""Unit tests for the loading of the holdings of positions.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+
+import pytest
+
+from baskets import loader
+from baskets import normalize
+from baskets import table
+
+
+# pylint: disable=missing-docstring
+
+
+def _write(dirname, etf, rows):
+    filename = path.join(dirname, '{}.csv'.format(etf))
+    with open(filename, 'w') as outfile:
+        outfile.write('HoldingsTicker,SecurityNum,Name,MarketValue\n')
+        for ticker, value in rows:
+            outfile.write('{0},{0}123,{0} Inc,"${1:,}"\n'.format(ticker, value))
+    return filename
+
+
+@pytest.mark.parametrize('num_workers', [1, 3])
+def test_parse_all(tmp_path, num_workers):
+    qqq = _write(str(tmp_path), 'QQQ', [('AAPL', 3000), ('MSFT', 1000)])
+    pbw = _write(str(tmp_path), 'PBW', [('TSLA', 500)])
+    bad = path.join(str(tmp_path), 'BAD.csv')
+    with open(bad, 'w') as outfile:
+        outfile.write('Nothing,Useful\n')
+    jobs = [('PowerShares', qqq), ('PowerShares', bad), ('PowerShares', pbw),
+            ('PowerShares', qqq)]
+    results = loader.parse_all(jobs, use_cache=False, num_workers=num_workers)
+    assert len(results) == 4
+    (holdings1, error1), (holdings2, error2), (holdings3, _), (holdings4, _) = results
+    assert error1 is None and error2 is not None and holdings2 is None
+    assert isinstance(holdings1.rows, table.Columns)
+    assert set(normalize.IDCOLUMNS) <= set(holdings1.columns)
+    assert holdings1.values('ticker') == ['AAPL', 'MSFT']
+    assert list(holdings1.values('fraction')) == [0.75, 0.25]
+    assert holdings3.values('ticker') == ['TSLA']
+    assert list(holdings4) == list(holdings1)
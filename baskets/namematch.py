@@ -0,0 +1,237 @@
+"""Fuzzy matching of the names of holdings without identifiers.
+
+Some issuers (e.g., GlobalX) don't provide any identifier for their holdings,
+so those can only be matched by name, and exact matches of normalized names
+(see graph.name_key) miss many of them. Comparing all pairs of names is
+quadratic, so the names are indexed with MinHash signatures of their character
+n-grams, with locality-sensitive hashing: the signatures are cut in bands and
+only names sharing a band (and an asset type) are compared, by the Jaccard
+similarity of their n-grams.
+
+Every holding with a name gets a link on its own name, and a holding without
+identifiers also gets a link on the most similar other name over a threshold.
+Holdings with identifiers are never linked to each other this way, so similar
+names of distinct securities (e.g., two share classes) aren't merged.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import List, Optional, Set, Tuple
+import hashlib
+import itertools
+import logging
+import zlib
+
+import numpy
+
+from baskets import graph
+from baskets.table import Table
+
+
+# Prime modulus of the hash functions of the signatures.
+_PRIME = (1 << 31) - 1
+
+# Maximum number of n-grams to process at once, to bound memory use.
+_CHUNK_SIZE = 1 << 16
+
+
+def ngrams(key: str, size: int = 3) -> Set[str]:
+    """Get the character n-grams of a normalized name, padded with spaces."""
+    padded = ' {} '.format(key)
+    if len(padded) <= size:
+        return {padded}
+    return {padded[index:index + size] for index in range(len(padded) - size + 1)}
+
+
+def jaccard(set1: Set[str], set2: Set[str]) -> float:
+    """Compute the Jaccard similarity of two sets."""
+    if not set1 and not set2:
+        return 1.
+    return len(set1 & set2) / len(set1 | set2)
+
+
+def holdings_keys(holdings: Table) -> List[Tuple[str, str]]:
+    """Get the (asset type, normalized name) pairs of the rows of a holdings
+    table. The normalized name is empty for rows without a name."""
+    return [(asstype, graph.name_key(name) if name and name != '-' else '')
+            for asstype, name in zip(holdings.values('asstype'),
+                                     holdings.values('name'))]
+
+
+class NameIndex:
+    """An index of (asset type, normalized name) pairs for similarity queries.
+
+    'threshold' is the minimum Jaccard similarity of the n-grams of matching
+    names. The signatures have 'num_perm' hash values cut into 'bands' bands;
+    with r = num_perm / bands values per band, names are compared when their
+    similarity s is likely over (1 / bands) ** (1 / r), with probability
+    1 - (1 - s ** r) ** bands. Only the first 'max_bucket' names of a bucket are
+    compared, so very common bands don't degrade to pairwise comparisons."""
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 64, bands: int = 16,
+                 size: int = 3, max_bucket: int = 64, seed: int = 0):
+        assert num_perm % bands == 0, "The bands must divide the signatures evenly"
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.size = size
+        self.max_bucket = max_bucket
+        rand = numpy.random.RandomState(seed)
+        self.coefs = rand.randint(1, _PRIME, num_perm).astype(numpy.uint64)
+        self.offsets = rand.randint(0, _PRIME, num_perm).astype(numpy.uint64)
+        self.band_coefs = rand.randint(1, _PRIME, self.rows).astype(numpy.uint64)
+        self.band_salts = rand.randint(0, _PRIME, bands).astype(numpy.uint64)
+        self.vocab = {}     # n-gram -> row of its values in 'gram_values'.
+        self.gram_values = numpy.full((1, num_perm), numpy.iinfo(numpy.uint32).max,
+                                      dtype=numpy.uint32)
+        self.items = []     # (asstype, key) of each indexed name.
+        self.ids = {}       # (asstype, key) -> index in 'items'.
+        self.grams = []     # n-grams of each indexed name.
+        self.hashes = numpy.empty((0, bands), dtype=numpy.int64)
+
+        # The buckets of each asset type, as the sorted band hashes of its
+        # names and the corresponding indexes of the names.
+        self.buckets = {}
+
+    def _gram_ids(self, grams: List[Set[str]]) -> numpy.ndarray:
+        """Map n-grams to the rows of their hash values, hashing new ones."""
+        vocab = self.vocab
+        start = len(vocab)
+        ids = numpy.fromiter((vocab.setdefault(gram, len(vocab) + 1)
+                              for gramset in grams for gram in gramset),
+                             dtype=numpy.int64, count=sum(map(len, grams)))
+        if len(vocab) > start:
+            hashes = numpy.fromiter((zlib.crc32(gram.encode('utf8'))
+                                     for gram in itertools.islice(vocab, start, None)),
+                                    dtype=numpy.uint64, count=len(vocab) - start)
+            values = (hashes[:, None] * self.coefs + self.offsets) % _PRIME
+            self.gram_values = numpy.concatenate(
+                [self.gram_values, values.astype(numpy.uint32)])
+        return ids
+
+    def signatures(self, grams: List[Set[str]]) -> numpy.ndarray:
+        """Compute the MinHash signatures of sets of n-grams, one per row."""
+        ids = self._gram_ids(grams)
+        lengths = numpy.fromiter(map(len, grams), dtype=numpy.int64, count=len(grams))
+        starts = numpy.cumsum(lengths) - lengths
+        signatures = numpy.empty((len(grams), len(self.coefs)), dtype=numpy.uint32)
+
+        # Process the sets by increasing size, padding the n-grams of the sets of
+        # each chunk to the same size with the row of maximum values.
+        order = numpy.argsort(lengths, kind='stable')
+        sorted_lengths = lengths[order]
+        start = 0
+        while start < len(grams):
+            width = sorted_lengths[min(start + _CHUNK_SIZE // sorted_lengths[start],
+                                       len(grams)) - 1]
+            chunk = order[start:start + max(1, _CHUNK_SIZE // width)]
+            chunk_lengths = lengths[chunk]
+            mask = numpy.arange(chunk_lengths.max()) < chunk_lengths[:, None]
+            offsets = numpy.cumsum(chunk_lengths) - chunk_lengths
+            flat = (numpy.repeat(starts[chunk] - offsets, chunk_lengths) +
+                    numpy.arange(mask.sum()))
+            padded = numpy.zeros(mask.shape, dtype=numpy.int64)
+            padded[mask] = ids[flat]
+            signatures[chunk] = self.gram_values[padded].min(axis=1)
+            start += len(chunk)
+        return signatures
+
+    def band_hashes(self, signatures: numpy.ndarray) -> numpy.ndarray:
+        """Hash each band of signatures to a single integer, distinct across
+        bands, one row per signature."""
+        bands = signatures.astype(numpy.uint64).reshape(
+            len(signatures), self.bands, self.rows)
+        hashes = (bands * self.band_coefs).sum(axis=2) + self.band_salts
+        return hashes.astype(numpy.int64)
+
+    def add(self, items: List[Tuple[str, str]]):
+        """Index (asset type, normalized name) pairs."""
+        new = [item for item in dict.fromkeys(items)
+               if item not in self.ids and item[1]]
+        if not new:
+            return
+        first = len(self.items)
+        grams = [ngrams(key, self.size) for _, key in new]
+        self.hashes = numpy.concatenate([self.hashes,
+                                         self.band_hashes(self.signatures(grams))])
+        self.items.extend(new)
+        self.grams.extend(grams)
+        for index, item in enumerate(new, first):
+            self.ids[item] = index
+
+        # Merge the new names into the buckets. The sort is stable, so the names
+        # of each bucket remain in the order they were indexed.
+        indexes = numpy.arange(first, len(self.items))
+        asstypes = numpy.array([asstype for asstype, _ in new], dtype=object)
+        for asstype in sorted(set(asstypes)):
+            selected = indexes[asstypes == asstype]
+            empty = numpy.empty(0, dtype=numpy.int64)
+            old_hashes, old_indexes = self.buckets.get(asstype, (empty, empty))
+            hashes = numpy.concatenate([old_hashes, self.hashes[selected].ravel()])
+            names = numpy.concatenate([old_indexes, numpy.repeat(selected, self.bands)])
+            order = numpy.argsort(hashes, kind='stable')
+            self.buckets[asstype] = (hashes[order], names[order])
+
+    def digest(self) -> str:
+        """Compute a hash of the indexed names, in order, and of the parameters
+        of the index, which together determine the matches."""
+        sha = hashlib.sha256(repr((self.threshold, self.bands, self.rows, self.size,
+                                   self.max_bucket)).encode('utf8'))
+        for asstype, key in self.items:
+            sha.update('{}\t{}\n'.format(asstype, key).encode('utf8'))
+        return sha.hexdigest()
+
+    def best_match(self, asstype: str, key: str) -> Optional[str]:
+        """Find the most similar other indexed name of the same asset type, if
+        its similarity is over the threshold. The name must be indexed. Ties go
+        to the name indexed first."""
+        index = self.ids[(asstype, key)]
+        hashes, names = self.buckets[asstype]
+        lows = numpy.searchsorted(hashes, self.hashes[index], 'left')
+        highs = numpy.searchsorted(hashes, self.hashes[index], 'right')
+        candidates = set()
+        for low, high in zip(lows.tolist(), highs.tolist()):
+            candidates.update(names[low:min(high, low + self.max_bucket)].tolist())
+        candidates.discard(index)
+        gramset = self.grams[index]
+        best, best_score = None, self.threshold
+        for candidate in sorted(candidates):
+            score = jaccard(gramset, self.grams[candidate])
+            if score >= best_score and (best is None or score > best_score):
+                best, best_score = candidate, score
+        return self.items[best][1] if best is not None else None
+
+    def links(self, holdings: Table, rowlinks: List[List[Tuple]]) -> List[List[Tuple]]:
+        """Add the links of similar names to the links of the rows of a holdings
+        table (e.g., from graph.holdings_links)."""
+        keys = holdings_keys(holdings)
+        self.add(keys)
+        identified = [any(value and value != '-' for value in values)
+                      for values in zip(*[holdings.values(column)
+                                          for column in graph.LINK_COLUMNS])]
+        matches = {}
+        newlinks = []
+        for links, (asstype, key), has_ids in zip(rowlinks, keys, identified):
+            links = list(links)
+            if key:
+                links.append(('fuzzy_name', (asstype, key)))
+                if not has_ids:
+                    if (asstype, key) not in matches:
+                        matches[(asstype, key)] = self.best_match(asstype, key)
+                    match = matches[(asstype, key)]
+                    if match is not None:
+                        links.append(('fuzzy_name', (asstype, match)))
+            newlinks.append(links)
+        logging.info("Fuzzy name matches: %d / %d unidentified names",
+                     sum(1 for match in matches.values() if match is not None),
+                     len(matches))
+        return newlinks
+
+
+def fuzzy_links(holdings: Table, rowlinks: List[List[Tuple]] = None,
+                threshold: float = 0.7) -> List[List[Tuple]]:
+    """Compute the links of the rows of a holdings table, including fuzzy
+    matches of the names of the rows without identifiers."""
+    if rowlinks is None:
+        rowlinks = graph.holdings_links(holdings)
+    return NameIndex(threshold).links(holdings, rowlinks)
@@ -0,0 +1,61 @@
+"""Unit tests for the fuzzy matching of names.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import random
+import string
+
+import numpy
+
+from baskets import graph
+from baskets import namematch
+from baskets.table import Table
+
+
+# pylint: disable=missing-docstring
+
+
+COLUMNS = ['etf', 'asstype', 'name', 'ticker', 'sedol', 'isin', 'cusip', 'amount']
+
+
+def test_signatures_chunks(monkeypatch):
+    index = namematch.NameIndex()
+    grams = [namematch.ngrams(key) for key in ['apple', 'microsoft', 'a', 'tesla motors']]
+    expected = index.signatures(grams)
+    monkeypatch.setattr(namematch, '_CHUNK_SIZE', 8)
+    assert numpy.array_equal(index.signatures(grams), expected)
+    assert numpy.array_equal(index.signatures(grams[1:2]), expected[1:2])
+
+
+def test_best_match():
+    index = namematch.NameIndex(0.7)
+    rand = random.Random(0)
+    noise = [''.join(rand.choice(string.ascii_lowercase) for _ in range(12))
+             for _ in range(2000)]
+    index.add([('Equity', key) for key in noise])
+    index.add([('Equity', 'alibaba group holding'),
+               ('Equity', 'alibaba grp holding'),
+               ('FixedIncome', 'alibaba grp holding')])
+    assert index.best_match('Equity', 'alibaba grp holding') == 'alibaba group holding'
+    assert index.best_match('FixedIncome', 'alibaba grp holding') is None
+    assert index.best_match('Equity', noise[0]) is None
+
+
+def test_group_with_fuzzy_links():
+    holdings = Table(COLUMNS, [str] * 7 + [float], [
+        ('VTI', 'Equity', 'Alibaba Group Holding', 'BABA', '', '', '', 10.),
+        ('CHIQ', 'Equity', 'Alibaba Grp Holding', '', '', '', '', 5.),
+        ('VTI', 'Equity', 'Alphabet Inc Class A', 'GOOGL', '', '', '', 4.),
+        ('VTI', 'Equity', 'Alphabet Inc Class C', 'GOOG', '', '', '', 3.),
+        ('CHIQ', 'FixedIncome', 'Alibaba Grp Holding', '', '', '', '', 1.),
+    ])
+    aggtable, _ = graph.group(holdings)
+    assert len(aggtable) == 5
+    aggtable, annotable = graph.group(holdings, rowlinks=namematch.fuzzy_links(holdings))
+    assert [tuple(row) for row in aggtable] == [
+        ('BABA', 'Equity', 'Alibaba Group Holding', 15.),
+        ('GOOGL', 'Equity', 'Alphabet Inc Class A', 4.),
+        ('GOOG', 'Equity', 'Alphabet Inc Class C', 3.),
+        ('', 'FixedIncome', 'Alibaba Grp Holding', 1.)]
+    assert annotable.values('group') == [0, 0, 1, 2, 3]
@@ -0,0 +1,58 @@
+"""Normalized schema of parsed holdings tables.
+
+The issuer parsers produce tables with a fraction, an asset type and any of
+a set of identifier columns. This module defines that schema and the functions
+to check and complete parsed tables, shared by the tools which consume them.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+import logging
+
+from baskets.table import Table
+
+
+def normalize_holdings_table(tbl: Table) -> Table:
+    """The assets don't actually sum to 100%, normalize them."""
+    total = sum([row.fraction for row in tbl])
+    if not 0.98 < total < 1.02:
+        logging.error("Total weight seems invalid: %s", total)
+    scale = 1. / total
+    return tbl.map('fraction', lambda f: f*scale)
+
+
+ASSTYPES = {'Equity', 'FixedIncome', 'ShortTerm'}
+IDCOLUMNS = ['name', 'ticker', 'sedol', 'isin', 'cusip']
+COLUMNS = ['etf', 'account', 'fraction', 'asstype'] + IDCOLUMNS
+
+
+def check_holdings(holdings: Table):
+    """Check that the holdings Table has the required columns."""
+    actual = set(holdings.columns)
+
+    allowed = {'asstype', 'fraction'} | set(IDCOLUMNS)
+    other = actual - allowed
+    assert not other, "Extra columns found: {}".format(other)
+
+    required = {'asstype', 'fraction'}
+    assert required.issubset(actual), (
+        "Required columns missing: {}".format(required - actual))
+
+    assert set(IDCOLUMNS) & actual, "No ids columns found: {}".format(actual)
+    assert all(cls in ASSTYPES for cls in holdings.values('asstype'))
+
+    # Check that '-' don't appear in identifier columns.
+    for column in IDCOLUMNS:
+        if column not in holdings.columns:
+            continue
+        values = holdings.values(column)
+        if '-' in values:
+            raise ValueError("Invalid value '-' in column '{}'".format(column))
+
+
+def add_missing_columns(tbl: Table) -> Table:
+    """Add empty identifier columns to the table."""
+    for column in IDCOLUMNS:
+        if column not in tbl.columns:
+            tbl = tbl.create(column, lambda _: '')
+    return tbl
@@ -0,0 +1,105 @@
+"""Cache of parsed holdings tables.
+
+Raw holdings files never change once they are stored in the database, but
+parsing some of them is slow (e.g. loading Excel workbooks). The parsed tables
+are pickled in a hidden directory next to the raw files, keyed by the hash of
+the raw file's contents and the version of the parser. The parser version is a
+hash of the source of the issuer module and of all the modules of this package
+it uses, so modifying a parser invalidates its cached tables automatically.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import functools
+import hashlib
+import io
+import logging
+import os
+import pickle
+import re
+import sys
+import types
+from typing import List
+
+from baskets import database
+from baskets import table
+from baskets.table import Table
+
+
+# Name of the directory of cached tables, in the directory of the raw files.
+CACHE_DIR = '.parsed'
+
+def dependencies(module: types.ModuleType) -> List[types.ModuleType]:
+    """Find the modules of this package a module uses, directly or not,
+    including itself, in order of name."""
+    found = {}
+    pending = [module]
+    while pending:
+        mod = pending.pop()
+        if mod.__name__ in found or not getattr(mod, '__file__', None):
+            continue
+        found[mod.__name__] = mod
+        for value in vars(mod).values():
+            if not isinstance(value, types.ModuleType):
+                value = sys.modules.get(getattr(value, '__module__', None) or '')
+            if value is not None and value.__name__.startswith('baskets.'):
+                pending.append(value)
+    return [found[name] for name in sorted(found)]
+
+
+@functools.lru_cache()
+def parser_version(module: types.ModuleType) -> str:
+    """Compute the version of an issuer's parser from its source code and the
+    source code of the modules it uses."""
+    sha = hashlib.sha256()
+    for mod in dependencies(module):
+        with open(mod.__file__, 'rb') as infile:
+            sha.update(infile.read())
+    return sha.hexdigest()
+
+
+def content_hash(tbl: Table) -> str:
+    """Compute a hash of the contents of a parsed table. Tables with the same
+    columns and rows have the same hash, regardless of their storage."""
+    oss = io.StringIO()
+    table.write_csv(tbl, oss)
+    return hashlib.sha256(oss.getvalue().encode('utf8')).hexdigest()
+
+
+def cache_filename(filename: str, rawhash: str, version: str) -> str:
+    """Get the name of the cached table for a raw file."""
+    return path.join(path.dirname(filename), CACHE_DIR, '{}.{}.{}.pickle'.format(
+        path.basename(filename), rawhash[:16], version[:16]))
+
+
+def parse(module: types.ModuleType, filename: str) -> Table:
+    """Parse a holdings file with an issuer module, or get it from the cache."""
+    cachename = cache_filename(filename, database.hash_file(filename),
+                               parser_version(module))
+    if path.exists(cachename):
+        try:
+            with open(cachename, 'rb') as infile:
+                return pickle.load(infile)
+        except Exception:  # pylint: disable=broad-except
+            logging.warning("Invalid cached table %s; parsing again", cachename,
+                            exc_info=True)
+
+    tbl = module.parse(filename)
+
+    # Replace the stale tables for this file and write the new one atomically.
+    cachedir = path.dirname(cachename)
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        stale = re.compile(r'{}\.[0-9a-f]{{16}}\.[0-9a-f]{{16}}\.pickle$'.format(
+            re.escape(path.basename(filename))))
+        for stalename in os.listdir(cachedir):
+            if stale.match(stalename):
+                os.remove(path.join(cachedir, stalename))
+        tmpname = '{}.{}.tmp'.format(cachename, os.getpid())
+        with open(tmpname, 'wb') as outfile:
+            pickle.dump(tbl, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, cachename)
+    except OSError:
+        logging.warning("Could not cache parsed table for %s", filename, exc_info=True)
+    return tbl
@@ -0,0 +1,92 @@
+"""Unit tests for the cache of parsed holdings.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import os
+import tempfile
+import types
+
+from baskets import parsecache
+from baskets import table
+
+
+# pylint: disable=missing-docstring
+
+
+def test_parse(monkeypatch):
+    calls = []
+    def parse(filename):
+        calls.append(filename)
+        with open(filename) as infile:
+            return table.read_csv(infile, infer=True)
+    module = types.SimpleNamespace(parse=parse)
+    versions = iter(['a' * 64, 'a' * 64, 'a' * 64, 'b' * 64])
+    monkeypatch.setattr(parsecache, 'parser_version', lambda _: next(versions))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = path.join(tmpdir, 'holdings.csv')
+        with open(filename, 'w') as outfile:
+            outfile.write('ticker,fraction\nAAPL,0.6\nMSFT,0.4\n')
+
+        tbl = parsecache.parse(module, filename)
+        cached = parsecache.parse(module, filename)
+        assert calls == [filename]
+        assert cached.columns == tbl.columns
+        assert cached.types == tbl.types
+        assert list(cached) == list(tbl)
+        assert cached.Row is tbl.Row
+
+        # Changing the file or the parser version invalidates the cache.
+        with open(filename, 'w') as outfile:
+            outfile.write('ticker,fraction\nAAPL,1.0\n')
+        assert list(parsecache.parse(module, filename).itervalues('fraction')) == [1.0]
+        parsecache.parse(module, filename)
+        assert len(calls) == 3
+        assert len(os.listdir(path.join(tmpdir, parsecache.CACHE_DIR))) == 1
+
+
+def test_parser_version():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        modules = {}
+        for name in 'issuer', 'helpers':
+            module = types.ModuleType('baskets.{}'.format(name))
+            module.__file__ = path.join(tmpdir, '{}.py'.format(name))
+            with open(module.__file__, 'w') as outfile:
+                outfile.write('# {}\n'.format(name))
+            modules[name] = module
+        calls = []
+        def parse(filename):
+            calls.append(filename)
+            with open(filename) as infile:
+                return table.read_csv(infile, infer=True)
+        modules['issuer'].helpers = modules['helpers']
+        modules['issuer'].Table = table.Table
+        assert [module.__name__ for module in parsecache.dependencies(
+            modules['issuer'])] == ['baskets.helpers', 'baskets.issuer',
+                                    'baskets.table']
+        modules['issuer'].parse = parse
+
+        # Changing a module the parser uses invalidates the cached tables.
+        filename = path.join(tmpdir, 'holdings.csv')
+        with open(filename, 'w') as outfile:
+            outfile.write('ticker,fraction\nAAPL,1.0\n')
+        parsecache.parser_version.cache_clear()
+        version = parsecache.parser_version(modules['issuer'])
+        parsecache.parse(modules['issuer'], filename)
+        parsecache.parse(modules['issuer'], filename)
+        assert len(calls) == 1
+        with open(modules['helpers'].__file__, 'a') as outfile:
+            outfile.write('# changed\n')
+        parsecache.parser_version.cache_clear()
+        assert parsecache.parser_version(modules['issuer']) != version
+        parsecache.parse(modules['issuer'], filename)
+        assert len(calls) == 2
+
+
+def test_content_hash():
+    tbl = table.Table(['ticker', 'fraction'], [str, float],
+                      [('AAPL', 0.6), ('MSFT', 0.4)])
+    assert parsecache.content_hash(tbl) == parsecache.content_hash(tbl.columnar())
+    assert parsecache.content_hash(tbl) != parsecache.content_hash(tbl.head(1))
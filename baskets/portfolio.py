@@ -3,7 +3,10 @@
 __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
+from os import path
+from typing import Callable, Dict, List, Tuple
 import argparse
+import collections
 import logging
 
 import numpy
@@ -12,54 +15,47 @@ from baskets.table import Table
 from baskets import table
 from baskets import beansupport
 from baskets import database
-from baskets import issuers
+from baskets import disaggregate
+from baskets import loader
+from baskets import namematch
 from baskets import graph
-
-
-def normalize_holdings_table(tbl: Table) -> Table:
-    """The assets don't actually sum to 100%, normalize them."""
-    total = sum([row.fraction for row in tbl])
-    if not 0.98 < total < 1.02:
-        logging.error("Total weight seems invalid: %s", total)
-    scale = 1. / total
-    return tbl.map('fraction', lambda f: f*scale)
-
-
-ASSTYPES = {'Equity', 'FixedIncome', 'ShortTerm'}
-IDCOLUMNS = ['name', 'ticker', 'sedol', 'isin', 'cusip']
-COLUMNS = ['etf', 'account', 'fraction', 'asstype'] + IDCOLUMNS
-
-
-def check_holdings(holdings: Table):
-    """Check that the holdings Table has the required columns."""
-    actual = set(holdings.columns)
-
-    allowed = {'asstype', 'fraction'} | set(IDCOLUMNS)
-    other = actual - allowed
-    assert not other, "Extra columns found: {}".format(other)
-
-    required = {'asstype', 'fraction'}
-    assert required.issubset(actual), (
-        "Required columns missing: {}".format(required - actual))
-
-    assert set(IDCOLUMNS) & actual, "No ids columns found: {}".format(actual)
-    assert all(cls in ASSTYPES for cls in holdings.values('asstype'))
-
-    # Check that '-' don't appear in identifier columns.
-    for column in IDCOLUMNS:
-        if column not in holdings.columns:
-            continue
-        values = holdings.values(column)
-        if '-' in values:
-            raise ValueError("Invalid value '-' in column '{}'".format(column))
-
-
-def add_missing_columns(tbl: Table) -> Table:
-    """Add empty identifier columns to the table."""
-    for column in IDCOLUMNS:
-        if column not in tbl.columns:
-            tbl = tbl.create(column, lambda _: '')
-    return tbl
+from baskets import secmaster
+
+
+def fuzzy_linker(holdings: Table, threshold: float,
+                 linker: Callable[[Table], List[List[Tuple]]],
+                 tag: str) -> Tuple[str, Callable[[Table], List[List[Tuple]]]]:
+    """Add the fuzzy matches of names to the links of a linker, against the names
+    of all the holdings. The matches of the rows of a position depend on the
+    names of the other positions, so a hash of the names is added to the tag of
+    the links, and saved groups are recomputed when any name changes."""
+    names = namematch.NameIndex(threshold)
+    names.add(namematch.holdings_keys(holdings))
+    tag = '{}:fuzzy:{}:{}'.format(tag, threshold, names.digest()[:16])
+    return tag, lambda tbl: names.links(tbl, linker(tbl))
+
+
+def group_incrementally(filename: str, blocks: Dict[Tuple, Table],
+                        linker: Callable[[Table], List[List[Tuple]]],
+                        tag: str) -> Tuple[Table, Table]:
+    """Group the holdings of the positions, updating the groups saved by a
+    previous run with the positions which changed."""
+    groups = None
+    if path.exists(filename):
+        try:
+            groups = graph.load_groups(filename)
+        except Exception:  # pylint: disable=broad-except
+            logging.warning("Invalid groups file %s; regrouping", filename,
+                            exc_info=True)
+    if groups is None or groups.tag != tag:
+        groups = graph.IncrementalGroups(tag)
+    for key in list(groups.blocks):
+        if key not in blocks:
+            groups.remove(key)
+    for key, holdings in blocks.items():
+        groups.add(key, holdings, linker)
+    graph.save_groups(groups, filename)
+    return groups.group()
 
 
 def main():
@@ -89,6 +85,27 @@ def main():
     parser.add_argument('-A', '--agg-table', action='store',
                         help="Path to write the full table to.")
 
+    parser.add_argument('-P', '--pivot-table', action='store',
+                        help="Path to write the table of amounts per group and ETF to.")
+
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Parse all the holdings files, ignoring cached tables.")
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                        help="Number of processes to parse the holdings files with.")
+
+    parser.add_argument('--no-secmaster', action='store_true',
+                        help=("Don't match the holdings through the security master "
+                              "(see baskets-secmaster), even if it exists."))
+    parser.add_argument('-G', '--groups-state', action='store',
+                        help=("Path to a file to keep the groups of the holdings in "
+                              "between runs, so that only the positions which changed "
+                              "are regrouped."))
+    parser.add_argument('-z', '--fuzzy-names', action='store', type=float,
+                        nargs='?', const=0.7, default=None, metavar='THRESHOLD',
+                        help=("Also match holdings without identifiers to the most "
+                              "similar name over a threshold (default: 0.7). The "
+                              "saved groups (see -G) are recomputed whenever the "
+                              "names of the holdings change."))
     parser.add_argument('-D', '--debug-output', action='store',
                         help="Path to debugging output of grouping algorithm.")
 
@@ -101,60 +118,66 @@ def main():
 
     assets = assets.order(lambda row: (row.issuer, row.ticker))
 
-    # Fetch baskets for each of those.
+    # Find the latest holdings file of each of those.
+    positions = loader.find_files(db, assets, args.ignore_shorts,
+                                  args.ignore_missing_issuer)
+
+    # Parse the files, or reuse their previously parsed tables.
+    jobs = [(row.issuer, filename) for row, filename in positions if filename]
+    parsed = dict(zip(jobs, loader.parse_all(jobs, not args.no_cache, args.jobs)))
+
+    # Build the holdings of each position.
     alltables = []
-    for row in assets:
-        if row.quantity < 0 and args.ignore_shorts:
-            continue
-
-        if not row.issuer:
-            holdings = Table(['fraction', 'asstype', 'ticker'],
-                             [str, str, str],
-                             [[1.0, 'Equity', row.ticker]])
+    blocks = {}
+    etfs = {}
+    dollars = collections.defaultdict(float)
+    for row, filename in positions:
+        if filename is None:
+            holdings = loader.stock_holdings(row.ticker)
         else:
-            downloader = issuers.get(row.issuer)
-            if downloader is None:
-                message = "Missing issuer: {}".format(row.issuer)
-                if args.ignore_missing_issuer:
-                    logging.error(message)
-                    continue
-                else:
-                    raise SystemExit(message)
-
-            filename = database.getlatest(db, row.ticker)
-            if filename is None:
-                logging.error("Missing file for %s", row.ticker)
-                continue
-            logging.info("Parsing file '%s' with '%s'", filename, row.issuer)
-
-            if not hasattr(downloader, 'parse'):
-                logging.error("Parser for %s is not implemented", row.ticker)
+            holdings, error = parsed[(row.issuer, filename)]
+            if holdings is None:
+                logging.error("Could not parse '%s' for %s: %s",
+                              filename, row.ticker, error)
                 continue
 
-            # Parse the file.
-            holdings = downloader.parse(filename)
-            check_holdings(holdings)
-
-        # Add parent ETF and fixup columns.
-        holdings = add_missing_columns(holdings)
-        holdings = holdings.create('etf', lambda _, row=row: row.ticker)
-        holdings = holdings.create('account', lambda _, row=row: row.account)
-        holdings = holdings.select(COLUMNS)
-
-        # Convert fraction to dollar amount.
+        # Add parent ETF and convert fraction to dollar amount.
         dollar_amount = row.quantity * row.price
-        holdings = (holdings
-                    .create('amount', lambda row, a=dollar_amount: row.fraction * a)
-                    .delete(['fraction']))
+        etfs.setdefault(row.ticker, holdings)
+        dollars[row.ticker] += dollar_amount
+        holdings = loader.position_holdings(holdings, row.ticker, row.account,
+                                            dollar_amount)
 
-        alltables.append(holdings)
-    fulltable = table.concat(*alltables)
+        alltables.append((row.ticker, holdings))
+        key = (row.account, row.ticker, filename)
+        blocks[key] = (table.concat(blocks[key], holdings) if key in blocks
+                       else holdings)
+    fulltable = table.concat(*[holdings for _, holdings in alltables])
 
     # Aggregate the holdings.
-    aggtable, annotable = graph.group(fulltable, args.debug_output)
+    with secmaster.connect(secmaster.getfilename(db)) as conn:
+        if conn is None or args.no_secmaster:
+            tag, linker = 'graph', graph.holdings_links
+        else:
+            tag = 'secmaster:{}'.format(secmaster.version(conn))
+            linker = lambda holdings: secmaster.holdings_links(holdings, conn)
+        if args.fuzzy_names:
+            tag, linker = fuzzy_linker(fulltable, args.fuzzy_names, linker, tag)
+        if args.groups_state:
+            aggtable, annotable = group_incrementally(args.groups_state, blocks,
+                                                      linker, tag)
+        else:
+            matrix = disaggregate.build(etfs, linker, args.debug_output)
+            amounts = disaggregate.exposures(
+                matrix, disaggregate.position_vectors(matrix, [dollars]))
+            aggtable, annotable = disaggregate.annotate(matrix, amounts[:, 0],
+                                                        alltables)
     if args.agg_table:
         with open(args.agg_table, 'w') as outfile:
             table.write_csv(aggtable, outfile)
+    if args.pivot_table:
+        with open(args.pivot_table, 'w') as outfile:
+            table.write_csv(annotable.pivot('group', 'etf', 'amount'), outfile)
 
     # Remove the holdings whose aggregate sum is under a threshold.
     if args.threshold:
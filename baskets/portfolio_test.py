@@ -0,0 +1,37 @@
+"""Unit tests for the disaggregation of a portfolio.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from baskets import graph
+from baskets import portfolio
+from baskets import table
+from baskets.table import Table
+
+
+# pylint: disable=missing-docstring
+
+
+COLUMNS = ['etf', 'asstype', 'name', 'ticker', 'sedol', 'isin', 'cusip', 'amount']
+
+
+def test_group_incrementally_fuzzy(tmp_path):
+    blocks = {
+        'CHIQ': Table(COLUMNS, [str] * 7 + [float], [
+            ('CHIQ', 'Equity', 'Alibaba Grp Holding', '', '', '', '', 5.)]),
+        'VTI': Table(COLUMNS, [str] * 7 + [float], [
+            ('VTI', 'Equity', 'Alibaba Group Holding', 'BABA', '', '', '', 10.)]),
+    }
+    filename = str(tmp_path / 'groups.pickle')
+    for keys in [['CHIQ'], ['CHIQ', 'VTI']]:
+        current = {key: blocks[key] for key in keys}
+        fulltable = table.concat(*current.values())
+        tag, linker = portfolio.fuzzy_linker(fulltable, 0.7, graph.holdings_links,
+                                             'graph')
+        aggtable, _ = portfolio.group_incrementally(filename, current, linker, tag)
+        expected, _ = graph.group(fulltable, rowlinks=linker(fulltable))
+        assert list(aggtable) == list(expected)
+
+    # The existing unidentified holding matches the name of the new one.
+    assert [tuple(row) for row in aggtable] == [
+        ('BABA', 'Equity', 'Alibaba Group Holding', 15.)]
@@ -0,0 +1,264 @@
+"""Reverse index from the holdings to the ETFs which hold them.
+
+Every holding of every download of the database is indexed by its links, i.e.,
+its identifiers (ticker, CUSIP, ISIN, SEDOL) and its normalized name (see
+graph.row_links), in a SQLite database at the root of the database directory.
+Looking up an identifier returns the fraction of each ETF it makes up, in the
+latest snapshot of each ETF, or the latest as of a date. Weighted by the dollar
+amounts of the ETFs of a portfolio, this gives the contribution of each position
+to the exposure to a stock.
+
+Updating the index only parses the downloads which aren't in it yet, and
+baskets-updatedb updates it after downloading, if it exists.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, Iterator, List, NamedTuple
+import argparse
+import contextlib
+import datetime
+import logging
+import os
+import sqlite3
+
+from baskets import beansupport
+from baskets import database
+from baskets import graph
+from baskets import history
+from baskets import issuers
+from baskets import normalize
+from baskets import secmaster
+from baskets import snapshots
+from baskets.table import Table
+
+
+# Name of the index, at the root of the database directory.
+INDEX = 'revindex.db'
+
+_SCHEMA = """
+  CREATE TABLE IF NOT EXISTS snapshots (
+    etf TEXT NOT NULL,
+    date TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (etf, date)
+  );
+  CREATE TABLE IF NOT EXISTS holdings (
+    id INTEGER PRIMARY KEY,
+    etf TEXT NOT NULL,
+    date TEXT NOT NULL,
+    fraction REAL NOT NULL,
+    asstype TEXT,
+    name TEXT,
+    ticker TEXT
+  );
+  CREATE INDEX IF NOT EXISTS holdings_snapshot ON holdings (etf, date);
+  CREATE TABLE IF NOT EXISTS links (
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    holding INTEGER NOT NULL
+  );
+  CREATE INDEX IF NOT EXISTS links_value ON links (kind, value);
+  CREATE INDEX IF NOT EXISTS links_holding ON links (holding);
+"""
+
+
+Posting = NamedTuple('Posting', [
+    ('etf', str),
+    ('date', datetime.date),
+    ('fraction', float),
+    ('asstype', str),
+    ('name', str),
+    ('ticker', str),
+])
+
+
+def getfilename(db: database.Database) -> str:
+    """Get the default filename of the index of a database."""
+    return path.join(db.directory, INDEX)
+
+
+@contextlib.contextmanager
+def connect(filename: str, create: bool = False) -> Iterator[sqlite3.Connection]:
+    """Open a connection to the index and commit on success. This yields None if
+    the index does not exist and 'create' is false."""
+    if not create and not path.exists(filename):
+        yield None
+        return
+    os.makedirs(path.dirname(path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=60)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def replace_snapshot(conn: sqlite3.Connection, etf: str, date: datetime.date,
+                     sha256: str, holdings: Table):
+    """Index the normalized holdings of an ETF on a date, replacing any
+    previous ones."""
+    date = date.isoformat()
+    conn.execute('DELETE FROM links WHERE holding IN '
+                 '(SELECT id FROM holdings WHERE etf = ? AND date = ?)', (etf, date))
+    conn.execute('DELETE FROM holdings WHERE etf = ? AND date = ?', (etf, date))
+
+    first = (conn.execute('SELECT MAX(id) FROM holdings').fetchone()[0] or 0) + 1
+    rows = []
+    links = []
+    columns = [holdings.values(column)
+               for column in ['fraction', 'asstype', 'name'] + graph.LINK_COLUMNS]
+    for holding, (fraction, asstype, name, *identifiers) in enumerate(zip(*columns),
+                                                                       first):
+        rows.append((holding, etf, date, float(fraction), asstype, name,
+                     identifiers[0]))
+        links.extend(secmaster.encode(link) + (holding,)
+                     for link in graph.row_links(asstype, name, identifiers))
+    conn.executemany('INSERT INTO holdings VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.executemany('INSERT INTO links VALUES (?, ?, ?)', links)
+    conn.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)',
+                 (etf, date, sha256))
+
+
+def update(conn: sqlite3.Connection, db: database.Database) -> int:
+    """Index the downloads of the database which are missing or changed in the
+    index. Returns the number of files indexed."""
+    indexed = {(etf, date): sha256 for etf, date, sha256 in conn.execute(
+        'SELECT etf, date, sha256 FROM snapshots')}
+
+    # Keep only the latest file of each key and date, as getasof() does.
+    latest = {}
+    for entry in database.entries(db):
+        latest[(entry.key, entry.date)] = entry
+
+    count = 0
+    for (etf, date), entry in sorted(latest.items()):
+        if indexed.get((etf, date.isoformat())) == entry.sha256:
+            continue
+        module = issuers.get_holdings(entry.issuer)
+        if module is None or not hasattr(module, 'parse'):
+            logging.debug("No holdings parser for %s on %s; skipping", etf, date)
+            continue
+        try:
+            holdings = snapshots.normalized_holdings(entry)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.error("Could not parse %s: %s", entry.filename, exc)
+            continue
+        replace_snapshot(conn, etf, date, entry.sha256, holdings)
+        count += 1
+    return count
+
+
+def _identifier_keys(identifier: str) -> List:
+    """Get the link keys an identifier or a name may match."""
+    keys = [(column, identifier) for column in graph.LINK_COLUMNS]
+    key = graph.name_key(identifier)
+    if key:
+        keys.extend(secmaster.encode(('name_key', (asstype, key)))
+                    for asstype in sorted(normalize.ASSTYPES))
+    return keys
+
+
+def lookup(conn: sqlite3.Connection, identifier: str,
+           asof: datetime.date = None) -> List[Posting]:
+    """Find the holdings matching an identifier or a name in the latest snapshot
+    of each ETF, or the latest as of a date, in order of decreasing fraction."""
+    keys = _identifier_keys(identifier)
+    conditions = ' OR '.join(['(kind = ? AND value = ?)'] * len(keys))
+    params = [value for key in keys for value in key]
+    query = ('SELECT h.etf, h.date, h.fraction, h.asstype, h.name, h.ticker '
+             'FROM holdings h '
+             'JOIN (SELECT etf, MAX(date) AS date FROM snapshots {} GROUP BY etf) s '
+             'ON h.etf = s.etf AND h.date = s.date '
+             'WHERE h.id IN (SELECT holding FROM links WHERE {}) '
+             'ORDER BY h.fraction DESC, h.etf').format(
+                 'WHERE date <= ?' if asof else '', conditions)
+    if asof:
+        params.insert(0, asof.isoformat())
+    return [Posting(etf, datetime.date.fromisoformat(date), fraction, asstype, name,
+                    ticker)
+            for etf, date, fraction, asstype, name, ticker in conn.execute(query, params)]
+
+
+def contributions(postings: List[Posting], etf_amounts: Dict[str, float],
+                  stock_amounts: Dict[str, float] = None) -> Table:
+    """Compute the dollar amount contributed by each position of a portfolio to
+    the holdings found by lookup(), in order of decreasing amount. The single
+    stock positions with the ticker of the holdings contribute fully."""
+    rows = [(posting.etf, posting.date, posting.fraction,
+             posting.fraction * etf_amounts[posting.etf])
+            for posting in postings if posting.etf in etf_amounts]
+    tickers = {posting.ticker for posting in postings if posting.ticker}
+    for ticker, amount in sorted((stock_amounts or {}).items()):
+        if ticker in tickers:
+            rows.append((ticker, None, 1.0, amount))
+    rows.sort(key=lambda row: -row[3])
+    return Table(['position', 'date', 'fraction', 'amount'],
+                 [str, datetime.date, float, float], rows)
+
+
+def main():
+    """Build and query the reverse index of holdings."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--dbdir', default=database.DEFAULT_DIR,
+                        help="Database directory.")
+    parser.add_argument('--index', default=None,
+                        help="Index file (default: in the database directory).")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('update', help="Add the new downloads to the index.")
+    subparsers.add_parser('rebuild', help="Rebuild the index from scratch.")
+    query_parser = subparsers.add_parser(
+        'query', help="Find the ETFs holding a stock, or the positions contributing to it.")
+    query_parser.add_argument('identifiers', nargs='+',
+                              help="Tickers, CUSIPs, ISINs, SEDOLs or names.")
+    query_parser.add_argument('--asof', type=datetime.date.fromisoformat,
+                              help="Use the latest snapshots as of a date (YYYY-MM-DD).")
+    query_parser.add_argument('-p', '--portfolio', action='store',
+                              help=("A CSV file of positions to weight the holdings "
+                                    "with (see baskets-portfolio)."))
+    query_parser.add_argument('-o', '--ignore-options', action='store_true',
+                              help=("Ignore options positions "
+                                    "(only works with  Beancount export file)"))
+    args = parser.parse_args()
+    db = database.Database(args.dbdir)
+    filename = args.index or getfilename(db)
+
+    if args.command in ('update', 'rebuild'):
+        if args.command == 'rebuild':
+            for suffix in ('', '-wal', '-shm'):
+                if path.exists(filename + suffix):
+                    os.remove(filename + suffix)
+        with connect(filename, create=True) as conn:
+            count = update(conn, db)
+        logging.info("Indexed %d files in %s", count, filename)
+    elif args.command == 'query':
+        etf_amounts = stock_amounts = None
+        if args.portfolio:
+            assets = beansupport.read_portfolio(args.portfolio, args.ignore_options)
+            assets.checkall(['ticker', 'account', 'issuer', 'price', 'quantity'])
+            etf_amounts, stock_amounts = history.position_amounts(assets)
+        with connect(filename) as conn:
+            if conn is None:
+                raise SystemExit("No index at {}; run the update command first".format(
+                    filename))
+            for identifier in args.identifiers:
+                postings = lookup(conn, identifier, args.asof)
+                if etf_amounts is None:
+                    tbl = Table(list(Posting._fields),
+                                [str, datetime.date, float, str, str, str], postings)
+                else:
+                    tbl = contributions(postings, etf_amounts, stock_amounts)
+                    logging.info("Total amount of %s: %.2f", identifier,
+                                 sum(tbl.values('amount')))
+                print(identifier)
+                print(tbl)
+                print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Unit tests for the reverse index of holdings.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import datetime
+import logging
+import tempfile
+
+from baskets import database
+from baskets import revindex
+
+
+# pylint: disable=missing-docstring
+
+
+def _store(db, tmpdir, etf, date, rows):
+    filename = path.join(tmpdir, '{}.csv'.format(etf))
+    with open(filename, 'w') as outfile:
+        outfile.write('HoldingsTicker,SecurityNum,Name,MarketValue\n')
+        for ticker, value in rows:
+            outfile.write('{0},{0}123,{0} Inc,"${1:,}"\n'.format(ticker, value))
+    database.store(db, etf, date, filename, 'PowerShares')
+
+
+def test_update_and_lookup(caplog):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = database.Database(path.join(tmpdir, 'db'))
+        day1, day2 = datetime.date(2018, 10, 1), datetime.date(2018, 10, 2)
+        _store(db, tmpdir, 'QQQ', day1, [('AAPL', 3000), ('MSFT', 1000)])
+        _store(db, tmpdir, 'PBW', day1, [('TSLA', 500), ('AAPL', 500)])
+        _store(db, tmpdir, 'QQQ', day2, [('AAPL', 1000), ('MSFT', 1000)])
+        listfile = path.join(tmpdir, 'etflist.csv')
+        with open(listfile, 'w') as outfile:
+            outfile.write('not holdings')
+        database.store(db, '__LIST__', day2, listfile, 'Nasdaq')
+
+        filename = revindex.getfilename(db)
+        with revindex.connect(filename, create=True) as conn:
+            with caplog.at_level(logging.ERROR):
+                assert revindex.update(conn, db) == 3
+            assert not caplog.records
+            assert revindex.update(conn, db) == 0
+
+        with revindex.connect(filename) as conn:
+            postings = revindex.lookup(conn, 'AAPL')
+            assert [(p.etf, p.date, p.fraction) for p in postings] == [
+                ('PBW', day1, 0.5), ('QQQ', day2, 0.5)]
+            assert [(p.etf, p.date, p.fraction)
+                    for p in revindex.lookup(conn, 'AAPL123', asof=day1)] == [
+                        ('QQQ', day1, 0.75), ('PBW', day1, 0.5)]
+            assert [p.etf for p in revindex.lookup(conn, 'Tsla Inc.')] == ['PBW']
+            assert revindex.lookup(conn, 'GOOG') == []
+
+            tbl = revindex.contributions(postings, {'QQQ': 1000., 'PBW': 4000.},
+                                         {'AAPL': 100., 'MSFT': 50.})
+            assert [tuple(row) for row in tbl] == [
+                ('PBW', day1, 0.5, 2000.),
+                ('QQQ', day2, 0.5, 500.),
+                ('AAPL', None, 1.0, 100.)]
+
+        # A new download for an existing date replaces its postings.
+        _store(db, tmpdir, 'PBW', day1, [('TSLA', 500)])
+        with revindex.connect(filename) as conn:
+            assert revindex.update(conn, db) == 1
+            assert [p.etf for p in revindex.lookup(conn, 'AAPL')] == ['QQQ']
+            assert conn.execute('SELECT COUNT(*) FROM links WHERE holding NOT IN '
+                                '(SELECT id FROM holdings)').fetchone()[0] == 0
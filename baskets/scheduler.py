@@ -0,0 +1,137 @@
+"""Concurrent scheduler for download jobs.
+
+Jobs are run on a fixed number of worker threads. Each job belongs to a group
+(e.g., its issuer) and the number of jobs of a group running at the same time
+can be limited, so that we can stay polite with the issuers' websites while
+downloading from several of them in parallel.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import collections
+import logging
+import threading
+import time
+import types
+
+
+Job = NamedTuple('Job', [
+    ('key', str),
+    ('group', str),
+])
+
+Result = NamedTuple('Result', [
+    ('job', Job),
+    ('value', Any),
+    ('error', Optional[BaseException]),
+    ('elapsed', float),
+])
+
+
+class Scheduler:
+    """Run jobs on worker threads, with per-group concurrency limits.
+
+    Each worker thread has its own state object, which is passed to every job it
+    runs; this is where per-worker resources (e.g. a web driver) can be kept.
+    """
+
+    def __init__(self, num_workers: int,
+                 limits: Dict[str, int] = None,
+                 default_limit: int = None):
+        assert num_workers >= 1
+        for group, limit in sorted((limits or {}).items()):
+            if limit < 1:
+                raise ValueError("Invalid limit for {}: {}".format(group, limit))
+        if default_limit is not None and default_limit < 1:
+            raise ValueError("Invalid default limit: {}".format(default_limit))
+        self.num_workers = num_workers
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = collections.defaultdict(int)
+        self._results = []
+        self._numjobs = 0
+        self._start = None
+
+    def run(self, func: Callable[[Job, Any], Any], jobs: List[Job],
+            teardown: Callable[[Any], None] = None) -> List[Result]:
+        """Run func(job, worker_state) for all the jobs and return their results,
+        in the order of the jobs. Exceptions raised by jobs, other than
+        KeyboardInterrupt, are logged and stored in the results. 'teardown' is
+        called on each worker's state when it is done."""
+        self._pending = list(jobs)
+        self._numjobs = len(self._pending)
+        self._results = []
+        self._start = time.time()
+        threads = [threading.Thread(target=self._worker, args=(func, teardown),
+                                    name='worker-{}'.format(index), daemon=True)
+                   for index in range(min(self.num_workers, len(self._pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._log_summary()
+        order = {job: index for index, job in enumerate(jobs)}
+        return sorted(self._results, key=lambda result: order[result.job])
+
+    def _next_job(self) -> Optional[Job]:
+        """Pick the next job whose group is under its limit, waiting for one to
+        become available if necessary. Returns None when all jobs are taken."""
+        with self._cond:
+            while self._pending:
+                for index, job in enumerate(self._pending):
+                    limit = self.limits.get(job.group, self.default_limit)
+                    if limit is None or self._running[job.group] < limit:
+                        del self._pending[index]
+                        self._running[job.group] += 1
+                        return job
+                self._cond.wait()
+            return None
+
+    def _worker(self, func, teardown):
+        state = types.SimpleNamespace()
+        try:
+            while True:
+                job = self._next_job()
+                if job is None:
+                    break
+                start = time.time()
+                value = error = None
+                try:
+                    value = func(job, state)
+                except KeyboardInterrupt:
+                    raise
+                except BaseException as exc:  # pylint: disable=broad-except
+                    # Also record SystemExit and the like as failures of the job,
+                    # rather than ending the worker.
+                    logging.exception("Error running job for %s", job.key)
+                    error = exc
+                finally:
+                    result = Result(job, value, error, time.time() - start)
+                    with self._cond:
+                        self._running[job.group] -= 1
+                        self._results.append(result)
+                        numdone = len(self._results)
+                        self._cond.notify_all()
+                logging.info("[%d/%d] %s %s (%s) in %.1fs",
+                             numdone, self._numjobs, job.key,
+                             'failed' if error else 'done', job.group, result.elapsed)
+        finally:
+            if teardown is not None:
+                teardown(state)
+
+    def _log_summary(self):
+        """Log a summary of the run."""
+        failed = [result.job.key for result in self._results if result.error]
+        logging.info("Ran %d jobs on %d workers in %.1fs: %d succeeded, %d failed",
+                     len(self._results), self.num_workers, time.time() - self._start,
+                     len(self._results) - len(failed), len(failed))
+        bygroup = collections.defaultdict(list)
+        for result in self._results:
+            bygroup[result.job.group].append(result.elapsed)
+        for group, elapsed in sorted(bygroup.items()):
+            logging.info("   %-16s %4d jobs, %8.1fs total", group, len(elapsed), sum(elapsed))
+        if failed:
+            logging.error("Failed: %s", ', '.join(failed))
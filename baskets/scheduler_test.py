@@ -0,0 +1,106 @@
+"""Unit tests for the download scheduler.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import collections
+import functools
+import http.server
+import tempfile
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from baskets import scheduler
+
+
+# pylint: disable=missing-docstring
+
+
+@pytest.fixture
+def holdings_server():
+    """A local HTTP server serving canned holdings files."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for symbol in 'VTI', 'VEA', 'IVV', 'IJH', 'SPY':
+            with open(path.join(tmpdir, '{}.csv'.format(symbol)), 'w') as outfile:
+                outfile.write('ticker,fraction\n{},1.0\n'.format(symbol))
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler,
+                                    directory=tmpdir)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+        server.shutdown()
+        server.server_close()
+
+
+def test_scheduler(holdings_server):
+    running = collections.Counter()
+    maxrunning = collections.Counter()
+    lock = threading.Lock()
+
+    def fetch(job, worker):
+        if not hasattr(worker, 'downloads_dir'):
+            worker.downloads_dir = tempfile.TemporaryDirectory()
+        with lock:
+            running[job.group] += 1
+            maxrunning[job.group] = max(maxrunning[job.group], running[job.group])
+        try:
+            time.sleep(0.05)
+            filename = path.join(worker.downloads_dir.name, '{}.csv'.format(job.key))
+            url = '{}/{}.csv'.format(holdings_server, job.key)
+            with urllib.request.urlopen(url) as resp, open(filename, 'wb') as outfile:
+                outfile.write(resp.read())
+            with open(filename) as infile:
+                return infile.read()
+        finally:
+            with lock:
+                running[job.group] -= 1
+
+    def teardown(worker):
+        if hasattr(worker, 'downloads_dir'):
+            worker.downloads_dir.cleanup()
+
+    jobs = [scheduler.Job('VTI', 'Vanguard'),
+            scheduler.Job('VEA', 'Vanguard'),
+            scheduler.Job('IVV', 'iShares'),
+            scheduler.Job('IJH', 'iShares'),
+            scheduler.Job('SPY', 'StateStreet'),
+            scheduler.Job('XXX', 'StateStreet')]
+    sched = scheduler.Scheduler(4, {'Vanguard': 1, 'iShares': 1})
+    results = sched.run(fetch, jobs, teardown)
+
+    assert [result.job for result in results] == jobs
+    assert maxrunning['Vanguard'] == 1
+    assert maxrunning['iShares'] == 1
+    for result in results[:5]:
+        assert result.error is None
+        assert result.value == 'ticker,fraction\n{},1.0\n'.format(result.job.key)
+    assert results[5].error is not None
+
+
+def test_scheduler_invalid_limits():
+    with pytest.raises(ValueError):
+        scheduler.Scheduler(2, {'Vanguard': 0})
+    with pytest.raises(ValueError):
+        scheduler.Scheduler(2, {'Vanguard': 1, 'iShares': -1})
+    with pytest.raises(ValueError):
+        scheduler.Scheduler(2, default_limit=0)
+
+
+def test_scheduler_system_exit():
+    def fetch(job, _):
+        if job.key == 'XXX':
+            raise SystemExit("Missing issuer for {}".format(job.key))
+        return job.key
+
+    jobs = [scheduler.Job('XXX', 'Unknown'),
+            scheduler.Job('VTI', 'Vanguard'),
+            scheduler.Job('VEA', 'Vanguard')]
+    results = scheduler.Scheduler(1).run(fetch, jobs)
+    assert [result.job for result in results] == jobs
+    assert isinstance(results[0].error, SystemExit)
+    assert [result.value for result in results[1:]] == ['VTI', 'VEA']
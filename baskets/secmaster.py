@@ -0,0 +1,318 @@
+"""Persistent security master of the instruments held by the ETFs.
+
+Every holding of the snapshots (see snapshots) is assigned a stable instrument
+ID through its links, i.e., its identifiers (ticker, CUSIP, ISIN, SEDOL) and its
+normalized name, the same links as used for grouping (see graph.row_links). The
+master is a SQLite database at the root of the database directory, mapping each
+link to the ID of its instrument. Updating it only reads the snapshot rows of
+the raw files it hasn't seen yet.
+
+When a new holding links instruments which were distinct, they are merged into
+the one with the smallest ID and the other IDs are kept as aliases of it, so
+IDs handed out earlier remain valid. Grouping the holdings of a portfolio then
+amounts to looking up the links of its rows.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import contextlib
+import logging
+import os
+import sqlite3
+
+from baskets import database
+from baskets import graph
+from baskets import normalize
+from baskets import snapshots
+from baskets.table import Table
+
+
+# Name of the master, at the root of the database directory.
+MASTER = 'secmaster.db'
+
+_SCHEMA = """
+  CREATE TABLE IF NOT EXISTS instruments (
+    id INTEGER PRIMARY KEY,
+    asstype TEXT,
+    name TEXT,
+    ticker TEXT
+  );
+  CREATE TABLE IF NOT EXISTS links (
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    instrument INTEGER NOT NULL,
+    PRIMARY KEY (kind, value)
+  );
+  CREATE INDEX IF NOT EXISTS links_instrument ON links (instrument);
+  CREATE TABLE IF NOT EXISTS aliases (
+    id INTEGER PRIMARY KEY,
+    instrument INTEGER NOT NULL
+  );
+  CREATE TABLE IF NOT EXISTS sources (
+    sha256 TEXT PRIMARY KEY
+  );
+"""
+
+# Columns of the holdings needed to compute their links.
+IDKEY = ['asstype'] + normalize.IDCOLUMNS
+
+
+Instrument = NamedTuple('Instrument', [
+    ('id', int),
+    ('asstype', str),
+    ('name', str),
+    ('ticker', str),
+])
+
+
+def getfilename(db: database.Database) -> str:
+    """Get the default filename of the master of a database."""
+    return path.join(db.directory, MASTER)
+
+
+@contextlib.contextmanager
+def connect(filename: str, create: bool = False) -> Iterator[sqlite3.Connection]:
+    """Open a connection to the master and commit on success. This yields None
+    if the master does not exist and 'create' is false."""
+    if not create and not path.exists(filename):
+        yield None
+        return
+    os.makedirs(path.dirname(path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=60)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def encode(link: Tuple) -> Tuple[str, str]:
+    """Convert a link (see graph.row_links) to its (kind, value) key."""
+    kind, value = link
+    if kind == 'name_key':
+        value = '{}:{}'.format(*value)
+    return kind, value
+
+
+def _probe(conn: sqlite3.Connection,
+           keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """Look up the instruments of a set of link keys, in a single join."""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS probe (kind TEXT, value TEXT)')
+    conn.execute('DELETE FROM probe')
+    conn.executemany('INSERT INTO probe VALUES (?, ?)', keys)
+    found = {(kind, value): instrument
+             for kind, value, instrument in conn.execute(
+                 'SELECT links.kind, links.value, links.instrument '
+                 'FROM probe JOIN links USING (kind, value)')}
+    conn.execute('DELETE FROM probe')
+    return found
+
+
+def _combine(info1: Optional[Tuple], info2: Optional[Tuple]) -> Optional[Tuple]:
+    """Combine the (asstype, name, ticker) descriptions of an instrument,
+    preferring the first one's asset type and ticker, and the longest name."""
+    if info1 is None or info2 is None:
+        return info1 or info2
+    names = [name for name in (info1[1], info2[1]) if name]
+    name = min(names, key=lambda name: (-len(name), name)) if names else ''
+    return (info1[0] or info2[0], name, info1[2] or info2[2])
+
+
+def add_holdings(conn: sqlite3.Connection, holdings: Table) -> Tuple[int, int]:
+    """Assign instruments to the links of some holdings, creating and merging
+    instruments as needed. Returns the number of new instruments and the number
+    of existing instruments merged into others."""
+    distinct = dict.fromkeys(zip(*[holdings.values(column) for column in IDKEY]))
+    rowkeys = []
+    for asstype, name, *identifiers in distinct:
+        byname = dict(zip(normalize.IDCOLUMNS[1:], identifiers))
+        links = graph.row_links(asstype, name,
+                                [byname[column] for column in graph.LINK_COLUMNS])
+        rowkeys.append([encode(link) for link in links])
+    found = _probe(conn, {key for keys in rowkeys for key in keys})
+
+    # Merged instruments point to the instrument they were merged into, which
+    # always has the smallest ID of the two.
+    parent = {}
+    def find(instrument):
+        while instrument in parent:
+            instrument = parent[instrument]
+        return instrument
+
+    first_new = (conn.execute('SELECT MAX(id) FROM (SELECT id FROM instruments '
+                              'UNION ALL SELECT id FROM aliases)').fetchone()[0] or 0) + 1
+    next_id = first_new
+    new_links = {}
+    infos = {}
+    for (asstype, name, ticker, *_), keys in zip(distinct, rowkeys):
+        if not keys:
+            continue
+        instruments = {find(found[key]) for key in keys if key in found}
+        if instruments:
+            target = min(instruments)
+            for instrument in instruments:
+                if instrument != target:
+                    parent[instrument] = target
+        else:
+            target = next_id
+            next_id += 1
+        for key in keys:
+            if key not in found:
+                found[key] = new_links[key] = target
+        infos[target] = _combine(infos.get(target), (asstype, name, ticker))
+
+    # Redirect the links and aliases of the merged instruments.
+    for instrument in sorted(parent):
+        root = find(instrument)
+        conn.execute('UPDATE links SET instrument = ? WHERE instrument = ?',
+                     (root, instrument))
+        conn.execute('UPDATE aliases SET instrument = ? WHERE instrument = ?',
+                     (root, instrument))
+        if instrument < first_new:
+            conn.execute('INSERT OR REPLACE INTO aliases VALUES (?, ?)',
+                         (instrument, root))
+    conn.executemany('INSERT INTO links VALUES (?, ?, ?)',
+                     [(kind, value, find(instrument))
+                      for (kind, value), instrument in new_links.items()])
+
+    # Update the descriptions of the instruments. Processing them in order of
+    # ID visits the surviving instrument of each merge first.
+    combined = {}
+    for instrument in sorted(set(infos) | set(parent)):
+        existing = conn.execute('SELECT asstype, name, ticker FROM instruments '
+                                'WHERE id = ?', (instrument,)).fetchone()
+        info = _combine(existing, infos.get(instrument))
+        root = find(instrument)
+        combined[root] = _combine(combined.get(root), info)
+    conn.executemany('DELETE FROM instruments WHERE id = ?',
+                     [(instrument,) for instrument in parent])
+    conn.executemany('INSERT OR REPLACE INTO instruments VALUES (?, ?, ?, ?)',
+                     [(instrument,) + info for instrument, info in combined.items()])
+
+    num_new = sum(1 for instrument in range(first_new, next_id)
+                  if instrument not in parent)
+    num_merged = sum(1 for instrument in parent if instrument < first_new)
+    return num_new, num_merged
+
+
+def update(conn: sqlite3.Connection, storedir: str) -> int:
+    """Add the holdings of the snapshots which aren't in the master yet.
+    Returns the number of raw files added."""
+    if not path.exists(storedir):
+        return 0
+    done = [sha256 for sha256, in conn.execute('SELECT sha256 FROM sources')]
+    holdings = snapshots.read(storedir, columns=IDKEY + ['source'],
+                              exclude_sources=done)
+    sources = set(holdings.values('source'))
+    if sources:
+        num_new, num_merged = add_holdings(conn, holdings)
+        logging.info("Added %d instruments and merged %d from %d files",
+                     num_new, num_merged, len(sources))
+        conn.executemany('INSERT OR IGNORE INTO sources VALUES (?)',
+                         [(sha256,) for sha256 in sorted(sources)])
+    return len(sources)
+
+
+def instrument(conn: sqlite3.Connection, instrument_id: int) -> Optional[Instrument]:
+    """Get an instrument by ID, following aliases."""
+    row = conn.execute('SELECT instrument FROM aliases WHERE id = ?',
+                       (instrument_id,)).fetchone()
+    if row is not None:
+        instrument_id = row[0]
+    row = conn.execute('SELECT id, asstype, name, ticker FROM instruments '
+                       'WHERE id = ?', (instrument_id,)).fetchone()
+    return Instrument(*row) if row is not None else None
+
+
+def lookup(conn: sqlite3.Connection, identifier: str) -> List[Instrument]:
+    """Find the instruments with an identifier or a name."""
+    ids = {instrument for instrument, in conn.execute(
+        'SELECT instrument FROM links WHERE kind != ? AND value = ?',
+        ('name_key', identifier))}
+    key = graph.name_key(identifier)
+    if key:
+        for asstype in sorted(normalize.ASSTYPES):
+            ids.update(instrument for instrument, in conn.execute(
+                'SELECT instrument FROM links WHERE kind = ? AND value = ?',
+                encode(('name_key', (asstype, key)))))
+    return [instrument(conn, instrument_id) for instrument_id in sorted(ids)]
+
+
+def version(conn: sqlite3.Connection) -> int:
+    """Get the version of the master, which changes with every update."""
+    return conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+
+
+def holdings_links(holdings: Table, conn: sqlite3.Connection) -> List[List[Tuple]]:
+    """Get the links of the rows of a holdings table through the master: the
+    instruments of their links, and their links which are not in the master."""
+    rowlinks = graph.holdings_links(holdings)
+    rowkeys = [[encode(link) for link in links] for links in rowlinks]
+    found = _probe(conn, {key for keys in rowkeys for key in keys})
+    masterlinks = []
+    unknown = 0
+    for links, keys in zip(rowlinks, rowkeys):
+        instruments = sorted({found[key] for key in keys if key in found})
+        if not instruments:
+            unknown += 1
+        masterlinks.append([('instrument', instrument) for instrument in instruments] +
+                           [link for link, key in zip(links, keys) if key not in found])
+    logging.info("Rows not in the security master: %d / %d", unknown, len(holdings))
+    return masterlinks
+
+
+def group(holdings: Table, conn: sqlite3.Connection,
+          debug_filename: str = None) -> Tuple[Table, Table]:
+    """Group holdings by instrument. This is the same as graph.group(), but rows
+    are linked through the instruments of the master, and only the links which
+    are not in it are matched between rows."""
+    return graph.group(holdings, debug_filename, holdings_links(holdings, conn))
+
+
+def main():
+    """Build and query the security master."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--dbdir', default=database.DEFAULT_DIR,
+                        help="Database directory.")
+    parser.add_argument('--snapdir', default=None,
+                        help="Snapshots directory (default: in the database directory).")
+    parser.add_argument('--master', default=None,
+                        help="Security master file (default: in the database directory).")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('update', help="Add the new snapshots to the master.")
+    subparsers.add_parser('rebuild', help="Rebuild the master from scratch.")
+    lookup_parser = subparsers.add_parser('lookup', help="Find instruments.")
+    lookup_parser.add_argument('identifiers', nargs='+',
+                               help="Tickers, CUSIPs, ISINs, SEDOLs or names.")
+    args = parser.parse_args()
+    db = database.Database(args.dbdir)
+    storedir = args.snapdir or snapshots.getdir(db)
+    filename = args.master or getfilename(db)
+
+    if args.command in ('update', 'rebuild'):
+        if args.command == 'rebuild':
+            for suffix in ('', '-wal', '-shm'):
+                if path.exists(filename + suffix):
+                    os.remove(filename + suffix)
+        snapshots.update(db, storedir)
+        with connect(filename, create=True) as conn:
+            count = update(conn, storedir)
+        logging.info("Added %d files to %s", count, filename)
+    elif args.command == 'lookup':
+        with connect(filename) as conn:
+            if conn is None:
+                raise SystemExit("No security master at {}".format(filename))
+            for identifier in args.identifiers:
+                for instrument in lookup(conn, identifier):
+                    print('{}\t{}'.format(identifier, '\t'.join(map(str, instrument))))
+
+
+if __name__ == '__main__':
+    main()
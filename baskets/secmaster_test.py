@@ -0,0 +1,104 @@
+"""Unit tests for the security master.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import datetime
+import tempfile
+
+from baskets import database
+from baskets import secmaster
+from baskets import snapshots
+from baskets.table import Table
+
+
+# pylint: disable=missing-docstring
+
+
+def _holdings(rows):
+    return Table(secmaster.IDKEY, [str] * len(secmaster.IDKEY),
+                 [('Equity', name, ticker, '', '', cusip)
+                  for name, ticker, cusip in rows])
+
+
+def _links(conn):
+    return {(kind, value): instrument
+            for kind, value, instrument in conn.execute('SELECT * FROM links')}
+
+
+def test_add_holdings_merges():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = path.join(tmpdir, 'secmaster.db')
+        with secmaster.connect(filename, create=True) as conn:
+            assert secmaster.add_holdings(conn, _holdings([
+                ('Apple Inc', 'AAPL', ''),
+                ('Apple Inc.', 'AAPL', ''),
+                ('Microsoft Corp', 'MSFT', ''),
+                ('Alphabet Class A', 'GOOGL', 'G1'),
+                ('Alphabet A', '', 'G2'),
+            ])) == (4, 0)
+            links = _links(conn)
+            assert links[('ticker', 'AAPL')] == 1
+            assert links[('name_key', 'Equity:apple')] == 1
+            assert links[('ticker', 'MSFT')] == 2
+
+            # Adding the same holdings again changes nothing.
+            assert secmaster.add_holdings(conn, _holdings([
+                ('Apple Inc', 'AAPL', '')])) == (0, 0)
+
+            # A holding linking two instruments merges them into the oldest.
+            assert secmaster.add_holdings(conn, _holdings([
+                ('Alphabet Inc Class A', 'GOOGL', 'G2'),
+                ('Tesla', 'TSLA', '')])) == (1, 1)
+            links = _links(conn)
+            assert links[('cusip', 'G2')] == 3
+            assert links[('name_key', 'Equity:alphabet a')] == 3
+            assert links[('ticker', 'TSLA')] == 5
+            assert secmaster.instrument(conn, 4) == secmaster.Instrument(
+                3, 'Equity', 'Alphabet Inc Class A', 'GOOGL')
+            assert secmaster.lookup(conn, 'G1') == [secmaster.instrument(conn, 3)]
+            assert secmaster.lookup(conn, 'Apple Inc') == [
+                secmaster.Instrument(1, 'Equity', 'Apple Inc.', 'AAPL')]
+
+
+def test_group():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with secmaster.connect(path.join(tmpdir, 'secmaster.db'), create=True) as conn:
+            secmaster.add_holdings(conn, _holdings([
+                ('Alphabet Class A', 'GOOGL', 'G1'),
+                ('Alphabet Inc', 'GOOG', 'G1')]))
+            holdings = Table(['etf', 'asstype', 'name', 'ticker', 'sedol', 'isin',
+                              'cusip', 'amount'],
+                             [str, str, str, str, str, str, str, float],
+                             [('QQQ', 'Equity', 'Alphabet Class A', 'GOOGL',
+                               '', '', '', 10.),
+                              ('SPY', 'Equity', 'Alphabet', 'GOOG', '', '', '', 5.),
+                              ('SPY', 'Equity', 'Tesla', 'TSLA', '', '', '', 4.),
+                              ('QQQ', 'Equity', 'Tesla Motors', 'TSLA', '', '', '', 1.)])
+            aggtable, annotable = secmaster.group(holdings, conn)
+            assert [tuple(row) for row in aggtable] == [
+                ('GOOG,GOOGL', 'Equity', 'Alphabet Class A', 15.),
+                ('TSLA', 'Equity', 'Tesla Motors', 5.)]
+            assert annotable.values('group') == [0, 0, 1, 1]
+
+
+def test_update():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = database.Database(path.join(tmpdir, 'db'))
+        storedir = snapshots.getdir(db)
+        for etf, date, ticker in [('QQQ', datetime.date(2018, 10, 1), 'AAPL'),
+                                  ('QQQ', datetime.date(2018, 10, 2), 'MSFT')]:
+            filename = path.join(tmpdir, '{}.csv'.format(etf))
+            with open(filename, 'w') as outfile:
+                outfile.write('HoldingsTicker,SecurityNum,Name,MarketValue\n')
+                outfile.write('{0},{0}123,{0} Inc,"$1,000"\n'.format(ticker))
+            database.store(db, etf, date, filename, 'PowerShares')
+            snapshots.update(db, storedir)
+            with secmaster.connect(secmaster.getfilename(db), create=True) as conn:
+                assert secmaster.update(conn, storedir) == 1
+                assert secmaster.update(conn, storedir) == 0
+        with secmaster.connect(secmaster.getfilename(db)) as conn:
+            assert [instrument.ticker for instrument in
+                    (secmaster.instrument(conn, 1), secmaster.instrument(conn, 2))] == [
+                        'AAPL', 'MSFT']
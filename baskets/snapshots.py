@@ -0,0 +1,226 @@
+"""Columnar store of the normalized holdings of all the downloads.
+
+The holdings files of the database are parsed, normalized and appended to a
+compressed Parquet dataset, partitioned by date and issuer, i.e., one file per
+'date=YYYY-MM-DD/issuer=NAME' directory with the holdings of all the ETFs of
+that issuer on that date. Each row also records the hash of the raw file it
+comes from, so updating the store only parses the downloads which aren't in it
+yet. History queries are then vectorized scans of the dataset.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, List, Tuple
+import argparse
+import collections
+import datetime
+import functools
+import logging
+import operator
+import os
+import shutil
+
+import numpy
+import pyarrow
+from pyarrow import compute
+from pyarrow import dataset
+from pyarrow import parquet
+
+from baskets import database
+from baskets import issuers
+from baskets import normalize
+from baskets import parsecache
+from baskets import table
+from baskets.table import Table
+
+
+# Name of the default directory of the store, at the root of the database.
+SNAPSHOTS_DIR = '.snapshots'
+
+# Columns of the snapshot rows, besides the partitioning columns.
+COLUMNS = ['etf', 'fraction', 'asstype'] + normalize.IDCOLUMNS + ['source']
+
+SCHEMA = pyarrow.schema(
+    [('etf', pyarrow.string()),
+     ('fraction', pyarrow.float64()),
+     ('asstype', pyarrow.string())] +
+    [(column, pyarrow.string()) for column in normalize.IDCOLUMNS] +
+    [('source', pyarrow.string())])
+
+PARTITION_SCHEMA = pyarrow.schema([('date', pyarrow.date32()),
+                                   ('issuer', pyarrow.string())])
+
+PARTITIONING = dataset.partitioning(PARTITION_SCHEMA, flavor='hive')
+
+
+def getdir(db: database.Database) -> str:
+    """Get the default directory of the store of a database."""
+    return path.join(db.directory, SNAPSHOTS_DIR)
+
+
+def _partition_filename(storedir: str, date: datetime.date, issuer: str) -> str:
+    return path.join(storedir, 'date={}'.format(date.isoformat()),
+                     'issuer={}'.format(issuer), 'holdings.parquet')
+
+
+def _dataset(storedir: str) -> dataset.Dataset:
+    schema = pyarrow.unify_schemas([SCHEMA, PARTITION_SCHEMA])
+    return dataset.dataset(storedir, schema=schema, format='parquet',
+                           partitioning=PARTITIONING)
+
+
+def ingested(storedir: str) -> Dict[Tuple[str, datetime.date], str]:
+    """Get the source hash of each ETF and date in the store."""
+    if not path.exists(storedir):
+        return {}
+    sources = _dataset(storedir).to_table(columns=['etf', 'date', 'source'])
+    return {(etf, date): source
+            for etf, date, source in zip(*(sources.column(name).to_pylist()
+                                           for name in ['etf', 'date', 'source']))}
+
+
+def normalized_holdings(entry: database.Entry) -> Table:
+    """Parse and normalize the holdings of a stored file."""
+    module = issuers.get(entry.issuer)
+    holdings = parsecache.parse(module, entry.filename)
+    normalize.check_holdings(holdings)
+    holdings = normalize.add_missing_columns(holdings)
+    return (holdings
+            .create('etf', lambda _: entry.key)
+            .create('source', lambda _: entry.sha256)
+            .select(COLUMNS))
+
+
+def _to_arrow(tbl: Table) -> pyarrow.Table:
+    """Convert a normalized holdings table to Arrow."""
+    arrays = [pyarrow.array(tbl.values(column), type=field.type)
+              for column, field in zip(COLUMNS, SCHEMA)]
+    return pyarrow.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def _write_partition(filename: str, new: pyarrow.Table, etfs: List[str]):
+    """Add rows to a partition file, replacing those of the given ETFs."""
+    if path.exists(filename):
+        old = parquet.read_table(filename, schema=SCHEMA)
+        keep = compute.invert(compute.is_in(old.column('etf'),
+                                            value_set=pyarrow.array(etfs)))
+        new = pyarrow.concat_tables([old.filter(keep), new])
+    os.makedirs(path.dirname(filename), exist_ok=True)
+    tmpfilename = path.join(path.dirname(filename), '.holdings.parquet.tmp')
+    parquet.write_table(new.sort_by([('etf', 'ascending')]), tmpfilename,
+                        compression='zstd')
+    os.replace(tmpfilename, filename)
+
+
+def update(db: database.Database, storedir: str) -> int:
+    """Append the holdings of the downloads of the database which are missing or
+    changed in the store. Returns the number of files added."""
+    done = ingested(storedir)
+
+    # Keep only the latest file of each key and date, as getasof() does.
+    latest = {}
+    for entry in database.entries(db):
+        latest[(entry.key, entry.date)] = entry
+
+    partitions = collections.defaultdict(list)
+    for (etf, date), entry in sorted(latest.items()):
+        if done.get((etf, date)) == entry.sha256:
+            continue
+        module = issuers.get_holdings(entry.issuer)
+        if module is None or not hasattr(module, 'parse'):
+            logging.debug("No holdings parser for %s on %s; skipping", etf, date)
+            continue
+        try:
+            holdings = normalized_holdings(entry)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.error("Could not parse %s: %s", entry.filename, exc)
+            continue
+        partitions[(date, entry.issuer)].append((etf, holdings))
+
+    count = 0
+    for (date, issuer), items in sorted(partitions.items()):
+        logging.info("Writing %d ETFs of %s on %s", len(items), issuer, date)
+        new = _to_arrow(table.concat(*[holdings for _, holdings in items]))
+        _write_partition(_partition_filename(storedir, date, issuer), new,
+                         [etf for etf, _ in items])
+        count += len(items)
+    return count
+
+
+def read(storedir: str, etfs: List[str] = None, start: datetime.date = None,
+         end: datetime.date = None, columns: List[str] = None,
+         exclude_sources: List[str] = None) -> Table:
+    """Read the snapshot rows, optionally for some ETFs and a date range, as a
+    columnar table. The rows from the raw files with the hashes in
+    'exclude_sources' are skipped."""
+    if not path.exists(storedir):
+        raise FileNotFoundError("No snapshots in {}".format(storedir))
+    conditions = []
+    if exclude_sources:
+        conditions.append(~compute.field('source').isin(list(exclude_sources)))
+    if etfs:
+        conditions.append(compute.field('etf').isin(etfs))
+    if start:
+        conditions.append(compute.field('date') >= pyarrow.scalar(start))
+    if end:
+        conditions.append(compute.field('date') <= pyarrow.scalar(end))
+    expr = functools.reduce(operator.and_, conditions) if conditions else None
+    columns = columns or ['date', 'issuer'] + COLUMNS
+    atable = _dataset(storedir).to_table(columns=columns, filter=expr)
+    sort_keys = [(name, 'ascending') for name in ('date', 'etf') if name in columns]
+    if sort_keys:
+        atable = atable.sort_by(sort_keys)
+    types = {'date': datetime.date, 'fraction': float}
+    arrays = []
+    for name in columns:
+        column = atable.column(name)
+        if pyarrow.types.is_floating(column.type):
+            arrays.append(column.to_numpy())
+        else:
+            arr = numpy.empty(len(column), dtype=object)
+            arr[:] = column.to_pylist()
+            arrays.append(arr)
+    return Table(columns, [types.get(name, str) for name in columns],
+                 table.Columns(arrays))
+
+
+def main():
+    """Build and query the columnar store of normalized holdings."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--dbdir', default=database.DEFAULT_DIR,
+                        help="Database directory.")
+    parser.add_argument('--snapdir', default=None,
+                        help="Snapshots directory (default: in the database directory).")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('update', help="Add the new downloads to the store.")
+    subparsers.add_parser('rebuild', help="Rebuild the store from scratch.")
+    query_parser = subparsers.add_parser('query', help="Print snapshot rows.")
+    query_parser.add_argument('etfs', nargs='*', help="ETFs to restrict to.")
+    query_parser.add_argument('--start', type=datetime.date.fromisoformat,
+                              help="First date (YYYY-MM-DD).")
+    query_parser.add_argument('--end', type=datetime.date.fromisoformat,
+                              help="Last date (YYYY-MM-DD).")
+    query_parser.add_argument('-o', '--output', action='store',
+                              help="Path to write the rows to, as CSV.")
+    args = parser.parse_args()
+    db = database.Database(args.dbdir)
+    storedir = args.snapdir or getdir(db)
+
+    if args.command in ('update', 'rebuild'):
+        if args.command == 'rebuild' and path.exists(storedir):
+            shutil.rmtree(storedir)
+        count = update(db, storedir)
+        logging.info("Added %d files to %s", count, storedir)
+    elif args.command == 'query':
+        tbl = read(storedir, args.etfs, args.start, args.end)
+        if args.output:
+            table.write_csv(tbl, args.output)
+        else:
+            print(tbl)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Unit tests for the columnar store of holdings.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import datetime
+import logging
+import os
+import tempfile
+
+from baskets import database
+from baskets import snapshots
+
+
+# pylint: disable=missing-docstring
+
+
+def _store(db, etf, date, rows):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = path.join(tmpdir, '{}.csv'.format(etf))
+        with open(filename, 'w') as outfile:
+            outfile.write('HoldingsTicker,SecurityNum,Name,MarketValue\n')
+            for ticker, value in rows:
+                outfile.write('{0},{0}123,{0} Inc,"${1:,}"\n'.format(ticker, value))
+        database.store(db, etf, date, filename, 'PowerShares')
+
+
+def test_update_and_read(caplog):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = database.Database(path.join(tmpdir, 'db'))
+        storedir = snapshots.getdir(db)
+        day1, day2 = datetime.date(2018, 10, 1), datetime.date(2018, 10, 2)
+        _store(db, 'QQQ', day1, [('AAPL', 3000), ('MSFT', 1000)])
+        _store(db, 'PBW', day1, [('TSLA', 500)])
+        _store(db, 'QQQ', day2, [('AAPL', 1000), ('MSFT', 1000)])
+        database.store(db, 'XXX', day2, _dummy(tmpdir), 'Unknown')
+        database.store(db, '__LIST__', day2, _dummy(tmpdir), 'Nasdaq')
+
+        with caplog.at_level(logging.ERROR):
+            assert snapshots.update(db, storedir) == 3
+        assert not caplog.records
+        assert snapshots.update(db, storedir) == 0
+        assert sorted(os.listdir(storedir)) == ['date=2018-10-01', 'date=2018-10-02']
+
+        tbl = snapshots.read(storedir)
+        assert tbl.columns == ['date', 'issuer'] + snapshots.COLUMNS
+        assert [(row.date, row.etf, row.ticker, row.fraction) for row in tbl] == [
+            (day1, 'PBW', 'TSLA', 1.0),
+            (day1, 'QQQ', 'AAPL', 0.75),
+            (day1, 'QQQ', 'MSFT', 0.25),
+            (day2, 'QQQ', 'AAPL', 0.5),
+            (day2, 'QQQ', 'MSFT', 0.5)]
+        assert set(tbl.values('issuer')) == {'PowerShares'}
+        assert tbl.values('cusip')[0] == 'TSLA123'
+
+        # A new download for an existing date replaces that ETF's rows only.
+        _store(db, 'QQQ', day1, [('AAPL', 1000)])
+        assert snapshots.update(db, storedir) == 1
+        tbl = snapshots.read(storedir, ['QQQ', 'PBW'], end=day1,
+                             columns=['etf', 'ticker', 'fraction'])
+        assert [tuple(row) for row in tbl] == [
+            ('PBW', 'TSLA', 1.0), ('QQQ', 'AAPL', 1.0)]
+
+        tbl = snapshots.read(storedir, ['QQQ'], start=day2)
+        assert len(tbl) == 2
+
+
+def _dummy(tmpdir):
+    filename = path.join(tmpdir, 'notes.txt')
+    with open(filename, 'w') as outfile:
+        outfile.write('not holdings')
+    return filename
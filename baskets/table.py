@@ -5,9 +5,8 @@
 
 Think of this as a simpler, more functional, more predictable to use, much less
 efficient replacement for something like the Pandas DatFrame class, for doing
-relational transforms on in-memory tables. It doesn't optimize nor table
-advantage of columnar representation. The intent is to provide an easier-to-use
-API for small data tables (e.g. 100's or 1000's of rows).
+relational transforms on in-memory tables. The intent is to provide an
+easier-to-use API for small data tables (e.g. 100's or 1000's of rows).
 
 Usage:
 
@@ -16,6 +15,14 @@ rows. A "Row" subtype is provided to represent each row and make conveniently
 accessing its contents as attributes. A DefTable subtype is provided if you want
 to predefine and fix the schema of a table.
 
+Storage: By default the rows are stored as a list of Row tuples. A table can
+optionally be converted to a column-oriented representation with columnar(),
+where each column is stored as a NumPy array (typed for homogeneous numeric
+columns, of objects otherwise). The same operations apply to both; on columnar
+tables select, delete and rename only shuffle the column arrays, map and create
+produce a single new column, and the rows are created lazily as views when
+iterated over. Use rowwise() to convert back to a list of rows.
+
 Column Ops: You can perform some operations on the columns of a table:
 
 - select: You can select a subset of columns.
@@ -25,23 +32,28 @@ Column Ops: You can perform some operations on the columns of a table:
 - get: You can get a list of all the values in a column.
 - array: You can get a NumPy array of the values in a column (e.g., for plotting).
 - coltype: You can get the type of a column by name.
-- index: You can create an index of the rows from the unique values in a column.
+- index: You can create an index of the rows from the values in one or more
+  columns (unique, multi-valued or sorted); indexes are cached on the table.
 
 Row Ops: You can perform some operations on the rows of a table:
 
 - iterate: You can iterate over the rows.
 - filter: You can remove rows by filtering them.
 - group: You can perform aggregations of the rows.
+- aggregate: You can compute multiple named aggregates over groups of rows.
 - pivot: You can pivot on two columns and aggregate the values in each cell.
 - append: You can append new rows (suggest only doing this once to build up).
 
 Table Ops: You can perform some operations on a table:
 
 - format: It can be formatted to a string (for human consumption).
-- join: You can join two tables on a condition (e.g. same column).
-- read_csv: You can read a table from a CSV file.
+- join: You can join two tables on one or more key columns (inner, left or outer).
+- read_csv: You can read a table from a CSV file, optionally with declared or
+  inferred column types (see iter_csv() to read it in chunks).
 - write_csv: You can write a table to a CSV file.
 - check: You can assert the existence of columns and/or types of a table.
+- lazy: You can defer a chain of column and row operations and run them all
+  in a single pass with collect().
 
 This summarizes the entire interface and all this functionality is implemented
 in this one file. The operations can be invoked as function and most of them are
@@ -54,9 +66,14 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 from keyword import iskeyword
-from typing import NamedTuple, Tuple, List, Any, Callable, Union, Dict
+from typing import NamedTuple, Tuple, List, Any, Callable, Union, Dict, Iterator, Optional
+from typing import Sequence
+import bisect
 import collections
+import collections.abc
 import csv
+import datetime
+import functools
 import io
 import itertools
 import re
@@ -65,6 +82,7 @@ import typing
 # FIXME: Remove this dependency, this is the whole point of this file.
 import pandas
 import numpy
+import scipy.sparse
 
 # FIXME: Handle formatting in the table itself? Some columns as % always would
 # be useful.
@@ -72,11 +90,99 @@ import numpy
 # FIXME: Maybe rename Table -> Schema and DefTable -> Table? How do you link a
 # Table and its schema? Composition?
 
-# FIXME: Implement automatic type inference.
-
 # FIXME: Deal with an empty table properly (e.g. unit tests, because rows[0] is
 # accessed in the code below).
 
+# Number of rows to convert at once when iterating over columnar storage.
+_CHUNKSIZE = 4096
+
+# Mapping of Python value types to the dtypes of typed column arrays.
+_DTYPES = {
+    float: numpy.float64,
+    int: numpy.int64,
+    bool: numpy.bool_,
+}
+
+
+class Columns(collections.abc.Sequence):
+    """Column-oriented storage for the rows of a table.
+
+    This holds one NumPy array per column and acts as a read-only sequence of
+    rows, so it can be used in place of the list of rows of a Table. Rows are
+    created on demand from the arrays when accessed or iterated over.
+    """
+    __slots__ = ('arrays', 'Row')
+
+    def __init__(self, arrays: List[numpy.ndarray], Row: type = None):
+        self.arrays = list(arrays)
+        self.Row = Row
+
+    def __len__(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(map(self.Row._make,
+                            zip(*[arr[index].tolist() for arr in self.arrays])))
+        return self.Row._make(_item(arr, index) for arr in self.arrays)
+
+    def __iter__(self):
+        make = self.Row._make
+        for start in range(0, len(self), _CHUNKSIZE):
+            chunk = [arr[start:start + _CHUNKSIZE].tolist() for arr in self.arrays]
+            yield from map(make, zip(*chunk))
+
+    def __eq__(self, other):
+        if isinstance(other, (Columns, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (Columns, (self.arrays,))
+
+    def __repr__(self):
+        return 'Columns({!r})'.format(self.arrays)
+
+
+def _item(arr: numpy.ndarray, index: int):
+    """Get a single value from a column array as a native Python value."""
+    value = arr[index]
+    return value.item() if isinstance(value, numpy.generic) else value
+
+
+def _make_array(values: List[Any]) -> numpy.ndarray:
+    """Create a column array from a list of values. Homogeneous numeric columns
+    produce a typed array; anything else is stored as an array of objects."""
+    if values:
+        kinds = set(map(type, values))
+        dtype = _DTYPES.get(kinds.pop()) if len(kinds) == 1 else None
+        if dtype is not None:
+            try:
+                return numpy.array(values, dtype=dtype)
+            except OverflowError:
+                pass
+    return _object_array(values)
+
+
+def _object_array(values: List[Any]) -> numpy.ndarray:
+    """Create a column array of objects from a list of values."""
+    arr = numpy.empty(len(values), dtype=object)
+    try:
+        arr[:] = values
+    except ValueError:
+        # Sequence values confuse NumPy's broadcasting; set them one by one.
+        for idx, value in enumerate(values):
+            arr[idx] = value
+    return arr
+
+
+def _is_columnar(table) -> bool:
+    """Return true if the table uses column-oriented storage."""
+    return isinstance(table.rows, Columns)
+
+
 Header = List[str]
 Types = List[type]
 Rows = List[List[Any]]
@@ -96,10 +202,14 @@ class Table(_Table):
      and list of rows (matching the types)."""
 
     def __new__(cls, columns, types, rows):
-        clean_columns = list(itertools.starmap(idify, enumerate(columns)))
-        Row = collections.namedtuple('Row', clean_columns)
+        clean_columns = idify_columns(tuple(columns))
+        Row = row_class(clean_columns)
+        clean_columns = list(clean_columns)
         assert len(columns) == len(types)
-        if rows and not isinstance(rows[0], Row):
+        if isinstance(rows, Columns):
+            assert len(rows.arrays) == len(columns)
+            rows = Columns(rows.arrays, Row)
+        elif rows and not isinstance(rows[0], Row):
             rows = list(map(Row._make, rows))
         return _Table.__new__(cls, clean_columns, types, rows, Row)
 
@@ -109,6 +219,13 @@ class Table(_Table):
     def __len__(self):
         return len(self.rows)
 
+    def __reduce__(self):
+        # Row classes are created dynamically and can't be pickled by reference;
+        # store plain tuples and let the constructor restore the row class.
+        rows = (self.rows if isinstance(self.rows, Columns) else
+                [tuple(row) for row in self.rows])
+        return (Table, (self.columns, self.types, rows))
+
     # pylint: disable=missing-docstring,bad-whitespace,multiple-statements
 
     # Column operations.
@@ -129,6 +246,7 @@ class Table(_Table):
     def __iter__(self):                return iterate(self)
     def filter(self, *args, **kw):     return filter(self, *args, **kw)
     def group(self, *args, **kw):      return group(self, *args, **kw)
+    def aggregate(self, *args, **kw):  return aggregate(self, *args, **kw)
     def order(self, *args, **kw):      return order(self, *args, **kw)
     def pivot(self, *args, **kw):      return pivot(self, *args, **kw)
     def append(self, *args, **kw):     return append(self, *args, **kw)
@@ -138,9 +256,15 @@ class Table(_Table):
     def head(self, *args, **kw):       return head(self, *args, **kw)
     def concat(self, *args, **kw):     return concat(self, *args, **kw)
     def join(self, *args, **kw):       return join(self, *args, **kw)
+    def leftjoin(self, *args, **kw):   return leftjoin(self, *args, **kw)
     def check(self, *args, **kw):      return check(self, *args, **kw)
     def checkall(self, *args, **kw):   return checkall(self, *args, **kw)
 
+    # Storage operations.
+    def columnar(self):                return columnar(self)
+    def rowwise(self):                 return rowwise(self)
+    def lazy(self):                    return lazy(self)
+
     # @property
     # def Row(self):
     #     """Get the row tuple type."""
@@ -177,6 +301,20 @@ def idify(idx: int, name: str):
     return name.lower()
 
 
+@functools.lru_cache(maxsize=4096)
+def idify_columns(columns: Tuple[str]) -> Tuple[str]:
+    """Coerce a tuple of column names into identifiers. The results are cached."""
+    return tuple(itertools.starmap(idify, enumerate(columns)))
+
+
+@functools.lru_cache(maxsize=4096)
+def row_class(columns: Tuple[str]) -> type:
+    """Get the Row type for a tuple of (idified) column names. These are interned:
+    all the tables with the same columns share the same Row type, so the rows of
+    a table can be reused as they are in the tables derived from it."""
+    return collections.namedtuple('Row', columns)
+
+
 def select(table: Table, columns: List[str]) -> Table:
     """Select, transform or create some columns.
     Here the columns may be just strings, or tuples of (new-column-name,
@@ -184,8 +322,11 @@ def select(table: Table, columns: List[str]) -> Table:
     """
     indexes = [table.columns.index(column)
                for column in columns]
-    rows = [[row[index] for index in indexes]
-            for row in table.rows]
+    if _is_columnar(table):
+        rows = Columns([table.rows.arrays[index] for index in indexes])
+    else:
+        rows = [[row[index] for index in indexes]
+                for row in table.rows]
     types = [table.types[index] for index in indexes]
     return Table(columns, types, rows)
 
@@ -198,29 +339,50 @@ def create(table: Table, column: str, newfunc: Callable) -> Table:
     types = list(table.types)
     types.append(hints.get('return', str))
 
-    rows = [row + (newfunc(row),)
-            for row in table.rows]
+    if _is_columnar(table):
+        newarray = _make_array([newfunc(row) for row in table.rows])
+        rows = Columns(table.rows.arrays + [newarray])
+    else:
+        rows = [row + (newfunc(row),)
+                for row in table.rows]
 
     return Table(columns, types, rows)
 
 
-
 def update(table: Table, column: str, mapfunc: Callable) -> Table:
     """Replace the contents of a column via a mapper on a row."""
     idx = table.columns.index(column)
     hints = typing.get_type_hints(mapfunc)
     new_types = list(table.types)
     new_types[idx] = hints.get('return', str)
-    new_rows = []
-    for row in table.rows:
-        kw = {column: mapfunc(row)}
-        new_rows.append(row._replace(**kw))
+    if _is_columnar(table):
+        arrays = list(table.rows.arrays)
+        arrays[idx] = _make_array([mapfunc(row) for row in table.rows])
+        return Table(table.columns, new_types, Columns(arrays))
+    # The schema is unchanged, so the new rows are made with the same Row type
+    # and don't get rewrapped.
+    make = table.Row._make
+    new_rows = [make(row[:idx] + (mapfunc(row),) + row[idx + 1:])
+                for row in table.rows]
     return Table(table.columns, new_types, new_rows)
 
 
 def map_(table: Table, column: str, mapfunc: Callable) -> Table:
     """Replace the contents of a column via a mapper on the column."""
-    return update(table, column, lambda row: mapfunc(getattr(row, column)))
+    rowfunc = lambda row: mapfunc(getattr(row, column))
+    if not _is_columnar(table):
+        return update(table, column, rowfunc)
+
+    # Apply the mapper directly to the column values, without creating rows.
+    idx = table.columns.index(column)
+    new_types = list(table.types)
+    new_types[idx] = typing.get_type_hints(rowfunc).get('return', str)
+    arrays = list(table.rows.arrays)
+    if isinstance(mapfunc, numpy.ufunc) and arrays[idx].dtype != object:
+        arrays[idx] = mapfunc(arrays[idx])
+    else:
+        arrays[idx] = _make_array(list(map(mapfunc, arrays[idx].tolist())))
+    return Table(table.columns, new_types, Columns(arrays))
 
 
 def delete(table: Table, columns: List[str]) -> Table:
@@ -230,6 +392,9 @@ def delete(table: Table, columns: List[str]) -> Table:
                if column not in columns]
     columns = [table.columns[idx] for idx in indexes]
     types = [table.types[idx] for idx in indexes]
+    if _is_columnar(table):
+        return Table(columns, types,
+                     Columns([table.rows.arrays[idx] for idx in indexes]))
     return Table(columns, types,
                  [[row[idx] for idx in indexes]
                   for row in table.rows])
@@ -238,12 +403,16 @@ def delete(table: Table, columns: List[str]) -> Table:
 def values(table: Table, column: str):
     """Get a column's list of values."""
     idx = table.columns.index(column)
+    if _is_columnar(table):
+        return table.rows.arrays[idx].tolist()
     return [row[idx] for row in table.rows]
 
 
 def itervalues(table: Table, column: str):
     """Get a column's iterator of values."""
     idx = table.columns.index(column)
+    if _is_columnar(table):
+        return iter(table.rows.arrays[idx].tolist())
     return (row[idx] for row in table.rows)
 
 
@@ -251,11 +420,15 @@ def array(table: Table, column: str):
     """Get a NumPy array of a column's values."""
     rows = table.rows
     if not rows:
-        return numpy.empty()
-    else:
-        idx = table.columns.index(column)
-        return numpy.fromiter((row[idx] for row in rows),
-                              type(rows[0][idx]), len(rows))
+        return numpy.empty(0)
+    idx = table.columns.index(column)
+    if _is_columnar(table):
+        arr = rows.arrays[idx]
+        if arr.dtype != object:
+            return arr
+        return numpy.fromiter(arr, type(arr[0]), len(arr))
+    return numpy.fromiter((row[idx] for row in rows),
+                          type(rows[0][idx]), len(rows))
 
 
 # pylint: disable=unused-argument
@@ -264,12 +437,126 @@ def coltype(*args, **kw):
     raise NotImplementedError
 
 
-# pylint: disable=unused-argument
-def index(table: Table, column: str) -> Dict:
-    """Create a unique mapping from the contents of a column."""
-    idx = table.columns.index(column)
-    return {row[idx]: row
-            for row in table.rows}
+class UniqueIndex(collections.abc.Mapping):
+    """A hash index of the rows of a table by unique key values.
+    This is a mapping of key to row."""
+
+    def __init__(self, rows: Rows, keys: List[Any]):
+        self.rows = rows
+        self.positions = {}
+        for pos, key in enumerate(keys):
+            if self.positions.setdefault(key, pos) != pos:
+                raise ValueError("Duplicate key in unique index: {!r}".format(key))
+
+    def __getitem__(self, key):
+        return self.rows[self.positions[key]]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class LastIndex(UniqueIndex):
+    """A hash index of the rows of a table by key values, which keeps the last
+    row of duplicate keys, like a dict of the rows would. This is a mapping of
+    key to row."""
+
+    def __init__(self, rows: Rows, keys: List[Any]):
+        # pylint: disable=super-init-not-called
+        self.rows = rows
+        self.positions = dict(zip(keys, range(len(keys))))
+
+
+class MultiIndex(collections.abc.Mapping):
+    """A hash index of the rows of a table by key values, allowing duplicates.
+    This is a mapping of key to the list of rows with that key."""
+
+    def __init__(self, rows: Rows, keys: List[Any]):
+        self.rows = rows
+        self.positions = collections.defaultdict(list)
+        for pos, key in enumerate(keys):
+            self.positions[key].append(pos)
+        self.positions.default_factory = None
+
+    def __getitem__(self, key):
+        return [self.rows[pos] for pos in self.positions[key]]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get(self, key, default=()):
+        return self[key] if key in self.positions else default
+
+
+class SortedIndex:
+    """An index of the rows of a table sorted by key values, for range queries.
+    Duplicate keys are allowed."""
+
+    def __init__(self, rows: Rows, keys: List[Any]):
+        self.rows = rows
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[pos] for pos in order]
+        self.positions = order
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, key) -> List[tuple]:
+        """Get the list of rows with the given key."""
+        return self.range(key, key, inclusive=True)
+
+    def range(self, low=None, high=None, inclusive: bool = False) -> List[tuple]:
+        """Get the rows with keys in [low, high), or [low, high] if 'inclusive' is
+        set, in order of key. Either bound may be None for an open range."""
+        start = 0 if low is None else bisect.bisect_left(self.keys, low)
+        if high is None:
+            end = len(self.keys)
+        else:
+            end = (bisect.bisect_right if inclusive else bisect.bisect_left)(self.keys, high)
+        return [self.rows[pos] for pos in self.positions[start:end]]
+
+
+# The types of indexes available, by kind.
+INDEXES = {
+    'last': LastIndex,
+    'unique': UniqueIndex,
+    'multi': MultiIndex,
+    'sorted': SortedIndex,
+}
+
+
+def index(table: Table, column: Union[str, Sequence[str]],
+          kind: str = 'last') -> Union[UniqueIndex, MultiIndex, SortedIndex]:
+    """Get an index of the rows from the contents of one or more columns.
+
+    'kind' selects the type of index (see INDEXES): 'last' for a mapping of key
+    to the last row with that key; 'unique' for a mapping of key to row, which
+    fails on duplicate keys; 'multi' for a mapping of key to the list of rows
+    with that key; 'sorted' for range queries. If 'column' is a sequence of
+    column names, the keys are tuples of their values. Indexes are built on
+    first use and kept on the table; since tables aren't modified, tables
+    derived from it build their own.
+    """
+    if not isinstance(column, str):
+        column = tuple(column)
+    indexes = vars(table).setdefault('_indexes', {})
+    try:
+        return indexes[(column, kind)]
+    except KeyError:
+        pass
+    if kind not in INDEXES:
+        raise ValueError("Invalid index kind: {}".format(kind))
+    if isinstance(column, str):
+        keys = values(table, column)
+    else:
+        keys = list(zip(*[values(table, col) for col in column]))
+    indexes[(column, kind)] = tblindex = INDEXES[kind](table.rows, keys)
+    return tblindex
 
 
 def rename(table: Table, *namepairs: Tuple[Tuple[str]]) -> Table:
@@ -291,7 +578,12 @@ def iterate(table: Table):
 # pylint: disable=redefined-builtin
 def filter(table: Table, predicate: Callable) -> Table:
     """Filter the rows of a table."""
-    rows = [row for row in table.rows if predicate(row)]
+    if _is_columnar(table):
+        mask = numpy.fromiter(map(bool, map(predicate, table.rows)),
+                              bool, len(table.rows))
+        rows = Columns([arr[mask] for arr in table.rows.arrays])
+    else:
+        rows = [row for row in table.rows if predicate(row)]
     return table.__class__(table.columns, table.types, rows)
 
 
@@ -304,51 +596,200 @@ def _get_group_column(table: Table, key: Union[Callable, str]):
         assert isinstance(key, tuple)
     names = []
     types = []
-    funcs = []
     for part in key:
         if isinstance(part, str):
-            func = lambda row, k=part: getattr(row, k)
             type = table.types[table.columns.index(part)]
             name = part
         else:
             assert isinstance(part, Callable)
-            func = part
-            hints = typing.get_type_hints(func)
+            hints = typing.get_type_hints(part)
             type = hints.get('return', str)
-            name = func.__name__
+            name = part.__name__
         names.append(name)
         types.append(type)
-        funcs.append(func)
-    return names, types, funcs
+    return names, types, list(key)
+
+
+def _column_array(table: Table, part: Union[Callable, str]) -> numpy.ndarray:
+    """Get the array of values of a column, or of a function of each row."""
+    if isinstance(part, str):
+        if _is_columnar(table):
+            return table.rows.arrays[table.columns.index(part)]
+        return _make_array(values(table, part))
+    return _make_array([part(row) for row in table.rows])
+
+
+# The names of the aggregation functions supported by aggregate().
+AGGREGATES = ('sum', 'count', 'min', 'max', 'mean', 'first', 'wsum')
+
+# Builtin functions which have an equivalent named aggregate.
+_BUILTIN_AGGREGATES = {sum: 'sum', min: 'min', max: 'max', len: 'count'}
+
+# Bound on the combined integer codes of the keys of groups.
+_MAX_CODE = 1 << 62
+
+
+class _Groups:
+    """The assignment of rows to groups, from the values of their keys.
+
+    Group ids are assigned in order of first appearance of the keys. The rows
+    are also sorted by group once, so that each group is a contiguous run of
+    'order' starting at the corresponding offset in 'starts'.
+    """
+
+    def __init__(self, keyarrays: List[numpy.ndarray]):
+        # Encode each key column as integers and combine them in a single code.
+        # The combined codes are renumbered densely whenever combining them with
+        # the next column could overflow.
+        num = len(keyarrays[0]) if keyarrays else 0
+        codes = numpy.zeros(num, dtype=numpy.int64)
+        bound = 1
+        for arr in keyarrays:
+            values = arr.tolist()
+            lookup = {value: code for code, value in enumerate(dict.fromkeys(values))}
+            colcodes = numpy.fromiter(map(lookup.__getitem__, values), numpy.int64, num)
+            if bound * len(lookup) > _MAX_CODE:
+                uniques, codes = numpy.unique(codes, return_inverse=True)
+                codes = codes.astype(numpy.int64).reshape(num)
+                bound = len(uniques)
+            codes = codes * len(lookup) + colcodes
+            bound *= max(len(lookup), 1)
+
+        # Find the runs of identical codes and number them by first appearance.
+        order = numpy.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        newrun = numpy.ones(num, dtype=bool)
+        newrun[1:] = sorted_codes[1:] != sorted_codes[:-1]
+        runfirsts = order[newrun]
+        rank = numpy.empty(len(runfirsts), dtype=numpy.intp)
+        rank[numpy.argsort(runfirsts, kind='stable')] = numpy.arange(len(runfirsts))
+        self.gids = numpy.empty(num, dtype=numpy.intp)
+        self.gids[order] = rank[numpy.cumsum(newrun) - 1]
+        self.num = len(runfirsts)
+
+        self.order = numpy.argsort(self.gids, kind='stable')
+        self.starts = numpy.flatnonzero(numpy.diff(self.gids[self.order], prepend=-1))
+        self.firsts = self.order[self.starts]
+
+    def apply(self, func: Callable, arr: numpy.ndarray) -> List[Any]:
+        """Apply a Python function to the list of values of each group."""
+        vals = arr[self.order].tolist()
+        bounds = self.starts.tolist() + [len(vals)]
+        return [func(vals[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+    def aggregate(self, func: str, arr: numpy.ndarray,
+                  weights: numpy.ndarray = None) -> numpy.ndarray:
+        """Compute a named aggregate of the values of each group. Numerical
+        arrays are reduced with NumPy, other ones in Python."""
+        if func == 'count':
+            return numpy.bincount(self.gids, minlength=self.num)
+        if func == 'first':
+            return arr[self.firsts]
+        if func == 'wsum':
+            if arr.dtype.kind in 'fiub' and weights.dtype.kind in 'fiub':
+                return numpy.bincount(self.gids, weights=arr * weights,
+                                      minlength=self.num)
+            func, arr = 'sum', _object_array([value * weight for value, weight
+                                              in zip(arr.tolist(), weights.tolist())])
+        if arr.dtype.kind in 'fiub':
+            if func in ('sum', 'mean'):
+                if arr.dtype.kind == 'f':
+                    sums = numpy.bincount(self.gids, weights=arr, minlength=self.num)
+                else:
+                    sums = numpy.zeros(self.num, dtype=numpy.int64)
+                    numpy.add.at(sums, self.gids, arr)
+                if func == 'sum':
+                    return sums
+                return sums / numpy.bincount(self.gids, minlength=self.num)
+            if func in ('min', 'max'):
+                ufunc = numpy.minimum if func == 'min' else numpy.maximum
+                return ufunc.reduceat(arr[self.order], self.starts)
+        pyfuncs = {'sum': sum, 'min': min, 'max': max,
+                   'mean': lambda vals: sum(vals) / len(vals)}
+        if func not in pyfuncs:
+            raise ValueError("Invalid aggregate: {}".format(func))
+        return _object_array(self.apply(pyfuncs[func], arr))
+
+
+def _grouped_table(table: Table, columns: List[str], types: List[type],
+                   arrays: List[numpy.ndarray]) -> Table:
+    """Create the output table of a grouping, with the same storage as the input."""
+    if _is_columnar(table):
+        return Table(columns, types, Columns(arrays))
+    return Table(columns, types, list(zip(*[arr.tolist() for arr in arrays])))
+
+
+def _group_keys(table: Table, key: Union[Callable, str, Tuple]):
+    """Compute the groups of a table from its key columns or functions. Returns
+    the key column names, types, the groups and the key column arrays."""
+    keynames, keytypes, keyparts = _get_group_column(table, key)
+    keyarrays = [_column_array(table, part) for part in keyparts]
+    groups = _Groups(keyarrays)
+    return keynames, keytypes, groups, [arr[groups.firsts] for arr in keyarrays]
 
 
 def group(table: Table,
           key: Union[Callable, str],
           value: [Callable, str],
-          aggfunc: Callable):
-    """Group the rows of a table."""
-    keynames, keytypes, keyfuncs = _get_group_column(table, key)
-    valuenames, valuetypes, valuefuncs = _get_group_column(table, value)
-    aggregates = collections.defaultdict(list)
-    for row in table.rows:
-        key = tuple(func(row) for func in keyfuncs)
-        vals = tuple(func(row) for func in valuefuncs)
-        aggregates[key].append(vals)
-
-    columns = keynames + valuenames
-    types = keytypes + valuetypes
-    rows = []
-    for key_, valuetuples in aggregates.items():
-        valuelists = list(zip(*valuetuples))
-        for valuelist in valuelists:
-            value = aggfunc(valuelist)
-            rows.append(key_ + (value,))
-
-    return Table(columns, types, rows)
+          aggfunc: Union[Callable, str]):
+    """Group the rows of a table and aggregate the values of each group with
+    'aggfunc'. This is either the name of an aggregate (see AGGREGATES) or a
+    function of the list of values of a group. One row is produced per group."""
+    keynames, keytypes, groups, keyarrays = _group_keys(table, key)
+    valuenames, valuetypes, valueparts = _get_group_column(table, value)
+    aggname = (aggfunc if isinstance(aggfunc, str)
+               else _BUILTIN_AGGREGATES.get(aggfunc))
+    arrays = list(keyarrays)
+    for part in valueparts:
+        arr = _column_array(table, part)
+        arrays.append(groups.aggregate(aggname, arr)
+                      if aggname
+                      else _make_array(groups.apply(aggfunc, arr)))
+    return _grouped_table(table, keynames + valuenames, keytypes + valuetypes, arrays)
+
+
+def aggregate(table: Table,
+              key: Union[Callable, str, Tuple],
+              aggregates: List[Tuple[str, ...]]) -> Table:
+    """Group the rows of a table and compute several named aggregates per group
+    in one pass. Each aggregate is a tuple of (output column name, aggregate
+    name, input column), with the weights column as a fourth element for 'wsum'
+    (the weighted sum). See AGGREGATES for the list of aggregate names."""
+    keynames, keytypes, groups, keyarrays = _group_keys(table, key)
+    columns = list(keynames)
+    types = list(keytypes)
+    arrays = list(keyarrays)
+    cache = {}
+    def getarr(column):
+        if column not in cache:
+            cache[column] = _column_array(table, column)
+        return cache[column]
+    for name, func, column, *weight in aggregates:
+        if func not in AGGREGATES:
+            raise ValueError("Invalid aggregate: {}".format(func))
+        if (func == 'wsum') != bool(weight):
+            raise ValueError("A weight column is required for (only) 'wsum'")
+        weights = getarr(weight[0]) if weight else None
+        arrays.append(groups.aggregate(func, getarr(column), weights))
+        columns.append(name)
+        types.append(int if func == 'count' else
+                     float if func in ('mean', 'wsum') else
+                     table.types[table.columns.index(column)])
+    return _grouped_table(table, columns, types, arrays)
 
 
 def order(table: Table, key: Union[str, Callable], asc: bool = True) -> Table:
     """Reorder the rows of a table."""
+    if _is_columnar(table):
+        # Sort the row indexes and reorder each column array.
+        if isinstance(key, str):
+            keys = table.rows.arrays[table.columns.index(key)].tolist()
+        else:
+            keys = list(map(key, table.rows))
+        indexes = numpy.array(sorted(range(len(keys)), key=keys.__getitem__,
+                                     reverse=(not asc)), dtype=numpy.intp)
+        return Table(table.columns, table.types,
+                     Columns([arr[indexes] for arr in table.rows.arrays]))
     if isinstance(key, str):
         idx = table.columns.index(key)
         key = lambda row, i=idx: row[i]
@@ -356,10 +797,82 @@ def order(table: Table, key: Union[str, Callable], asc: bool = True) -> Table:
                  sorted(table.rows, key=key, reverse=(not asc)))
 
 
-# pylint: disable=unused-argument
-def pivot(*args, **kw):
-    """Aggregate in two dimensions."""
-    raise NotImplementedError
+Pivot = NamedTuple('Pivot', [
+    ('matrix', Any),
+    ('row_labels', List[Any]),
+    ('column_labels', List[Any]),
+])
+
+
+def _unique_columns(columns: List[str]) -> List[str]:
+    """Make the idified names of columns unique, with numeric suffixes."""
+    names = []
+    seen = set()
+    for name in idify_columns(tuple(columns)):
+        unique, suffix = name, 1
+        while unique in seen:
+            suffix += 1
+            unique = '{}_{}'.format(name, suffix)
+        seen.add(unique)
+        names.append(unique)
+    return names
+
+
+def pivot(table: Table, row: str, column: str, value: str,
+          aggfunc: str = 'sum', output: str = 'table', fill: float = 0,
+          weight: str = None) -> Union[Table, Pivot]:
+    """Aggregate in two dimensions.
+
+    The distinct values of the 'row' and 'column' columns become the rows and
+    columns of a matrix, whose cells aggregate the matching values of the 'value'
+    column with the named aggregate 'aggfunc' (see AGGREGATES; 'wsum' requires a
+    'weight' column). 'output' selects the result: 'table' for a dense Table with
+    the row labels as its first column and a column per column label (missing
+    cells set to 'fill'; labels with the same column name get numeric
+    suffixes), 'dense' for a Pivot of a NumPy array, or 'sparse' for a Pivot of
+    a SciPy CSR matrix of floats (missing cells are implicit zeros). Labels are
+    in order of first appearance.
+    """
+    if output not in ('table', 'dense', 'sparse'):
+        raise ValueError("Invalid pivot output: {}".format(output))
+    if aggfunc not in AGGREGATES:
+        raise ValueError("Invalid aggregate: {}".format(aggfunc))
+    if (aggfunc == 'wsum') != (weight is not None):
+        raise ValueError("A weight column is required for (only) 'wsum'")
+    rowarr = _column_array(table, row)
+    colarr = _column_array(table, column)
+    rowgroups = _Groups([rowarr])
+    colgroups = _Groups([colarr])
+    cells = _Groups([rowgroups.gids, colgroups.gids])
+    cellvalues = cells.aggregate(aggfunc, _column_array(table, value),
+                                 _column_array(table, weight) if weight else None)
+    cellrows = rowgroups.gids[cells.firsts]
+    cellcols = colgroups.gids[cells.firsts]
+    shape = (rowgroups.num, colgroups.num)
+    row_labels = rowarr[rowgroups.firsts].tolist()
+    column_labels = colarr[colgroups.firsts].tolist()
+
+    if output == 'sparse':
+        matrix = scipy.sparse.csr_matrix((cellvalues.astype(float), (cellrows, cellcols)),
+                                         shape=shape)
+        return Pivot(matrix, row_labels, column_labels)
+
+    try:
+        dtype = numpy.result_type(cellvalues, fill)
+    except TypeError:
+        dtype = object
+    matrix = numpy.full(shape, fill, dtype=dtype)
+    matrix[cellrows, cellcols] = cellvalues
+    if output == 'dense':
+        return Pivot(matrix, row_labels, column_labels)
+
+    valuetype = (int if aggfunc == 'count' else
+                 float if aggfunc in ('mean', 'wsum') else
+                 table.types[table.columns.index(value)])
+    columns = _unique_columns([row] + [str(label) for label in column_labels])
+    types = [table.types[table.columns.index(row)]] + [valuetype] * len(column_labels)
+    arrays = [rowarr[rowgroups.firsts]] + list(matrix.T)
+    return _grouped_table(table, columns, types, arrays)
 
 
 # pylint: disable=unused-argument
@@ -371,29 +884,191 @@ def append(*args, **kw):
 # pylint: disable=redefined-builtin
 def format(table: Table):
     """Format the table as aligned ASCII."""
+    if _is_columnar(table):
+        return pandas.DataFrame(dict(zip(table.columns, table.rows.arrays)),
+                                columns=table.columns).to_string()
     return pandas.DataFrame(table.rows, columns=table.columns).to_string()
 
 
 def head(table: Table, num: int = 8):
     """Return the first 'num' rows of the table."""
+    if _is_columnar(table):
+        return Table(table.columns, table.types,
+                     Columns([arr[:num] for arr in table.rows.arrays]))
     return Table(table.columns, table.types, table.rows[:num])
 
 
 def concat(*tables: Tuple[Table]):
     """Return the first 'num' rows of the table."""
     table1 = tables[0]
-    rows = list(table1.rows)
     for table2 in tables[1:]:
         assert table2.columns == table1.columns, (table1.columns, table2.columns)
         assert table2.types == table1.types, (table1.types, table2.types)
-        rows.extend(table2.rows)
+    if all(map(_is_columnar, tables)):
+        arrays = [numpy.concatenate(colarrays)
+                  for colarrays in zip(*[tbl.rows.arrays for tbl in tables])]
+        return Table(table1.columns, table1.types, Columns(arrays))
+    rows = []
+    for tbl in tables:
+        rows.extend(tbl.rows)
     return Table(table1.columns, table1.types, rows)
 
 
-# pylint: disable=unused-argument
-def join(*args, **kw):
-    """Left join on two tables."""
-    raise NotImplementedError
+def _key_values(table: Table, columns: List[str]) -> List[Any]:
+    """Get the list of key values of each row. Single column keys are returned as
+    plain values and multiple column keys as tuples."""
+    keycols = [values(table, column) for column in columns]
+    return keycols[0] if len(keycols) == 1 else list(zip(*keycols))
+
+
+def _hash_keys(keys: List[Any]) -> Dict[Any, List[int]]:
+    """Build a hash table of the row indexes for each key."""
+    hashed = collections.defaultdict(list)
+    for idx, key in enumerate(keys):
+        hashed[key].append(idx)
+    return hashed
+
+
+def _probe(build_keys: List[Any], probe_keys: List[Any]):
+    """Hash the build keys and probe them with the probe keys. Returns two arrays
+    of the matching (build, probe) row indexes, in probe order."""
+    unique = dict(zip(build_keys, range(len(build_keys))))
+    if len(unique) == len(build_keys):
+        # Fast path for unique keys, e.g., a lookup table.
+        found = numpy.fromiter(map(unique.get, probe_keys, itertools.repeat(-1)),
+                               numpy.intp, len(probe_keys))
+        probe_idx = numpy.flatnonzero(found >= 0)
+        return found[probe_idx], probe_idx
+    hashed = _hash_keys(build_keys)
+    build_idx, probe_idx = [], []
+    for j, key in enumerate(probe_keys):
+        matches = hashed.get(key)
+        if matches:
+            build_idx.extend(matches)
+            probe_idx.extend([j] * len(matches))
+    return (numpy.array(build_idx, dtype=numpy.intp),
+            numpy.array(probe_idx, dtype=numpy.intp))
+
+
+def _unmatched(num: int, indexes: numpy.ndarray) -> numpy.ndarray:
+    """Return the sorted row indexes under 'num' which don't appear in 'indexes'."""
+    matched = numpy.zeros(num, dtype=bool)
+    matched[indexes[indexes >= 0]] = True
+    return numpy.flatnonzero(~matched)
+
+
+def _join_indexes(lkeys: List[Any], rkeys: List[Any], how: str):
+    """Compute the pairs of matching row indexes for a hash join. The smaller
+    side is hashed and the other one probed. An index of -1 denotes a missing
+    row. Returns two arrays of indexes, ordered like the left rows, followed by
+    the unmatched right rows for outer joins."""
+    if len(rkeys) <= len(lkeys):
+        ridx, lidx = _probe(rkeys, lkeys)
+    else:
+        lidx, ridx = _probe(lkeys, rkeys)
+    if how != 'inner':
+        unmatched = _unmatched(len(lkeys), lidx)
+        lidx = numpy.concatenate([lidx, unmatched])
+        ridx = numpy.concatenate([ridx, numpy.full(len(unmatched), -1, numpy.intp)])
+    # Restore the order of the left table.
+    ordering = numpy.argsort(lidx, kind='stable')
+    lidx, ridx = lidx[ordering], ridx[ordering]
+    if how == 'outer':
+        unmatched = _unmatched(len(rkeys), ridx)
+        lidx = numpy.concatenate([lidx, numpy.full(len(unmatched), -1, numpy.intp)])
+        ridx = numpy.concatenate([ridx, unmatched])
+    return lidx, ridx
+
+
+def _take(arr: numpy.ndarray, indexes: numpy.ndarray) -> numpy.ndarray:
+    """Gather the values at the given indexes into a new column array. Missing
+    rows (at index -1) get None (or NaN in a float array)."""
+    missing = indexes < 0
+    if not missing.any():
+        return arr[indexes]
+    if not len(arr):
+        return numpy.full(len(indexes), None, dtype=object)
+    out = arr[indexes]
+    if out.dtype.kind != 'f':
+        out = out.astype(object)
+    out[missing] = numpy.nan if out.dtype.kind == 'f' else None
+    return out
+
+
+def join(table1: Table, table2: Table, on: Union[str, List[str]],
+         how: str = 'inner',
+         suffixes: Tuple[str, str] = ('_left', '_right')) -> Table:
+    """Join two tables on one or more key columns present in both, using a hash
+    table built from the smaller of the two.
+
+    'how' is one of 'inner', 'left' or 'outer'. The output has all the columns
+    of the first table followed by the non-key columns of the second; non-key
+    columns present in both get the respective suffixes appended. Rows come out
+    in the order of the first table (and for outer joins, the unmatched rows of
+    the second table come last). Values for missing rows are None, or NaN in the
+    float arrays of columnar tables. The result is columnar if any of the input
+    tables is.
+    """
+    if how not in ('inner', 'left', 'outer'):
+        raise ValueError("Invalid join type: {}".format(how))
+    on = [on] if isinstance(on, str) else list(on)
+    for column in on:
+        if column not in table1.columns or column not in table2.columns:
+            raise KeyError("Join column '{}' is missing".format(column))
+    lidx, ridx = _join_indexes(_key_values(table1, on), _key_values(table2, on), how)
+
+    # Compute the output columns, renaming the clashing ones.
+    rcolumns = [column for column in table2.columns if column not in on]
+    clashing = set(table1.columns) & set(rcolumns)
+    columns = ([column + suffixes[0] if column in clashing else column
+                for column in table1.columns] +
+               [column + suffixes[1] if column in clashing else column
+                for column in rcolumns])
+    types = (list(table1.types) +
+             [table2.types[table2.columns.index(column)] for column in rcolumns])
+
+    # Gather the values of each column.
+    def getcol(table, column):
+        if _is_columnar(table):
+            return table.rows.arrays[table.columns.index(column)]
+        return _object_array(values(table, column))
+    arrays = []
+    for column in table1.columns:
+        arr = _take(getcol(table1, column), lidx)
+        if column in on and how == 'outer':
+            # Fill in the keys of the rows only present in the second table.
+            missing = lidx < 0
+            arr = arr.astype(object) if arr.dtype.kind == 'f' else arr
+            arr[missing] = _take(getcol(table2, column), ridx[missing])
+        arrays.append(arr)
+    for column in rcolumns:
+        arrays.append(_take(getcol(table2, column), ridx))
+
+    if _is_columnar(table1) or _is_columnar(table2):
+        return Table(columns, types, Columns(arrays))
+    return Table(columns, types, list(zip(*[arr.tolist() for arr in arrays])))
+
+
+def leftjoin(table1: Table, table2: Table, on: Union[str, List[str]], **kw) -> Table:
+    """Left join on two tables. See join()."""
+    return join(table1, table2, on, how='left', **kw)
+
+
+def columnar(table: Table) -> Table:
+    """Convert a table to column-oriented storage."""
+    if _is_columnar(table):
+        return table
+    arrays = [_make_array(list(values)) for values in zip(*table.rows)]
+    if not arrays:
+        arrays = [_make_array([]) for _ in table.columns]
+    return Table(table.columns, table.types, Columns(arrays))
+
+
+def rowwise(table: Table) -> Table:
+    """Convert a table to row-oriented storage (a list of rows)."""
+    if not _is_columnar(table):
+        return table
+    return Table(table.columns, table.types, list(table.rows))
 
 
 def check(table: Table, columns: List[str]):
@@ -410,56 +1085,477 @@ def checkall(table: Table, columns: List[str]):
     return table
 
 
-##def leftjoin(main_table: Table, *col_tables: Tuple[Tuple[Tuple[str], Table]]) -> Table:
-##    """Join a table with a number of other tables.
-##    col_tables is a tuple of (column, table) pairs."""
-##
-##    new_header = list(main_table.columns)
-##    new_types = list(main_table.types)
-##    for cols, col_table in col_tables:
-##        header = list(col_table.columns)
-##        types = list(col_table.types)
-##        for col in cols:
-##            assert col in main_table.columns
-##            index = header.index(col)
-##            del header[index]
-##            del types[index]
-##        new_header.extend(header)
-##        new_types.extend(types)
-##
-##    col_maps = []
-##    for cols, col_table in col_tables:
-##        indexes_main = [main_table.columns.index(col) for col in cols]
-##        indexes_col = [col_table.columns.index(col) for col in cols]
-##        #indexes_notcol = sorted(set(range(len(col_table.columns))) - set(indexes_col))
-##        col_map = {}
-##        for row in col_table.rows:
-##            key = tuple(row[index] for index in indexes_col)
-##            col_map[key] = row
-##        assert len(col_map) == len(col_table.rows), cols
-##        col_maps.append((indexes_main, indexes_col, col_map))
-##
-##    rows = []
-##    for row in main_table.rows:
-##        row = list(row)
-##        empty_row = [None] * (len(col_table.columns) - len(indexes_col))
-##        for indexes_main, indexes_col, col_map in col_maps:
-##            key = tuple(row[index] for index in indexes_main)
-##            other_row = col_map.get(key, None)
-##            if other_row is not None:
-##                other_row = list(other_row)
-##                for index in reversed(indexes_col):
-##                    del other_row[index]
-##            else:
-##                other_row = empty_row
-##            row.extend(other_row)
-##        rows.append(row)
-##
-##    return Table(new_header, new_types, rows)
+def lazy(table: Table) -> 'LazyTable':
+    """Start a deferred chain of operations on a table."""
+    return LazyTable(table)
+
+
+_Step = NamedTuple('_Step', [('op', str), ('args', tuple)])
+_Col = NamedTuple('_Col', [('id', int), ('name', str), ('type', type)])
 
 
-def read_csv(infile: Union[str, io.TextIOBase]) -> Table:
-    """Read from a CSV file."""
+class LazyTable:
+    """A plan of deferred operations on a table.
+
+    This records a chain of select, delete, rename, map, update, create, filter
+    and order operations without running them. When the plan is collected (or
+    iterated over), steps producing values which are never used are dropped,
+    the columns which aren't needed are projected out before the first step,
+    and all the steps between two orderings are run in a single pass over the
+    rows. Only the final table is built.
+    """
+
+    def __init__(self, table: Table, steps: Tuple[_Step] = ()):
+        self.table = table
+        self.steps = steps
+
+    def _then(self, op: str, *args) -> 'LazyTable':
+        return LazyTable(self.table, self.steps + (_Step(op, args),))
+
+    # pylint: disable=missing-docstring,bad-whitespace,multiple-statements
+    def select(self, columns):         return self._then('select', list(columns))
+    def delete(self, columns):         return self._then('delete', list(columns))
+    def rename(self, *namepairs):      return self._then('rename', *namepairs)
+    def map(self, column, mapfunc):    return self._then('map', column, mapfunc)
+    def update(self, column, mapfunc): return self._then('update', column, mapfunc)
+    def create(self, column, newfunc): return self._then('create', column, newfunc)
+    def filter(self, predicate):       return self._then('filter', predicate)
+    def order(self, key, asc=True):    return self._then('order', key, asc)
+    def collect(self):                 return collect(self)
+    def __iter__(self):                return iterate(collect(self))
+
+
+def _clean_schema(schema: List[_Col]) -> List[_Col]:
+    """Idify the column names of a schema, like the Table constructor does."""
+    names = idify_columns(tuple(col.name for col in schema))
+    return [col._replace(name=name) for col, name in zip(schema, names)]
+
+
+def _plan_step(schema: List[_Col], step: _Step, newid: int) -> List[_Col]:
+    """Compute the schema resulting from a step. This mirrors the column and type
+    changes of the eager functions. New or modified columns are assigned 'newid'."""
+    names = [col.name for col in schema]
+    op, args = step
+    if op == 'select':
+        schema = [schema[names.index(column)]._replace(name=column)
+                  for column in args[0]]
+    elif op == 'delete':
+        schema = [col for col in schema if col.name not in args[0]]
+    elif op == 'rename':
+        schema = list(schema)
+        for oldname, newname in args:
+            idx = names.index(oldname)
+            schema[idx] = schema[idx]._replace(name=newname)
+    elif op in ('map', 'update'):
+        column, mapfunc = args
+        idx = names.index(column)
+        # Like map_(), which goes through an unannotated row mapper.
+        hints = typing.get_type_hints(mapfunc) if op == 'update' else {}
+        schema = list(schema)
+        schema[idx] = _Col(newid, column, hints.get('return', str))
+    elif op == 'create':
+        column, newfunc = args
+        hints = typing.get_type_hints(newfunc)
+        schema = schema + [_Col(newid, column, hints.get('return', str))]
+    else:
+        assert op in ('filter', 'order'), op
+    return _clean_schema(schema)
+
+
+def _needed_steps(plan, final_ids: set):
+    """Walk the plan backwards and drop the steps whose output columns are never
+    used downstream. Returns the kept steps and the set of column ids needed
+    from the input table."""
+    needed = set(final_ids)
+    kept = []
+    for step, inschema, outschema in reversed(plan):
+        op = step.op
+        in_ids = {col.id for col in inschema}
+        if op in ('map', 'update', 'create'):
+            newid = ({col.id for col in outschema} - in_ids).pop()
+            if newid not in needed:
+                continue
+            needed.discard(newid)
+            if op == 'map':
+                column = step.args[0]
+                needed.add(inschema[[col.name for col in inschema].index(column)].id)
+            else:
+                needed |= in_ids
+        elif op == 'filter' or (op == 'order' and not isinstance(step.args[0], str)):
+            needed |= in_ids
+        elif op == 'order':
+            needed.add(inschema[[col.name for col in inschema].index(step.args[0])].id)
+        kept.append((step, inschema, outschema))
+    kept.reverse()
+    return kept, needed
+
+
+def _project_op(indexes: List[int]) -> Callable:
+    return lambda values: [values[idx] for idx in indexes]
+
+
+def _map_op(pos: int, mapfunc: Callable) -> Callable:
+    def op(values):
+        values[pos] = mapfunc(values[pos])
+        return values
+    return op
+
+
+def _update_op(Row: type, pos: int, mapfunc: Callable) -> Callable:
+    def op(values):
+        values[pos] = mapfunc(Row._make(values))
+        return values
+    return op
+
+
+def _create_op(Row: type, newfunc: Callable) -> Callable:
+    def op(values):
+        values.append(newfunc(Row._make(values)))
+        return values
+    return op
+
+
+def _filter_op(Row: type, predicate: Callable) -> Callable:
+    return lambda values: values if predicate(Row._make(values)) else None
+
+
+def _run_ops(rows, ops: List[Callable]) -> List[List[Any]]:
+    """Run a fused sequence of row operations in a single pass."""
+    outrows = []
+    for row in rows:
+        values = list(row)
+        for op in ops:
+            values = op(values)
+            if values is None:
+                break
+        else:
+            outrows.append(values)
+    return outrows
+
+
+def collect(plan: LazyTable) -> Table:
+    """Optimize and run a plan of deferred operations, and return the table."""
+    table = plan.table
+    if all(step.op in ('select', 'delete', 'rename') for step in plan.steps):
+        # Nothing to do on the rows; the eager versions are cheap enough.
+        functions = {'select': select, 'delete': delete, 'rename': rename}
+        for step in plan.steps:
+            table = functions[step.op](table, *step.args)
+        return table
+
+    # Simulate the schema through all the steps.
+    schema = [_Col(idx, name, type_)
+              for idx, (name, type_) in enumerate(zip(table.columns, table.types))]
+    steps = []
+    for newid, step in enumerate(plan.steps, len(schema)):
+        outschema = _plan_step(schema, step, newid)
+        steps.append((step, schema, outschema))
+        schema = outschema
+    steps, needed = _needed_steps(steps, {col.id for col in schema})
+
+    # Compile the steps to operations on lists of values, projecting the unused
+    # columns out first. 'layout' tracks the column ids of the current values.
+    layout = [idx for idx in range(len(table.columns)) if idx in needed]
+    ops = []
+    if len(layout) != len(table.columns):
+        ops.append(_project_op(list(layout)))
+    rows = table.rows
+    for step, inschema, outschema in steps:
+        op = step.op
+        if op in ('select', 'delete'):
+            present = set(layout)
+            target = [col.id for col in outschema if col.id in present]
+            if target != layout:
+                ops.append(_project_op([layout.index(colid) for colid in target]))
+                layout = target
+        elif op == 'map':
+            pos = [col.name for col in inschema].index(step.args[0])
+            oldid, newid = inschema[pos].id, outschema[pos].id
+            pos = layout.index(oldid)
+            ops.append(_map_op(pos, step.args[1]))
+            layout[pos] = newid
+        elif op == 'order' and isinstance(step.args[0], str):
+            # Orderings need all the rows; run the fused operations so far. Only
+            # the key column is needed, so look it up in the current layout.
+            rows = _run_ops(rows, ops)
+            ops = []
+            key, asc = step.args
+            pos = layout.index(inschema[[col.name for col in inschema].index(key)].id)
+            rows.sort(key=lambda values, pos=pos: values[pos], reverse=(not asc))
+        elif op in ('update', 'create', 'filter', 'order'):
+            # Opaque functions of the row; all the columns are available here.
+            assert layout == [col.id for col in inschema]
+            Row = row_class(tuple(col.name for col in inschema))
+            if op == 'update':
+                pos = [col.name for col in inschema].index(step.args[0])
+                ops.append(_update_op(Row, pos, step.args[1]))
+            elif op == 'create':
+                ops.append(_create_op(Row, step.args[1]))
+            elif op == 'filter':
+                ops.append(_filter_op(Row, step.args[0]))
+            else:
+                # Orderings need all the rows; run the fused operations so far.
+                rows = _run_ops(rows, ops)
+                ops = []
+                key, asc = step.args
+                rows.sort(key=lambda values, key=key, Row=Row: key(Row._make(values)),
+                          reverse=(not asc))
+            layout = [col.id for col in outschema]
+    rows = _run_ops(rows, ops)
+
+    assert layout == [col.id for col in schema]
+    result = Table([col.name for col in schema], [col.type for col in schema], rows)
+    return columnar(result) if _is_columnar(table) else result
+
+
+def parse_int(string: str) -> Optional[int]:
+    """Parse an integer; empty strings produce None."""
+    return int(string) if string.strip() else None
+
+
+def parse_float(string: str) -> float:
+    """Parse a float; empty strings produce NaN."""
+    return float(string) if string.strip() else numpy.nan
+
+
+def parse_dollar(string: str) -> float:
+    """Parse a dollar amount, e.g. '$1,234.50', with parentheses for negative
+    amounts. Empty strings produce zero."""
+    clean = string.replace('$', '').replace(',', '').strip()
+    if clean.startswith('(') and clean.endswith(')'):
+        clean = '-' + clean[1:-1]
+    return float(clean) if clean else 0.
+
+
+def parse_percent(string: str) -> float:
+    """Parse a percentage to a fraction, e.g. '12.5%' to 0.125. Empty strings and
+    small values reported as a bound (e.g. '<0.01%') produce zero."""
+    clean = string.replace('%', '').replace(',', '').strip()
+    if not clean or clean.startswith('<'):
+        return 0.
+    return float(clean) / 100.
+
+
+_DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%d-%b-%Y', '%b %d, %Y', '%Y%m%d']
+
+
+def parse_date(string: str) -> Optional[datetime.date]:
+    """Parse a date in one of a few common formats; empty strings produce None."""
+    string = string.strip()
+    if not string:
+        return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(string, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: '{}'".format(string))
+
+
+# Column types supported by the CSV reader, as (Python type, parser) pairs.
+CONVERTERS = {
+    'str': (str, str),
+    'int': (int, parse_int),
+    'float': (float, parse_float),
+    'dollar': (float, parse_dollar),
+    'percent': (float, parse_percent),
+    'date': (datetime.date, parse_date),
+}
+
+# Python types accepted in place of the converter names.
+_TYPE_NAMES = {str: 'str', int: 'int', float: 'float', datetime.date: 'date'}
+
+# Patterns of the values of numerical columns, in order of inference. Integers
+# with leading zeros are excluded, as they're usually identifiers (e.g. CUSIPs).
+_INFER_PATTERNS = [
+    ('int', re.compile(r'-?(0|[1-9]\d*)$')),
+    ('float', re.compile(r'-?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][-+]?\d+)?$')),
+    ('percent', re.compile(r'(<|-)?(\d{1,3}(,\d{3})+|\d+)?(\.\d+)? ?%$')),
+    ('dollar', re.compile(r'\(?-?\$? ?-?(\d{1,3}(,\d{3})+|0|[1-9]\d*)?(\.\d+)?\)?$')),
+]
+
+# Default number of rows per chunk when parsing CSV files.
+_CSV_CHUNKSIZE = 10000
+
+# Wider types of the inferred types of CSV columns, for values of later chunks
+# they can't parse.
+_WIDER_TYPES = {'int': 'float'}
+
+
+def infer_type(values: List[str]) -> str:
+    """Infer the type of a column from a sample of its string values. Returns the
+    name of one of CONVERTERS. Empty values are ignored."""
+    values = [value.strip() for value in values if value.strip()]
+    if not values:
+        return 'str'
+    for name, pattern in _INFER_PATTERNS:
+        if all(pattern.match(value) and re.search(r'\d', value) for value in values):
+            return name
+    try:
+        for value in values:
+            parse_date(value)
+        return 'date'
+    except ValueError:
+        return 'str'
+
+
+def _csv_types(header: List[str], columns: List[str],
+               types: Dict[str, Union[str, type]],
+               sample: List[List[str]]) -> List[str]:
+    """Compute the converter names of the columns of a CSV file. The declared
+    types are looked up by their original or idified names. If a sample of rows
+    is provided, the types of undeclared columns are inferred from it."""
+    types = types or {}
+    unknown = set(types) - set(header) - set(columns)
+    if unknown:
+        raise ValueError("Unknown columns in types: {}".format(sorted(unknown)))
+    names = []
+    for idx, (name, column) in enumerate(zip(header, columns)):
+        spec = types.get(name, types.get(column))
+        if spec is None:
+            spec = infer_type([row[idx] for row in sample]) if sample else 'str'
+        spec = _TYPE_NAMES.get(spec, spec)
+        if spec not in CONVERTERS:
+            raise ValueError("Invalid type for column '{}': {}".format(name, spec))
+        names.append(spec)
+    return names
+
+
+def _widen_types(header: List[str], names: List[str], inferred: List[int],
+                 rows: List[List[str]]) -> List[str]:
+    """Widen the inferred types of the columns of a chunk of CSV rows which can't
+    parse some of its values, e.g. an 'int' column with a '5.5' value. Raises a
+    ValueError if no wider type parses a value."""
+    names = list(names)
+    for idx in inferred:
+        for row in rows:
+            if len(row) != len(names):
+                continue
+            while True:
+                try:
+                    CONVERTERS[names[idx]][1](row[idx])
+                    break
+                except ValueError:
+                    wider = _WIDER_TYPES.get(names[idx])
+                    if wider is None:
+                        raise ValueError(
+                            "Invalid value for column '{}' inferred as '{}': {!r}; "
+                            "declare its type instead".format(
+                                header[idx], names[idx], row[idx]))
+                    names[idx] = wider
+    return names
+
+
+def _cast_table(table: Table, types: List[type]) -> Table:
+    """Convert the integer columns of a columnar table to floats where 'types'
+    has widened them. Missing integers become NaN."""
+    if table.types == list(types):
+        return table
+    arrays = []
+    for arr, type1, type2 in zip(table.rows.arrays, table.types, types):
+        if type1 is int and type2 is float:
+            arr = numpy.array([numpy.nan if value is None else value for value in arr],
+                              dtype=numpy.float64)
+        arrays.append(arr)
+    return Table(table.columns, list(types), Columns(arrays))
+
+
+def _parse_columns(rows: List[List[str]], parsers: List[Callable],
+                   numcols: int) -> List[numpy.ndarray]:
+    """Parse a chunk of rows of strings into typed column arrays."""
+    for row in rows:
+        if len(row) != numcols:
+            raise ValueError("Invalid row length, expecting {}: {}".format(numcols, row))
+    columns = list(zip(*rows)) if rows else [()] * numcols
+    arrays = []
+    for parser, values in zip(parsers, columns):
+        if parser is str:
+            arrays.append(_object_array(list(values)))
+            continue
+        if parser is parse_float:
+            # Let NumPy parse the strings directly if they're all valid.
+            try:
+                arrays.append(numpy.array(values, dtype=numpy.float64))
+                continue
+            except ValueError:
+                pass
+        arrays.append(_make_array(list(map(parser, values))))
+    return arrays
+
+
+def iter_csv(infile: Union[str, io.TextIOBase],
+             types: Dict[str, Union[str, type]] = None,
+             infer: bool = False,
+             chunksize: int = _CSV_CHUNKSIZE) -> Iterator[Table]:
+    """Read a CSV file incrementally, as a sequence of columnar tables of at most
+    'chunksize' rows each, with typed columns.
+
+    'types' maps column names (as in the file, or idified) to either the name of
+    one of CONVERTERS or a Python type. If 'infer' is true the types of the
+    other columns are inferred from the first chunk, otherwise they are read as
+    strings. An inferred 'int' column is widened to 'float' from the first later
+    chunk which has a non-integer value in it, so the types of the tables may
+    differ; read_csv() converts the earlier ones. Other values an inferred type
+    can't parse raise a ValueError. Blank lines are skipped. At least one
+    (possibly empty) table is produced; an empty file produces a table without
+    any columns.
+    """
+    if isinstance(infile, str):
+        with open(infile) as file:
+            yield from iter_csv(file, types, infer, chunksize)
+        return
+
+    types = types or {}
+    readit = iter(csv.reader(infile))
+
+    # Skip empty lines at the beginning.
+    header = None
+    while not header:
+        header = next(readit, None)
+        if header is None:
+            yield Table([], [], Columns([]))
+            return
+    columns = list(idify_columns(tuple(header)))
+
+    names = inferred = None
+    while True:
+        chunk = list(itertools.islice(readit, chunksize))
+        rows = [row for row in chunk if row]
+        if names is None:
+            names = _csv_types(header, columns, types, rows if infer else None)
+            inferred = [idx for idx, (name, column) in enumerate(zip(header, columns))
+                        if infer and name not in types and column not in types]
+        elif not chunk:
+            break
+        try:
+            arrays = _parse_columns(rows, [CONVERTERS[name][1] for name in names],
+                                    len(columns))
+        except ValueError:
+            if not infer:
+                raise
+            names = _widen_types(header, names, inferred, rows)
+            arrays = _parse_columns(rows, [CONVERTERS[name][1] for name in names],
+                                    len(columns))
+        yield Table(columns, [CONVERTERS[name][0] for name in names], Columns(arrays))
+        if len(chunk) < chunksize:
+            break
+
+
+def read_csv(infile: Union[str, io.TextIOBase],
+             types: Dict[str, Union[str, type]] = None,
+             infer: bool = False,
+             chunksize: int = _CSV_CHUNKSIZE) -> Table:
+    """Read from a CSV file.
+
+    By default all the columns are read as strings, in a table of rows. If
+    'types' are declared or 'infer' is set, the file is instead parsed in chunks
+    straight into typed columns and a columnar table is returned. See iter_csv().
+    """
+    if types or infer:
+        tables = list(iter_csv(infile, types, infer, chunksize))
+        # The later chunks have the widest types; see iter_csv().
+        return concat(*[_cast_table(tbl, tables[-1].types) for tbl in tables])
+
     close = False
     if isinstance(infile, str):
         close = True
@@ -471,14 +1567,16 @@ def read_csv(infile: Union[str, io.TextIOBase]) -> Table:
         # Skip empty lines at the beginning.
         header = None
         while not header:
-            header = next(readit)
+            header = next(readit, None)
+            if header is None:
+                return Table([], [], [])
 
         types = [str] * len(header)
         rows = list(readit)
     finally:
         if close:
             infile.close()
-    header = list(itertools.starmap(idify, enumerate(header)))
+    header = list(idify_columns(tuple(header)))
     return Table(header, types, rows)
 
 
@@ -3,10 +3,15 @@
 __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
+import datetime
+import pickle
 import textwrap
 import io
+import math
 from decimal import Decimal as D
 
+import pytest
+
 from baskets import table
 
 
@@ -28,6 +33,15 @@ def test_constructor():
     # FIXME: TODO - check invalid sizes.
 
 
+def test_row_class_interning():
+    t = _sample_table()
+    assert t.Row is table.Table(['Name', 'currency', 'amount'], [str, str, float], []).Row
+    assert t.Row is not t.select(['name']).Row
+    nt = t.filter(lambda row: row.amount > 1).order('amount')
+    assert nt.Row is t.Row
+    assert nt.rows[0] is t.rows[2]
+
+
 def test_idify():
     assert table.idify(0, 'foo') == 'foo'
     assert table.idify(1, 'foo a') == 'foo_a'
@@ -90,3 +104,374 @@ def test_read_csv():
     assert t.columns == e.columns
     assert t.types == e.types
     assert t.rows == e.rows
+
+
+def _sample_table():
+    return table.Table(['name', 'currency', 'amount'],
+                       [str, str, float],
+                       [['Apple', 'USD', 3.0],
+                        ['Shopify', 'CAD', 1.0],
+                        ['BHP', 'AUD', 2.0]])
+
+
+def test_columnar():
+    t = _sample_table()
+    ct = t.columnar()
+    assert isinstance(ct.rows, table.Columns)
+    assert ct.rows.arrays[2].dtype == float
+    assert ct.rows.arrays[0].dtype == object
+    assert len(ct) == 3
+    assert ct.rows == t.rows
+    assert ct.rows[1] == t.rows[1]
+    assert ct.rows[1].name == 'Shopify'
+    assert list(ct) == t.rows
+    assert ct.rowwise().rows == t.rows
+    assert isinstance(ct.rowwise().rows, list)
+
+
+def test_columnar_ops():
+    t = _sample_table()
+    ct = t.columnar()
+    for func in [lambda x: x.select(['amount', 'name']),
+                 lambda x: x.delete(['currency']),
+                 lambda x: x.rename(('amount', 'value')),
+                 lambda x: x.map('amount', lambda v: v * 2),
+                 lambda x: x.update('name', lambda row: row.name.upper()),
+                 lambda x: x.create('label', lambda row: row.name + row.currency),
+                 lambda x: x.filter(lambda row: row.amount > 1),
+                 lambda x: x.order('amount'),
+                 lambda x: x.order(lambda row: row.currency, asc=False),
+                 lambda x: x.head(2),
+                 lambda x: table.concat(x, x)]:
+        expected, actual = func(t), func(ct)
+        assert isinstance(actual.rows, table.Columns)
+        assert actual.columns == expected.columns
+        assert actual.types == expected.types
+        assert actual.rows == expected.rows
+    assert ct.values('name') == t.values('name')
+    assert list(ct.array('amount')) == [3.0, 1.0, 2.0]
+
+
+def test_columnar_select_shares_arrays():
+    ct = _sample_table().columnar()
+    nt = ct.select(['amount']).rename(('amount', 'value'))
+    assert nt.rows.arrays[0] is ct.rows.arrays[2]
+    assert nt.rows[0].value == 3.0
+
+
+def test_lazy():
+    t = _sample_table()
+    calls = []
+    def double(value):
+        calls.append(value)
+        return value * 2
+    for tbl in t, t.columnar():
+        expected = (tbl
+                    .map('amount', double)
+                    .create('label', lambda row: row.name + row.currency)
+                    .rename(('label', 'tag'))
+                    .filter(lambda row: row.amount > 2)
+                    .order('tag')
+                    .delete(['currency'])
+                    .select(['tag', 'amount']))
+        plan = (tbl.lazy()
+                .map('amount', double)
+                .create('label', lambda row: row.name + row.currency)
+                .rename(('label', 'tag'))
+                .filter(lambda row: row.amount > 2)
+                .order('tag')
+                .delete(['currency'])
+                .select(['tag', 'amount']))
+        assert isinstance(plan, table.LazyTable)
+        actual = plan.collect()
+        assert actual.columns == expected.columns
+        assert actual.types == expected.types
+        assert actual.rows == expected.rows
+        assert list(plan) == expected.rows
+
+
+def test_lazy_order_then_project():
+    t = _sample_table()
+    for tbl in t, t.columnar():
+        for plan, expected in [
+                (tbl.lazy().order('name').delete(['currency']),
+                 tbl.order('name').delete(['currency'])),
+                (tbl.lazy().order('amount', asc=False).select(['name']),
+                 tbl.order('amount', asc=False).select(['name'])),
+                (tbl.lazy().filter(lambda row: row.amount > 0).order('currency')
+                 .select(['name', 'amount']),
+                 tbl.filter(lambda row: row.amount > 0).order('currency')
+                 .select(['name', 'amount']))]:
+            actual = plan.collect()
+            assert actual.columns == expected.columns
+            assert list(actual) == list(expected)
+
+
+def test_lazy_drops_unused_steps():
+    t = _sample_table()
+    calls = []
+    def double(value):
+        calls.append(value)
+        return value * 2
+    nt = (t.lazy()
+          .map('amount', double)
+          .create('label', lambda row: row.name.lower())
+          .map('name', str.upper)
+          .select(['name', 'currency'])
+          .collect())
+    assert not calls
+    assert nt.columns == ['name', 'currency']
+    assert nt.rows == list(map(nt.Row._make, [['APPLE', 'USD'],
+                                              ['SHOPIFY', 'CAD'],
+                                              ['BHP', 'AUD']]))
+
+
+def test_join():
+    holdings = table.Table(['ticker', 'amount'],
+                           [str, float],
+                           [['AAPL', 1.0],
+                            ['XOM', 2.0],
+                            ['AAPL', 3.0],
+                            ['ZZZ', 4.0]])
+    master = table.Table(['ticker', 'sector', 'amount'],
+                         [str, str, float],
+                         [['XOM', 'Energy', 10.0],
+                          ['AAPL', 'Tech', 20.0],
+                          ['MSFT', 'Tech', 30.0]])
+    for left, right in [(holdings, master),
+                        (holdings.columnar(), master),
+                        (holdings.head(2), master)]:
+        nt = left.join(right, 'ticker')
+        assert nt.columns == ['ticker', 'amount_left', 'sector', 'amount_right']
+        assert nt.types == [str, float, str, float]
+        expected = [row for row in [('AAPL', 1.0, 'Tech', 20.0),
+                                    ('XOM', 2.0, 'Energy', 10.0),
+                                    ('AAPL', 3.0, 'Tech', 20.0)]
+                    if row[:2] in list(map(tuple, left.rows))]
+        assert list(map(tuple, nt.rows)) == expected
+        assert isinstance(nt.rows, table.Columns) == isinstance(left.rows, table.Columns)
+
+    nt = holdings.leftjoin(master, ['ticker'], suffixes=('', '_master'))
+    assert nt.columns == ['ticker', 'amount', 'sector', 'amount_master']
+    assert list(map(tuple, nt.rows)) == [('AAPL', 1.0, 'Tech', 20.0),
+                                         ('XOM', 2.0, 'Energy', 10.0),
+                                         ('AAPL', 3.0, 'Tech', 20.0),
+                                         ('ZZZ', 4.0, None, None)]
+
+    nt = table.join(holdings.select(['ticker']), master.select(['ticker', 'sector']),
+                    'ticker', how='outer')
+    assert list(map(tuple, nt.rows)) == [('AAPL', 'Tech'),
+                                         ('XOM', 'Energy'),
+                                         ('AAPL', 'Tech'),
+                                         ('ZZZ', None),
+                                         ('MSFT', 'Tech')]
+
+
+def test_group():
+    t = table.Table(['ticker', 'account', 'quantity'],
+                    [str, str, float],
+                    [['VTI', 'A', 1.0],
+                     ['VEA', 'A', 2.0],
+                     ['VTI', 'B', 4.0],
+                     ['VTI', 'A', 8.0]])
+    for tbl in t, t.columnar():
+        nt = tbl.group(('ticker', 'account'), 'quantity', sum)
+        assert nt.columns == ['ticker', 'account', 'quantity']
+        assert nt.types == [str, str, float]
+        assert list(map(tuple, nt.rows)) == [('VTI', 'A', 9.0),
+                                             ('VEA', 'A', 2.0),
+                                             ('VTI', 'B', 4.0)]
+        nt = tbl.group('ticker', 'account', lambda vals: ''.join(sorted(vals)))
+        assert list(map(tuple, nt.rows)) == [('VTI', 'AAB'), ('VEA', 'A')]
+
+
+def test_group_many_keys():
+    # The product of the numbers of distinct values of the keys is over 2^64,
+    # and the naive combined codes of the first and last rows are equal.
+    num = 65537
+    t = table.Table(['a', 'b', 'c', 'd', 'v'], [str, str, str, str, float],
+                    [('a{}'.format(index), 'b{}'.format(index % 65536),
+                      'c{}'.format(index % 65536), 'd{}'.format(index % 65536), 1.0)
+                     for index in range(num)]).columnar()
+    nt = t.aggregate(('a', 'b', 'c', 'd'), [('v', 'sum', 'v')])
+    assert len(nt) == num
+    assert tuple(nt.rows[0]) == ('a0', 'b0', 'c0', 'd0', 1.0)
+    assert tuple(nt.rows[-1]) == ('a65536', 'b0', 'c0', 'd0', 1.0)
+
+
+def test_aggregate():
+    t = table.Table(['ticker', 'account', 'quantity', 'price'],
+                    [str, str, float, float],
+                    [['VTI', 'A', 1.0, 10.0],
+                     ['VEA', 'A', 2.0, 20.0],
+                     ['VTI', 'B', 4.0, 30.0],
+                     ['VTI', 'A', 8.0, 40.0]])
+    for tbl in t, t.columnar():
+        nt = tbl.aggregate('ticker', [('total', 'sum', 'quantity'),
+                                      ('num', 'count', 'quantity'),
+                                      ('low', 'min', 'price'),
+                                      ('high', 'max', 'price'),
+                                      ('avg', 'mean', 'price'),
+                                      ('account', 'first', 'account'),
+                                      ('last', 'max', 'account'),
+                                      ('value', 'wsum', 'price', 'quantity')])
+        assert nt.columns == ['ticker', 'total', 'num', 'low', 'high', 'avg',
+                              'account', 'last', 'value']
+        assert nt.types == [str, float, int, float, float, float, str, str, float]
+        assert list(map(tuple, nt.rows)) == [
+            ('VTI', 13.0, 3, 10.0, 40.0, 80/3, 'A', 'B', 450.0),
+            ('VEA', 2.0, 1, 20.0, 20.0, 20.0, 'A', 'A', 40.0)]
+
+    empty = table.Table(['ticker', 'quantity'], [str, float], []).columnar()
+    nt = empty.aggregate('ticker', [('total', 'sum', 'quantity'),
+                                    ('low', 'min', 'quantity')])
+    assert len(nt) == 0
+
+
+def test_pivot():
+    t = table.Table(['etf', 'group', 'amount'],
+                    [str, str, float],
+                    [['VTI', 'AAPL', 1.0],
+                     ['VTI', 'MSFT', 2.0],
+                     ['QQQ', 'AAPL', 4.0],
+                     ['VTI', 'AAPL', 8.0]])
+    for tbl in t, t.columnar():
+        nt = tbl.pivot('group', 'etf', 'amount')
+        assert nt.columns == ['group', 'vti', 'qqq']
+        assert nt.types == [str, float, float]
+        assert list(map(tuple, nt.rows)) == [('AAPL', 9.0, 4.0),
+                                             ('MSFT', 2.0, 0.0)]
+
+    piv = t.pivot('etf', 'group', 'amount', aggfunc='count', output='dense')
+    assert piv.row_labels == ['VTI', 'QQQ']
+    assert piv.column_labels == ['AAPL', 'MSFT']
+    assert piv.matrix.tolist() == [[2, 1], [1, 0]]
+
+    piv = t.pivot('etf', 'group', 'amount', output='sparse')
+    assert piv.matrix.shape == (2, 2)
+    assert piv.matrix.nnz == 3
+    assert piv.matrix.toarray().tolist() == [[9.0, 2.0], [4.0, 0.0]]
+
+
+def test_pivot_edge_cases():
+    t = table.Table(['etf', 'group', 'amount', 'weight'],
+                    [str, str, float, float],
+                    [['BRK.B', 'AAPL', 1, 2.0],
+                     ['BRK-B', 'AAPL', 2.5, 1.0],
+                     ['VTI', 'MSFT', 4, 0.5]])
+    with pytest.raises(ValueError):
+        t.pivot('group', 'etf', 'amount', aggfunc='wsum')
+    with pytest.raises(ValueError):
+        t.pivot('group', 'etf', 'amount', weight='weight')
+    with pytest.raises(ValueError):
+        t.pivot('group', 'etf', 'amount', aggfunc='median')
+
+    for tbl in t, t.columnar():
+        # Labels with the same column name get suffixes.
+        nt = tbl.pivot('group', 'etf', 'amount')
+        assert nt.columns == ['group', 'brk_b', 'brk_b_2', 'vti']
+        assert list(map(tuple, nt.rows)) == [('AAPL', 1, 2.5, 0),
+                                             ('MSFT', 0, 0, 4)]
+
+        piv = tbl.pivot('group', 'etf', 'amount', aggfunc='wsum', weight='weight',
+                        output='dense')
+        assert piv.matrix.tolist() == [[2.0, 2.5, 0.0], [0.0, 0.0, 2.0]]
+
+        # Mixed ints and floats make a matrix of floats.
+        piv = tbl.pivot('group', 'etf', 'amount', output='sparse')
+        assert piv.matrix.dtype == float
+        assert piv.matrix.toarray().tolist() == [[1.0, 2.5, 0.0], [0.0, 0.0, 4.0]]
+
+
+def test_read_csv_typed():
+    buf = io.StringIO(textwrap.dedent("""
+      Ticker,CUSIP,Shares,Price,Market Value,Weight,Date
+      AAPL,037833100,10,1.5,"$1,234.50",12.5%,2020-01-02
+      MSFT,594918104,20,2,$10.00,<0.01%,2020-01-03
+
+      XOM,30231G102,,3.25,($5.00),1%,
+    """))
+    t = table.read_csv(buf, infer=True, chunksize=2)
+    assert isinstance(t.rows, table.Columns)
+    assert t.columns == ['ticker', 'cusip', 'shares', 'price', 'market_value',
+                         'weight', 'date']
+    assert t.types == [str, str, int, float, float, float, datetime.date]
+    assert t.values('cusip') == ['037833100', '594918104', '30231G102']
+    assert t.values('shares') == [10, 20, None]
+    assert t.rows.arrays[3].dtype == float
+    assert t.values('price') == [1.5, 2.0, 3.25]
+    assert t.values('market_value') == [1234.5, 10.0, -5.0]
+    assert t.values('weight') == [0.125, 0.0, 0.01]
+    assert t.values('date') == [datetime.date(2020, 1, 2), datetime.date(2020, 1, 3), None]
+
+
+def test_iter_csv():
+    buf = io.StringIO("units,currency\n" + "".join(
+        "{},USD\n".format(i) for i in range(10)))
+    chunks = list(table.iter_csv(buf, types={'units': float}, chunksize=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert all(chunk.types == [float, str] for chunk in chunks)
+    assert table.concat(*chunks).values('units') == list(map(float, range(10)))
+
+    chunks = list(table.iter_csv(io.StringIO("units,currency\n"), infer=True))
+    assert len(chunks) == 1 and len(chunks[0]) == 0
+
+    # Empty files produce a single table without columns.
+    for text in "", "\n\n":
+        chunks = list(table.iter_csv(io.StringIO(text), infer=True))
+        assert len(chunks) == 1 and chunks[0].columns == [] and len(chunks[0]) == 0
+        assert table.read_csv(io.StringIO(text)).columns == []
+
+    # The inferred integers are widened to floats by later chunks.
+    text = "units,currency\n1,USD\n,USD\n5.5,CAD\n7,USD\n"
+    chunks = list(table.iter_csv(io.StringIO(text), infer=True, chunksize=2))
+    assert [chunk.types for chunk in chunks] == [[int, str], [float, str]]
+    tbl = table.read_csv(io.StringIO(text), infer=True, chunksize=2)
+    assert tbl.types == [float, str]
+    assert tbl.rows.arrays[0].dtype == float
+    assert tbl.values('units')[2:] == [5.5, 7.0]
+    assert math.isnan(tbl.values('units')[1])
+
+    # Other invalid values of the inferred types are reported.
+    with pytest.raises(ValueError, match="'units' inferred as 'float': 'n/a'"):
+        table.read_csv(io.StringIO("units\n1.5\nn/a\n"), infer=True, chunksize=1)
+    with pytest.raises(ValueError):
+        table.read_csv(io.StringIO("units\n1\n5.5\n"), types={'units': int},
+                       infer=True, chunksize=1)
+
+
+def test_index():
+    t = table.Table(['ticker', 'cusip', 'amount'],
+                    [str, str, float],
+                    [['AAPL', '037833100', 3.0],
+                     ['MSFT', '594918104', 1.0],
+                     ['AAPL', '037833100', 2.0]])
+    for tbl in t, t.columnar():
+        assert tbl.index('ticker')['AAPL'] == tbl.rows[2]
+        with pytest.raises(ValueError):
+            tbl.index('ticker', 'unique')
+        index = tbl.index('amount', 'unique')
+        assert index[2.0] == tbl.rows[2]
+        assert tbl.index('amount', 'unique') is index
+        assert tbl.filter(lambda _: True).index('amount') is not index
+
+        multi = tbl.index(('ticker', 'cusip'), 'multi')
+        assert multi[('AAPL', '037833100')] == [tbl.rows[0], tbl.rows[2]]
+        assert multi.get(('XOM', '')) == ()
+        assert len(multi) == 2
+        assert tbl.index(['ticker', 'cusip'], 'multi') is multi
+
+        srt = tbl.index('amount', 'sorted')
+        assert srt.range(1.0, 3.0) == [tbl.rows[1], tbl.rows[2]]
+        assert srt.range(2.0, inclusive=True) == [tbl.rows[2], tbl.rows[0]]
+        assert srt.lookup(3.0) == [tbl.rows[0]]
+
+
+def test_pickle_table():
+    tbl = table.Table(['ticker', 'fraction'], [str, float],
+                      [('AAPL', 0.6), ('MSFT', 0.4)])
+    for orig in tbl, tbl.columnar():
+        copy = pickle.loads(pickle.dumps(orig))
+        assert type(copy.rows) is type(orig.rows)
+        assert copy.columns == orig.columns
+        assert list(copy) == list(orig)
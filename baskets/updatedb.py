@@ -8,14 +8,30 @@ from os import path
 import argparse
 import datetime
 import logging
-import shutil
-import traceback
 
 from baskets.table import Table
 from baskets import beansupport
+from baskets import bulkfetch
 from baskets import driverlib
+from baskets import httpfetch
 from baskets import database
 from baskets import issuers
+from baskets import parsecache
+from baskets import revindex
+from baskets import scheduler
+from baskets import secmaster
+from baskets import snapshots
+
+
+# Name of the cache of HTTP validators in the database directory.
+HTTP_CACHE = '.httpcache.json'
+
+
+# Default limits on the number of concurrent downloads per issuer.
+ISSUER_LIMITS = {
+    'iShares': 1,
+    'Vanguard': 1,
+}
 
 
 def HoldingsTable(rows):
@@ -25,17 +41,6 @@ def HoldingsTable(rows):
                  rows)
 
 
-# FIXME: Remove this function and put this state as part of an object in
-# driverlib. Merge with downloads_dir attribute. The 'real' driver needs a
-# proxy. Call it something appropriate and different than 'driver'.
-def get_driver(driver, args):
-    """Get or create a new driver."""
-    driver = driver or driverlib.create_driver(args.driver_exec,
-                                               headless=not args.visible)
-    driverlib.reset(driver)
-    return driver
-
-
 def main():
     """Update the database of holdings for ETFs in the portfolio."""
     logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
@@ -52,6 +57,36 @@ def main():
                         help=("Ignore options positions "
                               "(only works with  Beancount export file)"))
 
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                        help="Number of concurrent download workers.")
+    parser.add_argument('--issuer-limit', action='append', default=[],
+                        metavar='ISSUER=N',
+                        help=("Maximum number of concurrent downloads from an issuer "
+                              "(overrides the defaults; may be repeated)."))
+
+    parser.add_argument('-u', '--skip-unchanged', action='store_true',
+                        help=("Don't store downloads whose parsed holdings are "
+                              "identical to the latest stored ones."))
+
+    parser.add_argument('--rebuild-manifest', action='store_true',
+                        help=("Reindex the files of the database tree first, taking "
+                              "the issuers of the files without a recorded issuer "
+                              "from the portfolio (see baskets-database rebuild)."))
+
+    parser.add_argument('-s', '--update-snapshots', action='store_true',
+                        help=("Append the new downloads to the columnar store of "
+                              "holdings and to the security master (see "
+                              "baskets-snapshots and baskets-secmaster)."))
+
+    parser.add_argument('--browser-only', action='store_true',
+                        help=("Always download with a browser, even for issuers "
+                              "with direct holdings URLs."))
+    parser.add_argument('--http-jobs', action='store', type=int, default=32,
+                        help="Number of concurrent plain HTTP downloads.")
+    parser.add_argument('--host-limit', action='store', type=int, default=4,
+                        help="Maximum number of concurrent HTTP downloads per host.")
+    parser.add_argument('--recycle-after', action='store', type=int, default=20,
+                        help="Number of downloads after which a browser is restarted.")
     parser.add_argument('--visible', action='store_true',
                         help="Run with a visible browser window (not headless).")
     parser.add_argument('-b', '--driver-exec', action='store',
@@ -59,34 +94,110 @@ def main():
                         help="Path to chromedriver executable.")
     args = parser.parse_args()
     db = database.Database(args.dbdir)
+    limits = dict(ISSUER_LIMITS)
+    for spec in args.issuer_limit:
+        issuer, _, limit = spec.partition('=')
+        limits[issuer] = int(limit)
+        if limits[issuer] < 1:
+            parser.error("Invalid issuer limit: {}".format(spec))
 
     # Load up the list of assets from the exported Beancount file.
     assets = beansupport.read_portfolio(args.portfolio, args.ignore_options)
 
-    # Fetch baskets for each of those.
-    driver = None
+    if args.rebuild_manifest:
+        count = database.rebuild(db, {row.ticker: row.issuer
+                                      for row in assets if row.issuer})
+        logging.info("Indexed %d files", count)
+
+    # Create a download job for each of those.
+    jobs = []
     for row in sorted(assets):
         if not row.issuer and args.ignore_missing_issuer:
             logging.warning("Ignoring missing issuer for {}".format(row.ticker))
             continue
+        if issuers.get(row.issuer) is None and not args.ignore_missing_issuer:
+            raise SystemExit("Missing issuer: {}".format(row.issuer))
+        job = scheduler.Job(row.ticker, row.issuer)
+        if job not in jobs:
+            jobs.append(job)
+
+    # Fetch all the baskets of issuers with direct holdings URLs concurrently
+    # over plain HTTP first. The ones which fail go through the browser below.
+    if not args.browser_only:
+        fetcher = httpfetch.Fetcher(path.join(db.directory, HTTP_CACHE),
+                                    pool_size=args.http_jobs)
         try:
-            driver, _ = fetch_holdings(row.ticker, row.issuer, driver, db,
-                                       args.ignore_missing_issuer, args)
-        except Exception:
-            traceback.print_exc()
+            fetched = fetch_all_holdings(jobs, db, fetcher, args.http_jobs,
+                                         args.host_limit, args.skip_unchanged)
+        finally:
+            fetcher.close()
+        jobs = [job for job in jobs if job not in fetched]
+
+    # Fetch the remaining baskets, with drivers from a shared pool.
+    pool = driverlib.DriverPool(args.driver_exec, headless=not args.visible,
+                                max_jobs=args.recycle_after)
+    try:
+        scheduler.Scheduler(args.jobs, limits).run(
+            lambda job, _: fetch_holdings(job.key, job.group, pool, db,
+                                          args.ignore_missing_issuer,
+                                          skip_unchanged=args.skip_unchanged),
+            jobs)
+    finally:
+        pool.close()
+
+    if args.update_snapshots:
+        count = snapshots.update(db, snapshots.getdir(db))
+        logging.info("Added %d files to the snapshots", count)
+        with secmaster.connect(secmaster.getfilename(db), create=True) as conn:
+            count = secmaster.update(conn, snapshots.getdir(db))
+        logging.info("Added %d files to the security master", count)
+
+    # Update the reverse index of holdings, if it is used.
+    with revindex.connect(revindex.getfilename(db)) as conn:
+        if conn is not None:
+            count = revindex.update(conn, db)
+            logging.info("Indexed %d files in the reverse index", count)
+
+
+def fetch_all_holdings(jobs, db, fetcher, limit, host_limit, skip_unchanged=False):
+    """Fetch the holdings of all the jobs whose issuer has a direct holdings URL
+    concurrently, and return the set of jobs which are done. Holdings already
+    downloaded today are skipped."""
+    today = datetime.date.today()
+    done = set()
+    downloads = {}
+    for job in jobs:
+        downloader = issuers.get(job.group)
+        if downloader is None or not httpfetch.has_url(downloader):
+            continue
+        if database.get(db, job.key, today) is not None:
+            logging.info("Skipping %s; already downloaded", job.key)
+            done.add(job)
             continue
-    if driver:
-        driver.close()
+        downloads[job] = bulkfetch.Download(
+            job.key, downloader.holdings_url(job.key),
+            database.getdir(db, job.key, today), '{}.csv'.format(job.key))
+    results = bulkfetch.fetch_all(fetcher, list(downloads.values()), limit, host_limit)
+    for job, result in zip(downloads, results):
+        if result.error is None:
+            store_holdings(db, job.key, job.group, today, result.value.filename,
+                           skip_unchanged)
+            done.add(job)
+        else:
+            logging.warning("HTTP download failed for %s; using browser", job.key)
+    return done
 
 
-def fetch_holdings(ticker, issuer, driver, db, ignore_missing_issuer, args):
-    """Fetch the holdings file."""
+def fetch_holdings(ticker, issuer, pool, db, ignore_missing_issuer,
+                   skip_unchanged=False):
+    """Fetch the holdings file with a browser. The issuers with a direct
+    holdings URL are fetched over HTTP beforehand, by fetch_all_holdings()."""
     downloader = issuers.get(issuer)
     if downloader is None:
         message = "Missing issuer: {}".format(issuer)
         if ignore_missing_issuer:
             logging.error(message)
-            return
+            return None
         else:
             raise SystemExit(message)
 
@@ -95,25 +206,44 @@ def fetch_holdings(ticker, issuer, driver, db, ignore_missing_issuer, args):
     csvfile = database.get(db, ticker, today)
     if csvfile is not None:
         logging.info("Skipping %s; already downloaded", ticker)
-        return driver, [csvfile]
+        return [csvfile]
 
     # Fetch the file.
     logging.info("Fetching holdings for %s", ticker)
-    driver = get_driver(driver, args)
-    filenames = downloader.download(driver, ticker)
-    if filenames is None:
-        logging.error("No files found for %s", ticker)
-        return driver, filenames
-
-    # Write out the downloaded file to database location.
-    csvdir = database.getdir(db, ticker, today)
-    os.makedirs(csvdir, exist_ok=True)
-    for filename in filenames:
-        dst = path.join(csvdir, path.basename(filename))
-        logging.info("Copying %s -> %s", filename, dst)
-        shutil.copyfile(filename, dst)
-
-    return driver, filenames
+    with pool.driver() as driver:
+        filenames = downloader.download(driver, ticker)
+        if filenames is None:
+            logging.error("No files found for %s", ticker)
+            return filenames
+
+        # Write out the downloaded file to database location, before the driver
+        # gets reused.
+        return [store_holdings(db, ticker, issuer, today, filename, skip_unchanged)
+                for filename in filenames]
+
+
+def store_holdings(db, ticker, issuer, date, filename, skip_unchanged=False):
+    """Store a downloaded holdings file in the database and return its stored
+    name. If 'skip_unchanged' is set and the parsed holdings are the same as the
+    latest stored ones, the file is not stored again; the latest one is recorded
+    for the date instead, as a link to the same blob, so that it isn't fetched
+    again on the next run."""
+    content = None
+    downloader = issuers.get(issuer)
+    if skip_unchanged and hasattr(downloader, 'parse'):
+        try:
+            content = parsecache.content_hash(downloader.parse(filename))
+        except Exception:  # pylint: disable=broad-except
+            logging.warning("Could not parse %s; storing it", filename, exc_info=True)
+        latest = database.getlatest_entry(db, ticker)
+        if (content is not None and latest is not None and
+                latest.content == content and latest.date < date):
+            logging.info("Holdings of %s unchanged since %s; linking them",
+                         ticker, latest.date)
+            if path.dirname(filename) == database.getdir(db, ticker, date):
+                os.remove(filename)
+            return database.store(db, ticker, date, latest.filename, issuer, content)
+    return database.store(db, ticker, date, filename, issuer, content)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,69 @@
+"""Unit tests for the update of the database of holdings.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import datetime
+import os
+import tempfile
+import types
+
+import pytest
+
+from baskets import bulkfetch
+from baskets import database
+from baskets import httpfetch
+from baskets import scheduler
+from baskets import table
+from baskets import updatedb
+
+
+# pylint: disable=missing-docstring
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield database.Database(path.join(tmpdir, 'db'))
+
+
+def test_skip_unchanged_is_not_fetched_again(db, monkeypatch):
+    downloader = types.SimpleNamespace(
+        holdings_url='http://example.com/{}.csv'.format,
+        parse=lambda filename: table.read_csv(filename))
+    monkeypatch.setattr(updatedb.issuers, 'get', lambda issuer: downloader)
+
+    fetched = []
+    def fetch_all(fetcher, downloads, limit, host_limit):
+        results = []
+        for download in downloads:
+            fetched.append(download.key)
+            os.makedirs(download.outdir, exist_ok=True)
+            filename = path.join(download.outdir, download.default_filename)
+            with open(filename, 'w') as outfile:
+                outfile.write('ticker,fraction\nAAPL,1.0\n')
+            results.append(scheduler.Result(None, httpfetch.Fetched(filename, True),
+                                            None, 0.0))
+        return results
+    monkeypatch.setattr(bulkfetch, 'fetch_all', fetch_all)
+
+    # Store the same holdings as of yesterday.
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = path.join(tmpdir, 'QQQ.csv')
+        with open(filename, 'w') as outfile:
+            outfile.write('ticker,fraction\nAAPL,1.0\n')
+        updatedb.store_holdings(db, 'QQQ', 'Invesco', yesterday, filename, True)
+
+    jobs = [scheduler.Job('QQQ', 'Invesco')]
+    for _ in range(2):
+        done = updatedb.fetch_all_holdings(jobs, db, None, 1, 1, skip_unchanged=True)
+        assert done == set(jobs)
+    assert fetched == ['QQQ']
+
+    # The unchanged file is recorded for today as a link to the same blob.
+    entries = list(database.entries(db, 'QQQ'))
+    assert [entry.date for entry in entries] == [yesterday, datetime.date.today()]
+    assert entries[0].sha256 == entries[1].sha256
+    assert path.samefile(entries[0].filename, entries[1].filename)
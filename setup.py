@@ -32,9 +32,10 @@ setup(
         'xlrd',
         'openpyxl',
         'selenium',
-        'networkx',
         'numpy',
         'pandas',
+        'scipy',
+        'pyarrow',
         'pytest',
     ]
 )